@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 
-import pdb
-from pprint import pprint
-
 import argparse
+import bisect
+import io
+import itertools
 import os
 import shutil
-import subprocess
+import sys
+import tempfile
 
+# The modules of the later stages (the ORF finder needs NumPy, the
+# search scheduler, the HMMER tables and the result cache) are imported
+# by annotate() when a stage needs them, to keep the startup cheap.
 from masterfile import Masterfile
+from masterfile.profiler import Profiler
 
 ##############################################################################################
 # Utilities Methods                                                                          #
@@ -20,6 +25,70 @@ def dir_path(path):
     else:
         raise argparse.ArgumentTypeError(f"readable_dir:{path} is not a valid path")
 
+# Hits of a contig found in the result cache, renamed after the ORFs of
+# this run (the contig ORFs being numbered from first)
+def cached_contig_hits(entry, orfs, first):
+    for index, hit in entry['hits']:
+        hit.target      = f"orf{first + index}"
+        hit.description = orfs[index].header(first + index).split(" ", 1)[1]
+        yield hit
+
+# Lines of fh, each one copied to copyfh on the way
+def copied_lines(fh, copyfh):
+    for line in fh:
+        copyfh.write(line)
+        yield line
+
+# Domain hits of each shard searched, read line by line as soon as the
+# shard is done or, piped, started (from the file it wrote, or the
+# CommandOutput, file or text of its standard output), its table copied
+# to tablefh
+def shard_hits(results, tablefh, debug=False):
+    from masterfile.hmmer_hits import iter_domtblout
+
+    for result in results:
+        if debug:
+            print(f"Shard {result.index}: {result.nsequences} ORFs, {result.length} aa searched")
+        table = result.table
+        if table is None:
+            table = open(result.output, "r")
+        elif isinstance(table, str):
+            table = io.StringIO(table)
+        with table:
+            yield from iter_domtblout(copied_lines(table, tablefh))
+
+# Pass the hits of the contigs searched through, adding each one to the
+# result cache entry of its contig (searchfirst holds the number of the
+# first ORF of each contig searched, searchentry its key and entry)
+def record_contig_hits(hits, searchfirst, searchentry):
+    for hit in hits:
+        number     = int(hit.target[3:])
+        index      = bisect.bisect_right(searchfirst, number) - 1
+        key, entry = searchentry[index]
+        entry['hits'].append((number - searchfirst[index], hit))
+        yield hit
+
+# With --pipeline: search the records with an AsyncSearchPipeline and
+# attach the hits of each shard as they're read from the standard
+# output of its search, while the next records are produced. recorder
+# is the (searchfirst, searchentry) of record_contig_hits, None without
+# result cache. Returns the number of hits attached.
+async def pipeline_hits(pipeline, records, annotated, tablefh, debug, profiler, recorder):
+    from masterfile.hmmer_hits import attach_hits, iter_domtblout
+
+    nhits = 0
+    async for result in pipeline.run(records):
+        if debug:
+            print(f"Shard {result.index}: {result.nsequences} ORFs, {result.length} aa searched")
+        async for lines in result.table.batches():
+            with profiler.stage('attach hits'):
+                hits = iter_domtblout(copied_lines(lines, tablefh))
+                if recorder:
+                    hits = record_contig_hits(hits, *recorder)
+                for contig, annot in attach_hits(hits, annotated):
+                    nhits += 1
+    return nhits
+
 ##############################################################################################
 # Set up the command line arguments                                                          #
 ##############################################################################################
@@ -31,11 +100,29 @@ parser = argparse.ArgumentParser(
     formatter_class=argparse.RawTextHelpFormatter
 )
 
-parser.add_argument('masterfile', help='The masterfile to be annotated.')
+parser.add_argument('masterfile',
+                    nargs='*',
+                    help="""The masterfile(s) to be annotated, plain text or gzip/xz/zstd compressed.
+Several masterfiles are annotated one after the other in the same process, or by a
+pool of processes with --batch.""")
+
+parser.add_argument('--manifest',
+                    metavar='FILE',
+                    help="""File listing masterfiles to annotate, one per line (blank lines and
+lines starting with '#' are ignored), after the ones given as arguments.""")
+
+parser.add_argument('--batch',
+                    type=int,
+                    nargs='?',
+                    const=0,
+                    metavar='N',
+                    help="""Annotate the masterfiles in a pool of N processes (the number of CPUs
+without N), each one in its own temporary directory. The exit status is 1
+when any of them failed.""")
 parser.add_argument('-g', '--genetic',
                     type=int,
                     default=1,
-                    choices=[1, 2, 3, 4, 4, 6, 9, 10, 11, 12, 13, 14, 15, 16, 21, 22, 23],
+                    choices=[1, 2, 3, 4, 5, 6, 9, 10, 11, 12, 13, 14, 15, 16, 21, 22, 23, 24, 25],
                     help="""Genetic code used.
 ---------------------------------
 1 =>  Standard (default)
@@ -54,12 +141,75 @@ parser.add_argument('-g', '--genetic',
 16 => Chlorophycean Mitochondrial               TAG=Leu(L)
 21 => Trematode Mitochondrial                   TGA=Trp(W),ATA=Met(M),AGA=Ser(S),AGG=Ser(S)
 22 => Scenedesmus Obliquus Mitochondrial        TCA=Stop(*),TAG=Leu(L)
-23 => Thraustochytrium Mitochondrial            TTA=Stop(*)""")
+23 => Thraustochytrium Mitochondrial            TTA=Stop(*)
+24 => Pterobranchia Mitochondrial               AGA=Ser(S),AGG=Lys(K),TGA=Trp(W)
+25 => Candidate Division SR1 and Gracilibacteria TGA=Gly(G)""")
+
+parser.add_argument('-T', '--tmpdir',
+                    type=dir_path,
+                    help="""Directory in which the temporary directory is created, only used
+when files are written (--debug or --tmpfs).""")
+
+parser.add_argument('--tmpfs',
+                    action='store_true',
+                    help="""Write the intermediate files in a temporary directory on tmpfs
+(/dev/shm) instead of piping the data between the steps.""")
+
+parser.add_argument('--profiles', help='HMM profile library searched against the ORFs (hmmsearch).')
+
+parser.add_argument('-j', '--jobs',
+                    type=int,
+                    default=1,
+                    help="""Number of hmmsearch runs in parallel, the ORFs are split in as many
+shards of about the same total length.""")
+
+parser.add_argument('--pipeline',
+                    action='store_true',
+                    help="""Search the ORFs while the masterfile is still being parsed, cleaned and
+translated: the ORFs are cut in shards of --shard-length aa as they come, up to
+--jobs hmmsearch runs at a time, and the hits of each shard are attached as
+soon as it's searched.""")
+
+parser.add_argument('--shard-length',
+                    type=int,
+                    default=1000000,
+                    metavar='AA',
+                    help='Size of the shards searched with --pipeline, in amino acids.')
+
+parser.add_argument('--result-cache',
+                    metavar='DIR',
+                    help="""Directory of a cache of the ORFs and hits of each contig, keyed by
+its sequence, genetic code, --minorflen, --eslstrand and profile library:
+the contigs found there are neither translated nor searched again.""")
+
+parser.add_argument('--result-cache-size',
+                    type=int,
+                    default=1024,
+                    metavar='MB',
+                    help='Size of the result cache, the least recently used entries are evicted.')
 
-parser.add_argument('-T', '--tmpdir',type=dir_path, help='Temporary directory to be used.')
+parser.add_argument('--cache',
+                    nargs='?',
+                    const=True,
+                    metavar='DIR',
+                    help="""Load the parsed masterfile from a binary cache, written next to it
+(or in DIR) on the first run and rebuilt whenever the masterfile changes.""")
 
 parser.add_argument('-d', '--debug', action='store_true', help='Print debugging information.')
 
+parser.add_argument('--profile',
+                    metavar='FILE',
+                    help="""Write a JSON report of the run to FILE ('-' for the standard output):
+wall clock and CPU time of each stage (parse, clean, write, orfs, search...),
+counters (lines, contigs, annotations, ORFs, hits, bytes written) and peak RSS.
+With several masterfiles, the report of the Nth one goes to FILE.N (and its
+cProfile statistics to DIR/N/).""")
+
+parser.add_argument('--cprofile',
+                    metavar='DIR',
+                    help="""With --profile, also run each stage under cProfile and dump its
+statistics to DIR/<stage>.prof.""")
+
 parser.add_argument('--minorflen',
                     type=int,
                     default=40,
@@ -71,64 +221,340 @@ parser.add_argument('--eslstrand',
                     choices=['watson', 'crick'],
                     help="""The strand of the sequence.""")
 
-args = parser.parse_args()
+
 
 ##############################################################################################
-# Should run before any step                                                                 #
+# Annotate a masterfile                                                                      #
 ##############################################################################################
 
-#--------------------------------#
-# Create the temporary directory #
-#--------------------------------#
+# Options of annotate(): the defaults of the command line, updated with
+# overrides (e.g. default_options(profiles='lib.hmm', jobs=4))
+def default_options(**overrides):
+    options = parser.parse_args([])
+    for name, value in overrides.items():
+        if not hasattr(options, name):
+            raise TypeError(f"Unknown option '{name}'")
+        setattr(options, name, value)
+    return options
+
+# Annotate one masterfile with options (an argparse.Namespace as given
+# by default_options() or the command line, or a dict of overrides of
+# the defaults). Returns a Masterfile holding the cleaned contigs, with
+# the hits attached when options.profiles is set. With keep=False the
+# cleaned contigs are only kept when the hits are to be attached, so
+# that memory stays bounded by the largest contig.
+def annotate(masterfile, options=None, keep=True):
+    if options is None:
+        options = default_options()
+    elif isinstance(options, dict):
+        options = default_options(**options)
+
+    # Disabled (and close to free) without --profile
+    profiler = Profiler(enabled=bool(options.profile), cprofiledir=options.cprofile)
+
+    ##########################################################################################
+    # Should run before any step                                                             #
+    ##########################################################################################
+
+    #--------------------------------#
+    # Create the temporary directory #
+    #--------------------------------#
 
-# If args.tmpdir is not None, then set TMPDIR to args.tmpdir
-TMPDIR = None
-if args.tmpdir:
-    TMPDIR = args.tmpdir
-else:
-    TMPDIR = f"/tmp/HMMannot.{os.getpid()}"
-if args.debug:
-    print(f"TMPDIR: {TMPDIR}\n")
-os.mkdir(TMPDIR, 0o700)
+    # The steps exchange their data in memory and through pipes. The
+    # intermediate files (Masterfile_copy, contigs.fna, orfs.faa, the
+    # search shards and tables) are only written with --debug, which
+    # keeps them, or --tmpfs, in a temporary directory of their own
+    # created in --tmpdir, on /dev/shm with --tmpfs, else in /tmp.
+    TMPDIR = None
+    if options.debug or options.tmpfs:
+        tmpbase = options.tmpdir
+        if tmpbase is None and options.tmpfs and os.path.isdir("/dev/shm"):
+            tmpbase = "/dev/shm"
+        TMPDIR = tempfile.mkdtemp(prefix="HMMannot.", dir=tmpbase)
+    if options.debug:
+        print(f"TMPDIR: {TMPDIR}\n")
 
-#---------------------#
-# Read the masterfile #
-#---------------------#
+    try:
+        pirmaster, annotated, resultcache = annotate_steps(masterfile, options, keep, profiler, TMPDIR)
+    finally:
+        # Remove the temporary directory
+        # if not in debug mode
+        if TMPDIR and not options.debug:
+            shutil.rmtree(TMPDIR)
 
-pirmaster = Masterfile()
-pirmaster.object_from_masterfile(args.masterfile)
-pirmaster.clean_pirmaster(TMPDIR)
+    # Write the profiling report
+    if options.profile:
+        profiler.add_counts(pirmaster.linecounts, "lines ")
+        profiler.add_counts(pirmaster.stats)
+        profiler.count('contigs cleaned', len(pirmaster.cleanstats))
+        profiler.count('annotations dropped', sum(stats['dropped'] for stats in pirmaster.cleanstats))
+        profiler.count('annotations rewritten', sum(stats['rewritten'] for stats in pirmaster.cleanstats))
+        if resultcache:
+            profiler.add_counts(resultcache.stats(), "result cache ")
+        profiler.write(options.profile, command=sys.argv, masterfile=masterfile)
 
-#-----------------------------#
-# Create the raw contigs file #
-#-----------------------------#
+    return annotated
 
-raw_contigs_file = f"{TMPDIR}/contigs.fna"
-# Write the contigs to a file
-contigs   = pirmaster.contigs
-for contig in contigs:
-    contigname = contig.name
-    seq        = contig.sequence
-    with open(raw_contigs_file, "w") as ofh:
-        ofh.write(f">{contigname}\n{seq}\n\n")
+# The steps of annotate(), writing their intermediate files to TMPDIR
+# when it's set. Returns the Masterfile parsed, the annotated one and
+# the result cache (or None).
+def annotate_steps(masterfile, options, keep, profiler, TMPDIR):
+    from masterfile.masterfile import file_digest
+    from masterfile.orf_finder import CODON_TABLES, ORF_FINDER_VERSION, Orf, contig_orfs, orf_records, orfs_to_fh
+    from masterfile.result_cache import ResultCache, sequence_digest
 
-ofh.close()
+    #------------------------------------------------------------#
+    # Read and clean the masterfile, create the raw contigs file #
+    #------------------------------------------------------------#
+
+    # The contigs are parsed, cleaned and translated one at a time, so
+    # memory stays bounded by the largest contig rather than by the whole
+    # masterfile (the cleaned contigs are only kept when their hits are to
+    # be attached, or with keep). With --cache the whole masterfile is
+    # loaded from (or saved to) its binary cache.
+    pirmaster          = Masterfile()
+    pirmaster.profiler = profiler
+    if options.cache:
+        contigs      = pirmaster.object_from_masterfile(masterfile, cache=options.cache).contigs
+    else:
+        contigs      = pirmaster.iter_contigs(masterfile)
+    raw_contigs_file = f"{TMPDIR}/contigs.fna" if TMPDIR else os.devnull
+
+    # The ORFs are found in the same pass, in place of esl-translate: each
+    # contig is translated with the code of its /trans= comment if it has
+    # one, else with --genetic, and the ORFs are numbered across contigs.
+    # A contig whose /trans= code has no translation table (see
+    # orf_finder.GENETIC_CODES) is kept but not translated, with a warning.
+    # The ORFs to search are kept as (name, protein) records. With
+    # --result-cache, the ORFs (and hits) of the contigs already seen come
+    # from the cache and only the ORFs of the other contigs are searched.
+    orfs_file  = f"{TMPDIR}/orfs.faa" if TMPDIR else os.devnull
+    orfnumber  = 1
+    cleaned    = []    # cleaned contigs, to attach the hits to
+
+    resultcache  = ResultCache(options.result_cache, options.result_cache_size << 20) if options.result_cache else None
+    profileshash = file_digest(options.profiles) if options.profiles else None
+    cachedhits   = []  # hits of the cached contigs
+    searchfirst  = []  # number of the first ORF of each contig searched...
+    searchentry  = []  # ...with its cache key and entry, completed once searched
+
+    annotated              = Masterfile()
+    annotated.header       = pirmaster.header
+    annotated.comment      = pirmaster.comment
+    annotated.contigs      = cleaned
+    annotated.contigbyname = {}  # filled as the contigs are cleaned, hits may come before the last one
+    nsearched              = 0
+
+    # The ORF records to search, produced as the contigs are parsed,
+    # cleaned and translated one at a time
+    def translate_contigs(ofh, orfsfh):
+        nonlocal orfnumber, nsearched
+        for contig in pirmaster.iter_clean_pirmaster(TMPDIR, contigs):
+            contigname = contig.name
+            seq        = contig.sequence
+            if TMPDIR:
+                ofh.write(f">{contigname}\n{seq}\n\n")
+            if options.profiles or keep:
+                cleaned.append(contig)
+                annotated.contigbyname[contigname] = contig
+
+            genetic = contig.genetic_code or options.genetic
+            if genetic not in CODON_TABLES:
+                header = pirmaster.cleanstats[-1]['header']
+                print(f"HMMannot: {masterfile}: {contigname} ({header}): no translation table for genetic code {genetic}, its ORFs are not searched", file=sys.stderr)
+                profiler.count('contigs not translated')
+                continue
+
+            entry = None
+            if resultcache:
+                with profiler.stage('result cache'):
+                    key     = ResultCache.key(sequence_digest(seq), genetic, options.minorflen, options.eslstrand, profileshash, ORF_FINDER_VERSION)
+                    entry   = resultcache.get(key)
+
+            if entry:
+                orfs = [Orf(contigname, start, end, frame, protein) for start, end, frame, protein in entry['orfs']]
+            else:
+                with profiler.stage('orfs'):
+                    orfs = contig_orfs(contig, options.genetic, options.minorflen, options.eslstrand)
+                profiler.count('orfs found', len(orfs))
+
+            first     = orfnumber
+            orfnumber = first + len(orfs)
+            if TMPDIR:
+                with profiler.stage('write'):
+                    orfs_to_fh(orfs, orfsfh, first)
+
+            if entry:
+                if options.profiles:
+                    cachedhits.extend(cached_contig_hits(entry, orfs, first))
+                continue
+            if resultcache:
+                entry = {
+                    'orfs': [(orf.start, orf.end, orf.frame, orf.protein) for orf in orfs],
+                    'hits': [] if options.profiles else None,
+                }
+                if options.profiles:
+                    searchfirst.append(first)
+                    searchentry.append((key, entry))
+                else:
+                    with profiler.stage('result cache'):
+                        resultcache.put(key, entry)
+            if options.profiles:
+                nsearched += len(orfs)
+                yield from orf_records(orfs, first)
+
+    ##########################################################################################
+    # Main steps                                                                             #
+    ##########################################################################################
+
+
+    #----------------------------------------#
+    # Search the ORFs with the HMM profiles  #
+    #----------------------------------------#
+
+    # The ORFs are split in --jobs shards searched concurrently, piped to
+    # hmmsearch (or written to TMPDIR). The domain tables of the shards are
+    # read in shard order, and only written to TMPDIR/orfs.domtblout.
+    #
+    # With --pipeline, the ORFs are cut in shards of --shard-length aa as
+    # they are translated and the shards are searched (always piped)
+    # while the next contigs are parsed, cleaned and translated.
+    #
+    #-------------------------------------------#
+    # Turn the hits into contig annotations     #
+    #-------------------------------------------#
+    #
+    # The domain hits are attached to the cleaned contigs as they are
+    # read. The hits of the contigs searched are stored in the result
+    # cache.
+    command        = ['hmmsearch', '--cpu', '1', '--noali', '-o', os.devnull, '--domtblout', '{output}', options.profiles, '{input}']
+    domtblout_file = f"{TMPDIR}/orfs.domtblout" if TMPDIR and options.profiles else os.devnull
+    recorder       = (searchfirst, searchentry) if resultcache else None
+    nhits          = 0
+    with open(raw_contigs_file, "w") as ofh, open(orfs_file, "w") as orfsfh, open(domtblout_file, "w") as tablefh:
+        records = translate_contigs(ofh, orfsfh)
+        if not options.profiles:
+            for record in records:
+                pass
+        elif options.pipeline:
+            import asyncio
+            from masterfile.async_pipeline import AsyncSearchPipeline
+            from masterfile.hmmer_hits import attach_hits
+
+            pipeline = AsyncSearchPipeline(command, workers=options.jobs, shard_length=options.shard_length)
+            nhits    = asyncio.run(pipeline_hits(pipeline, records, annotated, tablefh, options.debug, profiler, recorder))
+            for contig, annot in profiler.timed('attach hits', attach_hits(cachedhits, annotated)):
+                nhits += 1
+        else:
+            from masterfile.search_scheduler import SearchScheduler
+            from masterfile.hmmer_hits import attach_hits
+
+            searchorfs    = list(records)
+            scheduler     = SearchScheduler(command, workers=options.jobs, tmpdir=TMPDIR, prefix="orfs")
+            searchresults = profiler.timed('search', scheduler.run(searchorfs))
+            searchorfs    = None
+
+            newhits = profiler.timed('read hits', shard_hits(searchresults, tablefh, options.debug))
+            if recorder:
+                newhits = record_contig_hits(newhits, *recorder)
+            for contig, annot in profiler.timed('attach hits', attach_hits(itertools.chain(cachedhits, newhits), annotated)):
+                nhits += 1
+
+    profiler.count('orfs', orfnumber - 1)
+    profiler.count('orfs searched', nsearched)
+    if options.debug:
+        for stats in pirmaster.cleanstats:
+            print(f"{stats['contig']} ({stats['header']}): {stats['dropped']} annotations dropped, {stats['rewritten']} rewritten")
+        print(f"{orfnumber - 1} ORFs of at least {options.minorflen} aa written to {orfs_file}")
+
+    if options.profiles:
+        if resultcache:
+            with profiler.stage('result cache'):
+                for key, entry in searchentry:
+                    resultcache.put(key, entry)
+        profiler.count('hits attached', nhits)
+        if options.debug:
+            print(f"{nhits} hits attached")
+
+    if resultcache and options.debug:
+        print("Result cache: " + ", ".join(f"{name} {value}" for name, value in resultcache.stats().items()))
+
+    return pirmaster, annotated, resultcache
 
 
 ##############################################################################################
-# Main steps                                                                                 #
+# Batch mode                                                                                 #
 ##############################################################################################
 
+# Masterfiles listed in a manifest, one per line
+def read_manifest(filename):
+    with open(filename, 'r') as fh:
+        return [line.strip() for line in fh if line.strip() and not line.lstrip().startswith('#')]
+
+# Options of the Nth masterfile of a run over several ones: its profile
+# report goes to FILE.N, its cProfile statistics to DIR/N
+def file_options(options, number):
+    if not options.profile or options.profile == '-':
+        return options
+    options         = argparse.Namespace(**vars(options))
+    options.profile = f"{options.profile}.{number}"
+    if options.cprofile:
+        options.cprofile = os.path.join(options.cprofile, str(number))
+    return options
 
-# TODO
+# Worker of the batch mode: annotate one masterfile without keeping its
+# contigs (they'd be sent back to the parent process). Returns the
+# masterfile and None, or the error message when it failed.
+def annotate_file(masterfile, options):
+    try:
+        annotate(masterfile, options, keep=False)
+    except Exception as error:
+        return masterfile, f"{type(error).__name__}: {error}"
+    return masterfile, None
+
+# Annotate the masterfiles one after the other (workers None) or in a
+# pool of processes, reporting the failures on the standard error.
+# Returns the number of masterfiles that failed.
+def annotate_files(masterfiles, options, workers=None):
+    jobs = [(masterfile, file_options(options, number)) for number, masterfile in enumerate(masterfiles, 1)]
+    if workers is None:
+        results = (annotate_file(masterfile, fileoptions) for masterfile, fileoptions in jobs)
+        return report_failures(results)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(annotate_file, masterfile, fileoptions) for masterfile, fileoptions in jobs]
+        return report_failures(future.result() for future in futures)
+
+def report_failures(results):
+    failed = 0
+    for masterfile, error in results:
+        if error is not None:
+            failed += 1
+            print(f"HMMannot: {masterfile}: {error}", file=sys.stderr)
+    return failed
 
 
 ##############################################################################################
-# Should run after all step                                                                  #
+# Main                                                                                       #
 ##############################################################################################
 
-# Remove the temporary directory
-# if not in debug mode
-if not args.debug:
-    print(f"Removing temporary directory: {TMPDIR}\n")
-    os.rmtree(TMPDIR)
+def main(argv=None):
+    options     = parser.parse_args(argv)
+    masterfiles = list(options.masterfile)
+    if options.manifest:
+        masterfiles.extend(read_manifest(options.manifest))
+    if not masterfiles:
+        parser.error("no masterfile given")
+
+    # A single masterfile keeps its errors as they are
+    if len(masterfiles) == 1 and options.batch is None:
+        annotate(masterfiles[0], options, keep=False)
+        return 0
+
+    failed = annotate_files(masterfiles, options, options.batch)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
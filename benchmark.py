@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import io
+import json
+import lzma
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from masterfile import Masterfile
+from masterfile.masterfile import open_masterfile_input
+from masterfile.orf_finder import GENETIC_CODES, find_orfs, orfs_to_fh
+from synthetic_masterfile import write_synthetic_masterfile
+
+##############################################################################################
+# Utilities Methods                                                                          #
+##############################################################################################
+
+# Write a masterfile with a single contig of the given length, an
+# annotation line every annot_every nt (0 for none, a multiple of 60)
+# and a '!' marker every 5000 nt.
+def write_long_contig(filename, length, seed=1, annot_every=1020):
+    rand = random.Random(seed)
+    with open(filename, 'w') as fh:
+        fh.write(";; benchmark\n;; end mfannot\n\n>bench_contig\n")
+        pos = 0
+        while pos < length:
+            if annot_every and pos % annot_every == 0:
+                name     = f"orf{pos // (2 * annot_every)}"
+                startend = 'start' if pos % (2 * annot_every) == 0 else 'end'
+                fh.write(f"; G-{name} ==> {startend}\n")
+            size = min(60, length - pos)
+            seq  = "".join(rand.choice("acgtacgtacgtyn") for _ in range(size))
+            if pos % 5000 == 0:
+                seq = "!" + seq
+            fh.write(f"{pos+1:6d}  {seq}\n")
+            pos += size
+
+# Best of N wall clock times, in seconds. setup, when given, runs
+# before each call without being timed and its result is passed to func.
+def best_time(func, repeat, setup=None):
+    best = None
+    for _ in range(repeat):
+        value = setup() if setup else None
+        start = time.perf_counter()
+        func(value) if setup else func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+##############################################################################################
+# Benchmarks                                                                                 #
+##############################################################################################
+
+# Parsing a single long contig: the time per Mb should stay flat as the
+# contig grows, a quadratic sequence accumulation shows up as a time per
+# Mb growing with the length.
+def bench_long_contig(lengths, repeat, tmpdir):
+    print("object_from_masterfile, single contig")
+    print(f"{'length':>10}  {'seconds':>8}  {'s/Mb':>8}")
+    for length in lengths:
+        filename = f"{tmpdir}/long_{length}.mf"
+        write_long_contig(filename, length)
+        elapsed = best_time(lambda: Masterfile().object_from_masterfile(filename), repeat)
+        print(f"{length:10d}  {elapsed:8.3f}  {elapsed / length * 1e6:8.3f}")
+
+# Memory held by each parsed annotation (AnnotPair and its lines):
+# the parsed size of an annotated contig minus the one of the same
+# contig without any annotation, divided by the number of annotations.
+def bench_annotation_memory(count, tmpdir):
+    length   = count * 2 * 60
+    sizes    = []
+    nannots  = 0
+    for annot_every in (60, 0):
+        filename = f"{tmpdir}/annot_{annot_every}.mf"
+        write_long_contig(filename, length, annot_every=annot_every)
+        tracemalloc.start()
+        pirmaster = Masterfile().object_from_masterfile(filename)
+        sizes.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        nannots = max(nannots, len(pirmaster.contigs[0].annotations))
+        del pirmaster
+    print("object_from_masterfile, memory per annotation")
+    print(f"{nannots:10d} annotations  {(sizes[0] - sizes[1]) / nannots:8.1f} bytes each")
+
+# Loading a masterfile from its binary cache against parsing the text,
+# on a contig with an annotation line every 60 nt.
+def bench_cache(length, repeat, tmpdir):
+    filename = f"{tmpdir}/cache_{length}.mf"
+    write_long_contig(filename, length, annot_every=60)
+    parse = best_time(lambda: Masterfile().object_from_masterfile(filename), repeat)
+    Masterfile().object_from_masterfile(filename, cache=True)
+    load  = best_time(lambda: Masterfile().object_from_masterfile(filename, cache=True), repeat)
+    print("object_from_masterfile, text parse against binary cache")
+    print(f"{'length':>10}  {'parse':>8}  {'cache':>8}  {'speedup':>8}")
+    print(f"{length:10d}  {parse:8.3f}  {load:8.3f}  {parse / load:7.1f}x")
+
+# Six-frame ORF finding on a random sequence: the NumPy ORF finder
+# against a codon by codon translation in Python and, when it's in the
+# PATH, against esl-translate (whose output must be the same).
+def bench_orfs(length, minlen, repeat, tmpdir):
+    rand = random.Random(1)
+    seq  = "".join(rand.choice("acgt") for _ in range(length))
+
+    numpy_time  = best_time(lambda: find_orfs(seq, 1, minlen, source="bench"), repeat)
+    python_time = best_time(lambda: python_six_frames(seq, GENETIC_CODES[1]), 1)
+
+    print("six-frame ORF finding")
+    print(f"{'length':>10}  {'numpy':>8}  {'python':>8}  {'esl-translate':>13}")
+    esl_time = "not found"
+    esl      = shutil.which("esl-translate")
+    if esl:
+        filename = f"{tmpdir}/orfs.fna"
+        with open(filename, "w") as fh:
+            fh.write(f">bench\n{seq}\n")
+        command = [esl, "-l", str(minlen), "-c", "1", filename]
+        esl_out = None
+        def run_esl():
+            nonlocal esl_out
+            esl_out = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        esl_time = f"{best_time(run_esl, repeat):13.3f}"
+        out      = io.StringIO()
+        orfs_to_fh(find_orfs(seq, 1, minlen, source="bench"), out)
+        esl_time += "  (same output)" if out.getvalue() == esl_out else "  (OUTPUT DIFFERS)"
+    print(f"{length:10d}  {numpy_time:8.3f}  {python_time:8.3f}  {esl_time:>13}")
+
+# Reference translation of the six frames, one codon at a time
+def python_six_frames(seq, aminoacids):
+    rank    = {'t': 0, 'c': 1, 'a': 2, 'g': 3}
+    revcomp = seq[::-1].translate(str.maketrans('acgt', 'tgca'))
+    return [
+        "".join(aminoacids[16 * rank[strand[i]] + 4 * rank[strand[i+1]] + rank[strand[i+2]]] for i in range(frame, len(strand) - 2, 3))
+        for strand in (seq, revcomp) for frame in range(3)
+    ]
+
+# Name, unmarked sequence and number of annotations of each contig
+def contig_summary(pirmaster):
+    return [(contig.name, str(contig.sequence).replace('!', ''), len(contig.annotations)) for contig in pirmaster.contigs]
+
+# Peak memory allocated by func (tracemalloc), in bytes. setup is
+# handled as for best_time, its allocations are not counted.
+def peak_memory(func, setup=None):
+    value = setup() if setup else None
+    tracemalloc.start()
+    func(value) if setup else func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+# Scales of the synthetic masterfiles of the suite, as arguments of
+# write_synthetic_masterfile
+SUITE_SCALES = {
+    'small':  dict(contigs=20,  length=20000),
+    'medium': dict(contigs=100, length=50000),
+    'large':  dict(contigs=200, length=250000),
+    'huge':   dict(contigs=500, length=1000000),
+}
+
+# Parse, clean, write, splice (a write copying all the contigs but one
+# from the parsed file) and round trip (parse, write, parse again) of a
+# synthetic masterfile at each scale: best time and peak memory of each
+# stage. The round trip must keep the names, sequences and number of
+# annotations of the contigs.
+def bench_suite(scales, repeat, tmpdir):
+    results = {}
+    print("synthetic masterfile suite")
+    print(f"{'scale':>8}  {'stage':>10}  {'seconds':>8}  {'peak MB':>8}")
+    for scale in scales:
+        filename = f"{tmpdir}/suite_{scale}.mf"
+        output   = f"{tmpdir}/suite_{scale}.out.mf"
+        write_synthetic_masterfile(filename, **SUITE_SCALES[scale])
+
+        def parse():
+            return Masterfile().object_from_masterfile(filename)
+
+        # Parsed with one contig changed, to be written with splice=True
+        def parse_one_dirty():
+            pirmaster = parse()
+            pirmaster.contigs[len(pirmaster.contigs) // 2].mark_dirty()
+            return pirmaster
+
+        def roundtrip():
+            parse().object_to_masterfile(output)
+            return Masterfile().object_from_masterfile(output)
+
+        stages = {
+            'parse':     (lambda: parse(), None),
+            'clean':     (lambda pirmaster: pirmaster.clean_pirmaster(), parse),
+            'write':     (lambda pirmaster: pirmaster.object_to_masterfile(output), parse),
+            'splice':    (lambda pirmaster: pirmaster.object_to_masterfile(output, splice=True), parse_one_dirty),
+            'roundtrip': (lambda: roundtrip(), None),
+        }
+        results[scale] = {}
+        for stage, (func, setup) in stages.items():
+            seconds = best_time(func, repeat, setup)
+            peak    = peak_memory(func, setup)
+            results[scale][stage] = {'seconds': seconds, 'peak': peak}
+            print(f"{scale:>8}  {stage:>10}  {seconds:8.3f}  {peak / 1e6:8.1f}")
+
+        if contig_summary(parse()) != contig_summary(roundtrip()):
+            print(f"{scale:>8}  ROUND TRIP CHANGED THE CONTIGS")
+    return results
+
+# Write a compressed copy of a file: gzip and xz in this process, zstd
+# with the zstd command. Returns False when it can't be written.
+def compress_file(filename, output, compression):
+    if compression == 'zstd':
+        if not shutil.which('zstd'):
+            return False
+        subprocess.run(['zstd', '-q', '-f', filename, '-o', output], check=True)
+        return True
+    opener = gzip.open if compression == 'gzip' else lzma.open
+    with open(filename, 'rb') as src, opener(output, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    return True
+
+# Read every line of a masterfile, without parsing them
+def read_lines(filename, external=True):
+    with open_masterfile_input(filename, external=external) as fh:
+        for line in fh:
+            pass
+
+# Throughput of reading (decompression alone, by the external command
+# and in this process) and of parsing a synthetic masterfile, plain and
+# gzip/xz/zstd compressed, in MB of text per second. The contigs parsed
+# from a compressed copy must be the ones of the plain file.
+def bench_compressed(scale, repeat, tmpdir):
+    filename = f"{tmpdir}/compressed_{scale}.mf"
+    write_synthetic_masterfile(filename, **SUITE_SCALES[scale])
+    size     = os.path.getsize(filename) / 1e6
+    expected = contig_summary(Masterfile().object_from_masterfile(filename))
+
+    print(f"compressed input ({scale}, {size:.1f} MB of text)")
+    print(f"{'format':>8}  {'ratio':>6}  {'read MB/s':>9}  {'in-proc':>9}  {'parse MB/s':>10}")
+    for compression, suffix in ((None, ''), ('gzip', '.gz'), ('xz', '.xz'), ('zstd', '.zst')):
+        path = filename + suffix
+        if compression and not compress_file(filename, path, compression):
+            print(f"{compression:>8}  not available")
+            continue
+        ratio    = size / (os.path.getsize(path) / 1e6)
+        external = best_time(lambda: read_lines(path), repeat)
+        try:
+            inproc = f"{size / best_time(lambda: read_lines(path, external=False), repeat):9.1f}"
+        except ValueError:  # zstd without the zstandard module
+            inproc = f"{'-':>9}"
+        parse = best_time(lambda: Masterfile().object_from_masterfile(path), repeat)
+        same  = "" if contig_summary(Masterfile().object_from_masterfile(path)) == expected else "  CONTIGS DIFFER"
+        print(f"{compression or 'plain':>8}  {ratio:5.1f}x  {size / external:9.1f}  {inproc}  {size / parse:10.1f}{same}")
+
+# Compare the suite results to a baseline saved with --save-baseline.
+# Returns the number of stages slower (or using more memory) than the
+# baseline by more than tolerance (a ratio).
+def compare_baseline(results, baseline, tolerance):
+    regressions = 0
+    print(f"against baseline (tolerance {tolerance:.2f}x)")
+    print(f"{'scale':>8}  {'stage':>10}  {'time':>8}  {'memory':>8}")
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            if base is None:
+                continue
+            time_ratio   = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+            memory_ratio = result['peak'] / base['peak'] if base['peak'] else 1.0
+            flag         = ""
+            if time_ratio > tolerance or memory_ratio > tolerance:
+                flag         = "  REGRESSION"
+                regressions += 1
+            print(f"{scale:>8}  {stage:>10}  {time_ratio:7.2f}x  {memory_ratio:7.2f}x{flag}")
+    return regressions
+
+##############################################################################################
+# Main                                                                                       #
+##############################################################################################
+
+BENCHMARKS = ['long', 'memory', 'cache', 'orfs', 'suite', 'compressed']
+
+parser = argparse.ArgumentParser(
+    prog='benchmark',
+    description='Benchmarks for the masterfile parser and writer.',
+)
+parser.add_argument('--benchmarks',
+                    nargs='+',
+                    choices=BENCHMARKS,
+                    default=BENCHMARKS,
+                    help='Benchmarks to run (all by default).')
+parser.add_argument('--lengths',
+                    type=int,
+                    nargs='+',
+                    default=[250000, 500000, 1000000, 2000000],
+                    help='Contig lengths used for the long contig benchmark.')
+parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the best one is kept.')
+parser.add_argument('--annotations',
+                    type=int,
+                    default=100000,
+                    help='Number of annotations used for the memory benchmark.')
+parser.add_argument('--cache-length',
+                    type=int,
+                    default=2000000,
+                    help='Contig length used for the binary cache benchmark.')
+parser.add_argument('--orf-length',
+                    type=int,
+                    default=5000000,
+                    help='Sequence length used for the ORF finding benchmark.')
+parser.add_argument('--scales',
+                    nargs='+',
+                    choices=list(SUITE_SCALES),
+                    default=['small', 'medium'],
+                    help='Scales of the synthetic masterfile suite.')
+parser.add_argument('--compressed-scale',
+                    choices=list(SUITE_SCALES),
+                    default='medium',
+                    help='Scale of the synthetic masterfile of the compressed input benchmark.')
+parser.add_argument('--baseline',
+                    help='JSON file of suite results to compare against; '
+                         'the exit status is 1 on a regression.')
+parser.add_argument('--save-baseline', help='Save the suite results as a JSON baseline.')
+parser.add_argument('--tolerance',
+                    type=float,
+                    default=1.25,
+                    help='Slowdown (or memory growth) ratio over the baseline counted as a regression.')
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    # A baseline that can't be compared is an error, before anything runs
+    baseline = None
+    if args.baseline:
+        if 'suite' not in args.benchmarks:
+            parser.error("--baseline compares the results of the suite benchmark, which is not run")
+        try:
+            with open(args.baseline) as fh:
+                baseline = json.load(fh)
+        except (OSError, ValueError) as error:
+            parser.error(f"can't read baseline '{args.baseline}': {error}")
+
+    regressions = 0
+    with tempfile.TemporaryDirectory(prefix="HMMannot.bench.") as tmpdir:
+        if 'long' in args.benchmarks:
+            bench_long_contig(args.lengths, args.repeat, tmpdir)
+        if 'memory' in args.benchmarks:
+            bench_annotation_memory(args.annotations, tmpdir)
+        if 'cache' in args.benchmarks:
+            bench_cache(args.cache_length, args.repeat, tmpdir)
+        if 'orfs' in args.benchmarks:
+            bench_orfs(args.orf_length, 20, args.repeat, tmpdir)
+        if 'suite' in args.benchmarks:
+            results = bench_suite(args.scales, args.repeat, tmpdir)
+            if baseline is not None:
+                regressions = compare_baseline(results, baseline, args.tolerance)
+            if args.save_baseline:
+                with open(args.save_baseline, 'w') as fh:
+                    json.dump(results, fh, indent=2, sort_keys=True)
+        if 'compressed' in args.benchmarks:
+            bench_compressed(args.compressed_scale, args.repeat, tmpdir)
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
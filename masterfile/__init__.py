@@ -1 +1,2 @@
-from .masterfile import Masterfile
\ No newline at end of file
+from .masterfile      import Masterfile
+from .contig_sequence import ContigSequence
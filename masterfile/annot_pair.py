@@ -1,6 +1,16 @@
 #!/usr/bin/env python3
 
+import sys
+
 class AnnotPair:
+    # Slotted: hundreds of thousands of these are alive at once
+    __slots__ = (
+        'type', 'genename', 'startpos', 'endpos', 'direction',
+        'startmulticomment', 'endmulticomment', 'startlinenumber', 'endlinenumber',
+        'introntype', 'globaltype',
+        'rawname', 'lineprefix', '_startline', '_endline', '_startsplit', '_endsplit',
+    )
+
     # __init__ with all the attributes optional
     def __init__(self, type=None, genename=None, startpos=None, endpos=None, direction=None, startline=None, endline=None, startmulticomment=None, endmulticomment=None, startlinenumber=None, endlinenumber=None, introntype=None, globaltype=None):
         self.type              = type
@@ -8,11 +18,76 @@ class AnnotPair:
         self.startpos          = startpos
         self.endpos            = endpos
         self.direction         = direction
-        self.startline         = startline
-        self.endline           = endline
         self.startmulticomment = startmulticomment
         self.endmulticomment   = endmulticomment
         self.startlinenumber   = startlinenumber
         self.endlinenumber     = endlinenumber
         self.introntype        = introntype
         self.globaltype        = globaltype
+
+        # The start and end lines are either kept verbatim or, when they
+        # were read from a masterfile, only as the part after the gene
+        # name (_startsplit/_endsplit tell which): the full line is then
+        # rebuilt as lineprefix + rawname + suffix, the three parts being
+        # interned strings shared between annotations.
+        self.rawname           = None
+        self.lineprefix        = None
+        self._startline        = startline
+        self._endline          = endline
+        self._startsplit       = False
+        self._endsplit         = False
+
+    def _line(self, stored, split):
+        if not split:
+            return stored
+        return self.lineprefix + self.rawname + stored
+
+    @property
+    def startline(self):
+        return self._line(self._startline, self._startsplit)
+
+    @startline.setter
+    def startline(self, line):
+        self._startline  = line
+        self._startsplit = False
+
+    @property
+    def endline(self):
+        return self._line(self._endline, self._endsplit)
+
+    @endline.setter
+    def endline(self, line):
+        self._endline  = line
+        self._endsplit = False
+
+    # Store a line split around the gene name (prefix + rawname + suffix),
+    # returns what's stored and whether it's split. It's kept verbatim
+    # when the prefix or the name differ from the ones already stored for
+    # the other side of the pair.
+    def _split_line(self, prefix, rawname, suffix):
+        if self.rawname is None:
+            self.rawname    = sys.intern(rawname)
+            self.lineprefix = sys.intern(prefix)
+        if rawname != self.rawname or prefix != self.lineprefix:
+            return prefix + rawname + suffix, False
+        # Suffixes without comment (' ==> start') are the same everywhere
+        return (sys.intern(suffix) if ';' not in suffix else suffix), True
+
+    def set_startline_parts(self, prefix, rawname, suffix):
+        self._startline, self._startsplit = self._split_line(prefix, rawname, suffix)
+
+    def set_endline_parts(self, prefix, rawname, suffix):
+        self._endline, self._endsplit = self._split_line(prefix, rawname, suffix)
+
+    # All the attributes as a hashable tuple (the comment lists as
+    # tuples), for MasterfileContig.content_hash
+    def state(self):
+        startmulticomment = self.startmulticomment
+        endmulticomment   = self.endmulticomment
+        return (
+            self.type, self.genename, self.startpos, self.endpos, self.direction,
+            tuple(startmulticomment) if startmulticomment else startmulticomment,
+            tuple(endmulticomment) if endmulticomment else endmulticomment,
+            self.startlinenumber, self.endlinenumber, self.introntype, self.globaltype,
+            self.rawname, self.lineprefix, self._startline, self._endline, self._startsplit, self._endsplit,
+        )
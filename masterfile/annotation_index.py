@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+from collections import deque
+import random
+
+#####################################################################
+# IntervalNode class                                                #
+#####################################################################
+
+# A node of the tree: one annotation as an interval [start, end] of
+# the contig, start <= end whatever its direction. The nodes are
+# ordered by (start, serial), maxend is the largest end of the subtree.
+class IntervalNode:
+    __slots__ = ('start', 'end', 'serial', 'annot', 'priority', 'left', 'right', 'maxend')
+
+    def __init__(self, start, end, serial, annot, priority=None):
+        self.start    = start
+        self.end      = end
+        self.serial   = serial
+        self.annot    = annot
+        self.priority = priority
+        self.left     = None
+        self.right    = None
+        self.maxend   = end
+
+    def update(self):
+        maxend = self.end
+        if self.left is not None and self.left.maxend > maxend:
+            maxend = self.left.maxend
+        if self.right is not None and self.right.maxend > maxend:
+            maxend = self.right.maxend
+        self.maxend = maxend
+
+
+#####################################################################
+# Utility functions                                                 #
+#####################################################################
+
+# Interval [start, end] of an AnnotPair, with start <= end for both
+# directions ('<==' annotations have startpos > endpos), None when it
+# has no position at all
+def annot_interval(annot):
+    start, end = annot.startpos, annot.endpos
+    if start is None:
+        start = end
+    if end is None:
+        end = start
+    if start is None:
+        return None
+    return (start, end) if start <= end else (end, start)
+
+def rotate_right(node):
+    left       = node.left
+    node.left  = left.right
+    left.right = node
+    node.update()
+    left.update()
+    return left
+
+def rotate_left(node):
+    right      = node.right
+    node.right = right.left
+    right.left = node
+    node.update()
+    right.update()
+    return right
+
+
+#####################################################################
+# AnnotationIndex class                                             #
+#####################################################################
+
+# Interval index of the annotations of a contig: a treap (a binary
+# search tree kept balanced by random priorities) augmented with the
+# largest end of each subtree. Insertion and removal are O(log n),
+# overlap, containment and nearest queries O(log n + k) on the usual
+# annotation layouts (k annotations reported). The results come
+# sorted by start.
+#
+# The index holds the positions the annotations had when they were
+# added: call update(annot) after moving one.
+class AnnotationIndex:
+    def __init__(self, annotations=()):
+        self.root   = None
+        self.nodes  = {}  # id(annot) -> node
+        self.serial = 0
+        self.random = random.Random()
+        self._build(annotations)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, annot):
+        return id(annot) in self.nodes
+
+    # Annotations in start order
+    def __iter__(self):
+        stack = []
+        node  = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.annot
+            node = node.right
+
+    def _node(self, annot):
+        interval = annot_interval(annot)
+        if interval is None:
+            return None
+        node         = IntervalNode(interval[0], interval[1], self.serial, annot)
+        self.serial += 1
+        return node
+
+    # Build a balanced tree from the sorted annotations, the priorities
+    # (sorted random numbers) handed out level by level so that each
+    # node has a higher priority than its children
+    def _build(self, annotations):
+        nodes = [node for node in map(self._node, annotations) if node is not None]
+        if not nodes:
+            return
+        nodes.sort(key=lambda node: (node.start, node.serial))
+        for node in nodes:
+            self.nodes[id(node.annot)] = node
+
+        def build(low, high):
+            if low >= high:
+                return None
+            middle     = (low + high) // 2
+            node       = nodes[middle]
+            node.left  = build(low, middle)
+            node.right = build(middle + 1, high)
+            node.update()
+            return node
+
+        self.root  = build(0, len(nodes))
+        priorities = sorted((self.random.random() for _ in nodes), reverse=True)
+        level      = deque([self.root])
+        for priority in priorities:
+            node          = level.popleft()
+            node.priority = priority
+            if node.left is not None:
+                level.append(node.left)
+            if node.right is not None:
+                level.append(node.right)
+
+    # Add an annotation (ignored when it has no position or is already in)
+    def add(self, annot):
+        if id(annot) in self.nodes:
+            return
+        node = self._node(annot)
+        if node is None:
+            return
+        node.priority          = self.random.random()
+        self.nodes[id(annot)]  = node
+        self.root              = self._insert(self.root, node)
+
+    def _insert(self, node, new):
+        if node is None:
+            return new
+        if (new.start, new.serial) < (node.start, node.serial):
+            node.left = self._insert(node.left, new)
+            if node.left.priority > node.priority:
+                return rotate_right(node)
+        else:
+            node.right = self._insert(node.right, new)
+            if node.right.priority > node.priority:
+                return rotate_left(node)
+        node.update()
+        return node
+
+    # Remove an annotation (ignored when it isn't in the index)
+    def remove(self, annot):
+        node = self.nodes.pop(id(annot), None)
+        if node is not None:
+            self.root = self._delete(self.root, node)
+
+    def _delete(self, node, old):
+        if node is old:
+            if node.left is None:
+                return node.right
+            if node.right is None:
+                return node.left
+            if node.left.priority > node.right.priority:
+                node       = rotate_right(node)
+                node.right = self._delete(node.right, old)
+            else:
+                node       = rotate_left(node)
+                node.left  = self._delete(node.left, old)
+        elif (old.start, old.serial) < (node.start, node.serial):
+            node.left  = self._delete(node.left, old)
+        else:
+            node.right = self._delete(node.right, old)
+        node.update()
+        return node
+
+    # Index an annotation again at its current position
+    def update(self, annot):
+        self.remove(annot)
+        self.add(annot)
+
+    # Annotations overlapping [start, end]
+    def overlapping(self, start, end=None):
+        found = []
+        self._overlapping(self.root, start, start if end is None else end, found)
+        return found
+
+    def _overlapping(self, node, start, end, found):
+        if node is None or node.maxend < start:
+            return
+        self._overlapping(node.left, start, end, found)
+        if node.start <= end:
+            if node.end >= start:
+                found.append(node.annot)
+            self._overlapping(node.right, start, end, found)
+
+    # Annotations contained in [start, end]
+    def contained_in(self, start, end):
+        found = []
+        self._contained_in(self.root, start, end, found)
+        return found
+
+    def _contained_in(self, node, start, end, found):
+        if node is None or node.maxend < start:
+            return
+        if node.start >= start:
+            self._contained_in(node.left, start, end, found)
+        if node.start <= end:
+            if node.start >= start and node.end <= end:
+                found.append(node.annot)
+            self._contained_in(node.right, start, end, found)
+
+    # Annotations containing [start, end]
+    def containing(self, start, end=None):
+        found = []
+        self._containing(self.root, start, start if end is None else end, found)
+        return found
+
+    def _containing(self, node, start, end, found):
+        if node is None or node.maxend < end:
+            return
+        self._containing(node.left, start, end, found)
+        if node.start <= start:
+            if node.end >= end:
+                found.append(node.annot)
+            self._containing(node.right, start, end, found)
+
+    # Annotation nearest to [start, end] (an overlapping one if any),
+    # the one on the left on a tie, None when the index is empty
+    def nearest(self, start, end=None):
+        if end is None:
+            end = start
+
+        # Largest end among the annotations starting before end: a node
+        # on the search path or the best node of a left subtree of it
+        leftbest = None
+        bestend  = None
+        subtree  = False
+        node     = self.root
+        while node is not None:
+            if node.start <= end:
+                if bestend is None or node.end > bestend:
+                    leftbest, bestend, subtree = node, node.end, False
+                if node.left is not None and node.left.maxend > bestend:
+                    leftbest, bestend, subtree = node.left, node.left.maxend, True
+                node = node.right
+            else:
+                node = node.left
+        if subtree:
+            leftbest = self._maxend_node(leftbest)
+
+        # First annotation starting after end
+        rightbest = None
+        node      = self.root
+        while node is not None:
+            if node.start > end:
+                rightbest = node
+                node      = node.left
+            else:
+                node      = node.right
+
+        if leftbest is None:
+            return rightbest.annot if rightbest else None
+        if rightbest is None:
+            return leftbest.annot
+        leftdistance  = max(0, start - leftbest.end)
+        rightdistance = rightbest.start - end
+        return leftbest.annot if leftdistance <= rightdistance else rightbest.annot
+
+    # Node holding the largest end of a subtree
+    def _maxend_node(self, node):
+        while node.end != node.maxend:
+            if node.left is not None and node.left.maxend == node.maxend:
+                node = node.left
+            else:
+                node = node.right
+        return node
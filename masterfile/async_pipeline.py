@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+import asyncio
+import concurrent.futures
+import io
+import subprocess
+import threading
+
+from .search_scheduler import SearchResult
+
+#####################################################################
+# Utility functions                                                 #
+#####################################################################
+
+# Await the task or coroutine aw to its end, whatever the cancellations
+# of the caller in the meantime (they're dropped, the caller re-raises
+# its own). Returns its result, or raises its exception.
+async def uncancelled(aw):
+    task = asyncio.ensure_future(aw)
+    while not task.done():
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            break
+    return task.result()
+
+# Kill a process and wait for its end. Its standard input is closed
+# first: asyncio only sees the process end once all its pipes are closed.
+async def stop_process(process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    if process.stdin is not None:
+        process.stdin.close()
+    await process.communicate()
+
+# Default runner of the pipeline: start a command with input piped to
+# its standard input, returning its PipedOutput, its standard output
+# read line by line from the pipe: the table is neither held in memory
+# nor written to disk.
+#
+# Its start is never cancelled midway: a create_subprocess_exec
+# cancelled before its pipes are connected waits forever for the
+# process to end (Python 3.11). A cancelled start first waits for its
+# process to be started, then kills it.
+async def run_command_async(command, input):
+    starting = asyncio.ensure_future(asyncio.create_subprocess_exec(
+        *command,
+        stdin  = subprocess.PIPE,
+        stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+    ))
+    try:
+        process = await asyncio.shield(starting)
+    except asyncio.CancelledError:
+        try:
+            process = await uncancelled(starting)
+        except Exception:
+            raise asyncio.CancelledError
+        await uncancelled(stop_process(process))
+        raise
+    return PipedOutput(command, process, input)
+
+
+#####################################################################
+# PipedOutput class                                                 #
+#####################################################################
+
+# Standard output of a process being run, read line by line (or in
+# batches of lines) from its pipe while two tasks write input to its
+# standard input and collect its standard error. The process waits when
+# its output isn't read (backpressure: the reader of the pipe stops
+# reading past twice its limit, 64 KiB by default).
+#
+# wait() waits for the end of the process, without reading its output,
+# raising subprocess.CalledProcessError with its standard error when it
+# failed; close() reads what's left of the output first. kill() kills
+# the process, stop() kills it and waits for its end.
+class PipedOutput:
+    def __init__(self, command, process, input):
+        self.command = command
+        self.process = process
+        self.feeding = asyncio.create_task(self._feed(input))
+        self.stderr  = asyncio.create_task(process.stderr.read())
+
+    async def _feed(self, input):
+        try:
+            self.process.stdin.write(input.encode())
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):  # the process ended without reading it all
+            pass
+        finally:
+            self.process.stdin.close()
+
+    async def __aiter__(self):
+        async for line in self.process.stdout:
+            yield line.decode()
+
+    # The lines read, in batches of whole lines of at most about size
+    # bytes, each one (an io.StringIO) as soon as it's read without
+    # waiting for the process to write more
+    async def batches(self, size=1 << 16):
+        rest = b""
+        while True:
+            chunk = await self.process.stdout.read(size)
+            if not chunk:
+                if rest:
+                    yield io.StringIO(rest.decode())
+                return
+            data = rest + chunk
+            end  = data.rfind(b'\n') + 1
+            rest = data[end:]
+            if end:
+                yield io.StringIO(data[:end].decode())
+
+    async def wait(self):
+        returncode = await self.process.wait()
+        await asyncio.gather(self.feeding, return_exceptions=True)
+        stderr = await self.stderr
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command, None, stderr.decode())
+
+    async def close(self):
+        while await self.process.stdout.read(1 << 16):
+            pass
+        await self.wait()
+
+    def kill(self):
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def stop(self):
+        self.kill()
+        self.feeding.cancel()
+        try:
+            await self.close()
+        except subprocess.CalledProcessError:
+            pass
+
+
+#####################################################################
+# AsyncSearchPipeline class                                         #
+#####################################################################
+
+# Searches (name, sequence) records while they are still being
+# produced, e.g. the ORFs of a masterfile being parsed, cleaned and
+# translated one contig at a time.
+#
+# The records are cut, in the order they come, in shards of about
+# shard_length residues. Each shard is queued as soon as it's full to
+# `workers` search tasks, each one piping its shard to the command
+# (started with asyncio.create_subprocess_exec) and waiting for its end
+# before taking the next one. The tables are read from the standard
+# output of the searches, in shard order: a search whose table isn't
+# read yet waits for it, and the production of the records waits in
+# turn once queue_size shards are queued (backpressure), so that memory
+# stays bounded and nothing is written to disk.
+#
+# command is as for SearchScheduler, '{input}' becoming '-' and
+# '{output}' '/dev/stdout'. The runner (a coroutine function taking the
+# command and its input, returning its started PipedOutput) can be
+# replaced, e.g. by a fake search in tests.
+#
+# The records are pulled in a thread of their own (their production,
+# e.g. parsing and translating, being blocking code), while the event
+# loop feeds the searches and reads their tables.
+class AsyncSearchPipeline:
+    def __init__(self, command, workers=1, shard_length=1000000, queue_size=None, runner=None):
+        self.command      = list(command)
+        self.workers      = max(1, workers)
+        self.shard_length = max(1, shard_length)
+        self.queue_size   = queue_size or 2 * self.workers
+        self.runner       = runner or run_command_async
+
+    def shard_command(self):
+        return [arg.replace('{input}', '-').replace('{output}', '/dev/stdout') for arg in self.command]
+
+    # Cut the records in shards, queued to the workers (the thread
+    # pulling the records waiting when the queue is full) with the future
+    # of their result queued in order. An error of the records is queued
+    # in order too, as a failed future. When cancelled, the thread stops
+    # at the next record or shard queued, closing the records.
+    async def _produce(self, records, shards, ordered):
+        loop     = asyncio.get_running_loop()
+        lock     = threading.Lock()
+        stopping = False
+        putting  = None    # concurrent future of the shard being queued
+
+        async def put(result):
+            future = loop.create_future()
+            await ordered.put(future)
+            await shards.put((result, future))
+
+        # Queue a shard from the thread, False once stopped
+        def queue(result):
+            nonlocal putting
+            with lock:
+                if stopping:
+                    return False
+                putting = asyncio.run_coroutine_threadsafe(put(result), loop)
+            try:
+                putting.result()
+            except concurrent.futures.CancelledError:
+                return False
+            return True
+
+        # The records cut in shards, in the thread. Returns their error.
+        def cut():
+            index  = 0
+            chunks = []
+            result = SearchResult(index=0, nsequences=0, length=0)
+            try:
+                for name, seq in records:
+                    if stopping:
+                        return None
+                    chunks.append(f">{name}\n{seq}\n")
+                    result.nsequences += 1
+                    result.length     += len(seq)
+                    if result.length >= self.shard_length:
+                        result.sequences = "".join(chunks)
+                        if not queue(result):
+                            return None
+                        index += 1
+                        chunks = []
+                        result = SearchResult(index=index, nsequences=0, length=0)
+                if chunks:
+                    result.sequences = "".join(chunks)
+                    queue(result)
+            except Exception as error:
+                return error
+            finally:
+                if hasattr(records, 'close'):
+                    records.close()
+            return None
+
+        thread = asyncio.ensure_future(asyncio.to_thread(cut))
+        try:
+            error = await asyncio.shield(thread)
+        except asyncio.CancelledError:
+            with lock:
+                stopping = True
+                if putting is not None:
+                    putting.cancel()
+            await uncancelled(thread)
+            raise
+        if error is not None:
+            future = loop.create_future()
+            future.set_exception(error)
+            await ordered.put(future)
+        await ordered.put(None)
+
+    # Search the shards queued, the future of each one getting its result
+    # as soon as its search is started, failed getting the first error of
+    # all the workers (the other searches running are then killed)
+    async def _work(self, shards, failed, running):
+        command = self.shard_command()
+        while True:
+            result, future = await shards.get()
+            table          = None
+            try:
+                table            = await self.runner(command, result.sequences)
+                result.table     = table
+                result.sequences = None
+                future.set_result(result)
+                running.add(table)
+                await table.wait()
+            except asyncio.CancelledError:
+                future.cancel()
+                if table is not None:
+                    await uncancelled(table.stop())
+                raise
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+                if not failed.done():
+                    failed.set_exception(error)
+                    for other in running:
+                        other.kill()
+            finally:
+                running.discard(table)
+                shards.task_done()
+
+    # Search the records, yielding the SearchResult of each shard in
+    # shard order as soon as its search is started, its table (a
+    # PipedOutput) to be read before the next one is asked for; what's
+    # left of it is then read and the error of its search raised. An
+    # error of the records is raised here in order, the error of a
+    # search as soon as it fails (without waiting for the shards before
+    # it), the other searches are then stopped (their processes killed).
+    async def run(self, records):
+        shards   = asyncio.Queue(maxsize=self.queue_size)
+        ordered  = asyncio.Queue()
+        failed   = asyncio.get_running_loop().create_future()
+        running  = set()
+        producer = asyncio.create_task(self._produce(records, shards, ordered))
+        workers  = [asyncio.create_task(self._work(shards, failed, running)) for _ in range(self.workers)]
+        try:
+            while True:
+                future = await ordered.get()
+                if future is None:
+                    break
+                if not future.done():
+                    await asyncio.wait([future, failed], return_when=asyncio.FIRST_COMPLETED)
+                if failed.done():
+                    failed.result()
+                result = future.result()
+                yield result
+                try:
+                    await result.table.close()
+                except subprocess.CalledProcessError:
+                    if failed.done():  # killed after the failure of another search
+                        failed.result()
+                    raise
+        finally:
+            for task in [producer] + workers:
+                task.cancel()
+            await asyncio.gather(producer, *workers, return_exceptions=True)
+            if failed.done():
+                failed.exception()
+
+            # The results left behind (e.g. the searches failing after
+            # the first error) are retrieved, so that asyncio doesn't
+            # report their errors as never retrieved
+            while not ordered.empty():
+                future = ordered.get_nowait()
+                if future is not None and future.done() and not future.cancelled():
+                    future.exception()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+from array import array
+import bisect
+import re
+
+from .coordinate_index import CoordinateIndex
+
+#####################################################################
+# 2-bit encoding tables                                             #
+#####################################################################
+
+# a/c/g/t -> 0/1/2/3 whatever the case, n/N are stored as 0 and
+# restored from the N runs. Any other byte maps to 255 (invalid).
+ENCODE = bytearray(b'\xff' * 256)
+for char, code in zip(b'acgtnACGTN', [0, 1, 2, 3, 0, 0, 1, 2, 3, 0]):
+    ENCODE[char] = code
+ENCODE = bytes(ENCODE)
+
+# 0/1/2/3 -> a/c/g/t, the case is restored from the upper runs.
+DECODE = bytes.maketrans(b'\x00\x01\x02\x03', b'acgt')
+
+N_RUNS     = re.compile(r'[nN]+')
+UPPER_RUNS = re.compile(r'[ACGTN]+')
+
+
+#####################################################################
+# Utility functions                                                 #
+#####################################################################
+
+# Pack a bytes object of codes (each 0..3) four codes per byte, the
+# first code in the two high bits. The four interleaved slices are
+# combined as big integers: each byte stays below 256 so no carry ever
+# crosses a byte boundary and the whole packing runs at C speed.
+def pack_codes(codes):
+    codes  = codes + b'\x00' * (-len(codes) % 4)
+    nbytes = len(codes) // 4
+    packed = 0
+    for shift, offset in ((6, 0), (4, 1), (2, 2), (0, 3)):
+        packed |= int.from_bytes(codes[offset::4], 'big') << shift
+    return packed.to_bytes(nbytes, 'big')
+
+# Inverse of pack_codes, returns the lower case nucleotides of the
+# packed bytes as a bytearray of 4 * len(packed) characters.
+def unpack_codes(packed):
+    nbytes = len(packed)
+    out    = bytearray(4 * nbytes)
+    if not nbytes:
+        return out
+    value = int.from_bytes(packed, 'big')
+    mask  = int.from_bytes(b'\x03' * nbytes, 'big')
+    for shift, offset in ((6, 0), (4, 1), (2, 2), (0, 3)):
+        out[offset::4] = ((value >> shift) & mask).to_bytes(nbytes, 'big').translate(DECODE)
+    return out
+
+# Flatten the (start, end) of the matches of a pattern in two arrays
+def runs_of(pattern, text):
+    starts = array('I')
+    ends   = array('I')
+    for match in pattern.finditer(text):
+        starts.append(match.start())
+        ends.append(match.end())
+    return starts, ends
+
+
+#####################################################################
+# ContigSequence class                                              #
+#####################################################################
+
+# Compact replacement for the str stored in MasterfileContig.sequence.
+# The nucleotides are packed 2 bits each, N and upper case stretches are
+# kept as sorted runs and the '!' markers as a sorted array of positions
+# in nucleotide coordinates (a marker at p sits just before the
+# nucleotide of 0-based index p, several markers may share a position).
+#
+# len() is the number of nucleotides (the biological length), slicing
+# works on nucleotide coordinates and only decodes the bytes it touches,
+# str() gives back the original text, markers included.
+class ContigSequence:
+    __slots__ = ('packed', 'length', 'nstarts', 'nends', 'upperstarts', 'upperends', 'markers')
+
+    def __init__(self, packed=b'', length=0, nruns=None, upperruns=None, markers=None):
+        self.packed                       = packed
+        self.length                       = length
+        self.nstarts, self.nends          = nruns     or (array('I'), array('I'))
+        self.upperstarts, self.upperends  = upperruns or (array('I'), array('I'))
+        self.markers                      = markers   or array('I')
+
+    @classmethod
+    def from_string(cls, seq):
+        markers = CoordinateIndex.from_string(seq).markers
+
+        bases = seq.replace('!', '') if markers else seq
+        codes = bases.encode('ascii', 'replace').translate(ENCODE)
+        bad   = codes.find(255)
+        if bad != -1:
+            raise ValueError(f"Bad character in sequence at position {bad + 1}: '{bases[bad]}'")
+
+        return cls(
+            packed    = pack_codes(codes),
+            length    = len(bases),
+            nruns     = runs_of(N_RUNS, bases),
+            upperruns = runs_of(UPPER_RUNS, bases),
+            markers   = markers,
+        )
+
+    # Nucleotides in [start, end) without the markers, as a str
+    def nucleotides(self, start=0, end=None):
+        if end is None or end > self.length:
+            end = self.length
+        if start < 0:
+            start = 0
+        if start >= end:
+            return ''
+
+        first  = start // 4
+        out    = unpack_codes(self.packed[first:(end + 3) // 4])
+        offset = first * 4
+        del out[end - offset:]
+        del out[:start - offset]
+
+        # Restore the N then the upper case stretches overlapping the range
+        for starts, ends, upper in ((self.nstarts, self.nends, False), (self.upperstarts, self.upperends, True)):
+            i = bisect.bisect_right(ends, start)
+            while i < len(starts) and starts[i] < end:
+                runstart = max(starts[i], start) - start
+                runend   = min(ends[i], end) - start
+                if upper:
+                    out[runstart:runend] = out[runstart:runend].upper()
+                else:
+                    out[runstart:runend] = b'n' * (runend - runstart)
+                i += 1
+
+        return out.decode('ascii')
+
+    # Coordinate index of the sequence, sharing the markers array
+    def coordinates(self):
+        return CoordinateIndex(self.markers, self.length)
+
+    # Same nucleotides, no '!' marker
+    def without_markers(self):
+        return ContigSequence(self.packed, self.length, (self.nstarts, self.nends), (self.upperstarts, self.upperends))
+
+    # Same sequence, all upper case
+    def upper(self):
+        upperruns = (array('I', [0]), array('I', [self.length])) if self.length else None
+        return ContigSequence(self.packed, self.length, (self.nstarts, self.nends), upperruns, self.markers)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(self.length)
+            if step != 1:
+                return self.nucleotides()[index]
+            return self.nucleotides(start, end)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("ContigSequence index out of range")
+        return self.nucleotides(index, index + 1)
+
+    def __str__(self):
+        seq = self.nucleotides()
+        if not self.markers:
+            return seq
+        return self.coordinates().apply(seq)
+
+    def __eq__(self, other):
+        if isinstance(other, (ContigSequence, str)):
+            return str(self) == str(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ContigSequence(length={self.length}, markers={len(self.markers)})"
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+from array import array
+import bisect
+
+#####################################################################
+# CoordinateIndex class                                             #
+#####################################################################
+
+# Conversion between the biological coordinates of a contig (positions
+# counted in nucleotides) and the character offsets in its text, where
+# the '!' markers take one character each but no position.
+#
+# The markers are kept as in ContigSequence: a sorted array of positions
+# in nucleotide coordinates, a marker at p sitting just before the
+# nucleotide of 0-based index p (several markers may share a position).
+# Their character offsets (markers[j] + j, the prefix count of the
+# markers before each one) are kept alongside, so that both conversions
+# are one bisect.
+class CoordinateIndex:
+    __slots__ = ('markers', 'offsets', 'length')
+
+    def __init__(self, markers=None, length=0):
+        self.markers = markers if markers is not None else array('I')
+        self.offsets = array('I', [pos + rank for rank, pos in enumerate(self.markers)])
+        self.length  = length
+
+    # Index of a sequence given as text, markers included
+    @classmethod
+    def from_string(cls, seq):
+        markers = array('I')
+        index   = seq.find('!')
+        while index != -1:
+            markers.append(index - len(markers))
+            index = seq.find('!', index + 1)
+        return cls(markers, len(seq) - len(markers))
+
+    # Number of characters of the text
+    def __len__(self):
+        return self.length + len(self.markers)
+
+    # Character offset of the nucleotide at 0-based position pos; past
+    # the last nucleotide, the offset it would have
+    def offset(self, pos):
+        if not self.markers:
+            return pos
+        return pos + bisect.bisect_right(self.markers, pos)
+
+    # Number of nucleotides before the character offset offset, i.e. the
+    # 0-based position of the nucleotide (or of the one after the
+    # marker) found there
+    def position(self, offset):
+        if not self.offsets:
+            return offset
+        return offset - bisect.bisect_left(self.offsets, offset)
+
+    # Whether there's a marker just before the nucleotide at pos
+    def has_marker(self, pos):
+        index = bisect.bisect_left(self.markers, pos)
+        return index < len(self.markers) and self.markers[index] == pos
+
+    # Same index with markers added at positions (in any order), merged
+    # with the existing ones in one pass
+    def with_markers(self, positions):
+        positions = sorted(positions)
+        if not positions:
+            return self
+        merged = array('I')
+        i      = 0
+        for pos in self.markers:
+            while i < len(positions) and positions[i] < pos:
+                merged.append(positions[i])
+                i += 1
+            merged.append(pos)
+        merged.extend(positions[i:])
+        return CoordinateIndex(merged, self.length)
+
+    # Text of the nucleotides (a str without markers) with the markers
+    # put back, built in one join
+    def apply(self, nucleotides):
+        if not self.markers:
+            return nucleotides
+
+        pieces = []
+        last   = 0
+        for pos in self.markers:
+            pieces.append(nucleotides[last:pos])
+            pieces.append('!')
+            last = pos
+        pieces.append(nucleotides[last:])
+        return ''.join(pieces)
+
+    def __repr__(self):
+        return f"CoordinateIndex(length={self.length}, markers={len(self.markers)})"
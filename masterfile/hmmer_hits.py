@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import contextlib
+import re
+import sys
+
+from .annot_pair import AnnotPair
+from .masterfile import gene_name_and_type
+
+#####################################################################
+# Table formats                                                     #
+#####################################################################
+
+# Number of whitespace separated columns before the free text target
+# description, in the --tblout and --domtblout tables of HMMER
+TBLOUT_COLUMNS    = 18
+DOMTBLOUT_COLUMNS = 22
+
+# Location of an ORF, as written in its description by orfs_to_fh
+# (and esl-translate)
+ORF_DESCRIPTION = re.compile(r'source=(\S+)\s+coords=(\d+)\.\.(\d+)\s+length=\d+\s+frame=(\d)')
+
+
+#####################################################################
+# HmmerHit class                                                    #
+#####################################################################
+
+# One line of a tblout (per sequence) or domtblout (per domain) table.
+# The alignment and envelope coordinates are in amino acids of the
+# target and are only known for domain hits.
+class HmmerHit:
+    __slots__ = (
+        'target', 'query', 'queryaccession', 'evalue', 'score', 'bias',
+        'hmmfrom', 'hmmto', 'alifrom', 'alito', 'envfrom', 'envto', 'description',
+    )
+
+    def __init__(self, target=None, query=None, queryaccession=None, evalue=None, score=None, bias=None, hmmfrom=None, hmmto=None, alifrom=None, alito=None, envfrom=None, envto=None, description=None):
+        self.target         = target
+        self.query          = query
+        self.queryaccession = queryaccession
+        self.evalue         = evalue
+        self.score          = score
+        self.bias           = bias
+        self.hmmfrom        = hmmfrom
+        self.hmmto          = hmmto
+        self.alifrom        = alifrom
+        self.alito          = alito
+        self.envfrom        = envfrom
+        self.envto          = envto
+        self.description    = description
+
+    def __repr__(self):
+        return f"HmmerHit({self.query} on {self.target}, E-value {self.evalue})"
+
+
+#####################################################################
+# Streaming parsers                                                 #
+#####################################################################
+
+# A table given as a file name is opened (and closed once read), an
+# open file or any iterable of lines (e.g. the io.StringIO of a piped
+# output) is read as is
+def open_table(source):
+    if isinstance(source, str):
+        return open(source, 'r')
+    return contextlib.nullcontext(source)
+
+# Data lines of a HMMER table split in columns, the last one being the
+# target description (possibly empty). Comment lines are skipped.
+def table_rows(source, ncolumns):
+    with open_table(source) as fh:
+        for line in fh:
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split(None, ncolumns)
+            if len(fields) < ncolumns:
+                raise ValueError(f"Can't parse HMMER table line of '{source}'. Line is:\n{line}\n")
+            if len(fields) == ncolumns:
+                fields.append("")
+            yield fields
+
+# Hits of a --tblout table, one line at a time
+def iter_tblout(source):
+    for fields in table_rows(source, TBLOUT_COLUMNS):
+        yield HmmerHit(
+            target         = sys.intern(fields[0]),
+            query          = sys.intern(fields[2]),
+            queryaccession = fields[3],
+            evalue         = float(fields[4]),
+            score          = float(fields[5]),
+            bias           = float(fields[6]),
+            description    = fields[18],
+        )
+
+# Hits of a --domtblout table, one domain (line) at a time
+def iter_domtblout(source):
+    for fields in table_rows(source, DOMTBLOUT_COLUMNS):
+        yield HmmerHit(
+            target         = sys.intern(fields[0]),
+            query          = sys.intern(fields[3]),
+            queryaccession = fields[4],
+            evalue         = float(fields[12]),  # i-Evalue of the domain
+            score          = float(fields[13]),
+            bias           = float(fields[14]),
+            hmmfrom        = int(fields[15]),
+            hmmto          = int(fields[16]),
+            alifrom        = int(fields[17]),
+            alito          = int(fields[18]),
+            envfrom        = int(fields[19]),
+            envto          = int(fields[20]),
+            description    = fields[22],
+        )
+
+
+#####################################################################
+# Hits to annotations                                               #
+#####################################################################
+
+# Contig name and contig coordinates (start, end, direction) of a hit
+# on an ORF, from the ORF location in the target description. Domain
+# hits cover their alignment, sequence hits the whole ORF. On the
+# reverse strand start > end, as for '<==' annotations.
+def hit_location(hit):
+    match = ORF_DESCRIPTION.search(hit.description or "")
+    if not match:
+        raise ValueError(f"No ORF location in the description of target '{hit.target}': {hit.description}")
+
+    source           = match.group(1)
+    orfstart, orfend = int(match.group(2)), int(match.group(3))
+    if hit.alifrom is None:
+        return source, orfstart, orfend, '==>' if orfstart <= orfend else '<=='
+
+    if int(match.group(4)) <= 3:
+        return source, orfstart + 3 * (hit.alifrom - 1), orfstart + 3 * hit.alito - 1, '==>'
+    return source, orfstart - 3 * (hit.alifrom - 1), orfstart - 3 * hit.alito + 1, '<=='
+
+# AnnotPair of a hit, named after the HMM profile, with its start and
+# end lines ready to be written in a masterfile
+def hit_to_annot_pair(hit):
+    source, startpos, endpos, arrow = hit_location(hit)
+    genename, type                  = gene_name_and_type(hit.query)
+
+    annot = AnnotPair(
+        type      = type,
+        genename  = sys.intern(genename),
+        startpos  = startpos,
+        endpos    = endpos,
+        direction = arrow,
+    )
+    annot.set_startline_parts("; G-", hit.query, f" {arrow} start ;; HMMannot: {hit.target} E-value={hit.evalue:g} score={hit.score:g}")
+    annot.set_endline_parts("; G-", hit.query, f" {arrow} end")
+    return source, annot
+
+# Attach the hits, as they are read, to the contigs of a Masterfile
+# (looked up with get_contig_by_name, so an indexed masterfile only
+# parses the contigs hit). Yields each contig with its new AnnotPair.
+def attach_hits(hits, pirmaster):
+    for hit in hits:
+        source, annot = hit_to_annot_pair(hit)
+        contig        = pirmaster.get_contig_by_name(source)
+        if contig is None:
+            raise ValueError(f"Hit on ORF '{hit.target}' of unknown contig '{source}'")
+        contig.add_annot_pair(annot)
+        yield contig, annot
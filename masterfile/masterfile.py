@@ -1,123 +1,384 @@
 #!/usr/bin/env python3
 
-from pprint import pprint
-import pdb
+from collections import Counter, deque
+from itertools import repeat
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import os
+import pickle
+import re
+import shutil
+import subprocess
+import sys
+import zlib
 
+from .masterfile_contig import MasterfileContig
+from .annot_pair        import AnnotPair
+from .contig_sequence   import ContigSequence
+from .profiler          import NULL_PROFILER
+from .signed_pickle     import open_private, verify_signed, write_signed
 
-import functools
-import re
 
-from masterfile_contig import MasterfileContig
-from annot_pair        import AnnotPair
+#####################################################################
+# Sequence alphabet                                                 #
+#####################################################################
+
+# U -> T and the IUPAC ambiguity codes -> N, applied once per contig
+IUPAC_TO_TN = str.maketrans('uUyrwskmbdhvxUYRWSKMBDHVX', 'TTNNNNNNNNNNNNNNNNNNNNNNN')
 
+# Anything outside of these is a bad character in a sequence line
+BAD_SEQCHARS         = re.compile(r'[^uUyrwskmbdhvxUYRWSKMBDHVXACGTacgtnN!]')
+BAD_SEQCHARS_NOIUPAC = re.compile(r'[^acgtnN!]')
 
 #####################################################################
-# Utility functions                                                 #
+# Line classification                                               #
 #####################################################################
 
-# This is a Python implementation of the Perl cmp function
-def cmp(a, b):
-    return (a > b) - (a < b) # return 1 if a > b, -1 if a < b, 0 otherwise
-
-def sort_annots(a, b):
-    # Modified by T. HOELLINGER
-
-    # Simple case, nucleotide position is different:
-    if a[0] != b[0]:
-        return cmp(a[0], b[0])
-
-    # Simple case, line numbers are available and > 0, so compare them
-    if a[1] and b[1]:
-        return cmp(a[1], b[1])
-
-    # The new sorting function
-    fulllinea   = " "; # G-genname ==> start ;; comment
-    fulllineb   = " "; #    ||     ||
-    namea       = " "; # the genename
-    nameb       = " "; #   ||    ||
-    arrowa      = " "; # ==> or <==
-    arrowb      = " "; #  ||    ||
-    startorenda = " "; # as it said start or end
-    startorendb = " "; #         ||      ||
-
-    if a[2] == "S":
-        fulllinea = a[3].startline
-    if a[2] == "E":
-        fulllinea = a[3].endline
-    if b[2] == "S":
-        fulllineb = b[3].startline
-    if b[2] == "E":
-        fulllineb = b[3].endline
-
-    #  Cut the line were there are ;;
-    cutlinea = fulllinea.split(";;")
-    cutlineb = fulllineb.split(";;")
-
-    #  Cut the line and identify pattern
-    # Only take the part before ;;, Delete comments
-    linea = cutlinea[0] or ""
-    #     ||        ||
-    lineb = cutlineb[0] or ""
-
-    linea = linea.strip()  # Delete the spaces before, at the beginning of the description
-    lineb = lineb.strip()  #     ||        ||
-    linea = linea.rstrip() # Delete the spaces at the end of the descriptio
-    lineb = lineb.rstrip() #     ||        ||
-
-    linea       = re.match(r'([\w|\_\-\d\(\)\?]+)\s*(==>|<==)\s*(start|end)', linea)
-    namea       = linea.group(1) or "" # Get the genename
-    arrowa      = linea.group(2) or "" # Ge                                            IsDef = 1 if not char else 0 "" # Get the start or the end
-
-    lineb = re.match(r'([\w|\_\-\d\(\)\?]+)\s*(==>|<==)\s*(start|end)', lineb)
-    nameb = lineb.group(1)       or ""
-    arrowb = lineb.group(2)      or ""
-    startorendb = lineb.group(3) or ""
-
-    if arrowa == "==>" and arrowb == "==>"   and startorenda == "start" and startorendb == "start":
-        return cmp(namea, nameb)
-    elif arrowa == "==>" and arrowb == "==>" and startorenda == "end"   and startorendb == "end":
-        return cmp(nameb, namea)
-    elif arrowa == "==>" and arrowb == "==>" and startorenda == "start" and startorendb == "end":
-        return cmp(a[2], b[2])  # end before the start
-    elif arrowa == "==>" and arrowb == "==>" and startorenda == "end"   and startorendb == "start":
-        return cmp(a[2], b[2])  # end before the start
-    elif arrowa == "<==" and arrowb == "<==" and startorenda == "start" and startorendb == "start":
-        return cmp(nameb, namea)
-    elif arrowa == "<==" and arrowb == "<==" and startorenda == "end"   and startorendb == "end":
-        return cmp(namea, nameb)
-    elif arrowa == "<==" and arrowb == "<==" and startorenda == "start" and startorendb == "end":
-        return cmp(b[2], a[2])  # start before the end
-    elif arrowa == "<==" and arrowb == "<==" and startorenda == "end"   and startorendb == "start":
-        return cmp(b[2], a[2])  # start before the end
-    else:
-        return cmp(fulllinea, fulllineb)
+# Line types, as counted in Masterfile.linecounts
+LINE_HEADER       = 'header'        # '>' contig header
+LINE_BLANK        = 'blank'
+LINE_SEQUENCE     = 'sequence'      # [position] nucleotides
+LINE_ANNOTATION   = 'annotation'    # ; G-name ==> start|end|point
+LINE_COMMENT      = 'comment'       # any other line starting with ';'
+LINE_CONTINUATION = 'continuation'  # follows a line ending with '\'
+
+SEQUENCE_LINE   = re.compile(r'^\s*\d*\s*([^;].*)')
+ANNOTATION_LINE = re.compile(r'^;\s*([G])-(\S+)\s+(<==\*?|\*?==>)\s+(start|end|point)(.*)')
+INTRON_GROUP    = re.compile(r'/group=(\S+)')
+
+# Classify a stripped line of a contig on its first character, so that
+# each line goes through at most one regex. Returns the line type and
+# the match object (None for blank and comment lines).
+def classify_line(line):
+    if not line:
+        return LINE_BLANK, None
+    if line[0] == ';':
+        match = ANNOTATION_LINE.match(line)
+        if match:
+            return LINE_ANNOTATION, match
+        return LINE_COMMENT, None
+    return LINE_SEQUENCE, SEQUENCE_LINE.match(line)
+
+# Gene name patterns used once the annotations of a contig are read
+COPY_NUMBER  = re.compile(r'\_\d+')
+INTRONIC_ORF = re.compile(r'-I\d+-(\S+)$')
+SIGNAL_NAME  = re.compile(r'Sig-(.+)$')
+EXON_NAME    = re.compile(r'-E\d+(?:-\S+)?$')
+INTRON_NAME  = re.compile(r'-I\d+(?:-\S+)?$')
+TRNA_NAME    = re.compile(r'trn([\w|?]*)\([\w|?]*\)')
+
+# Annotation line followed by a ';;' comment, as rewritten by clean_contig
+TRAILING_COMMENT = re.compile(r'(.+)\s*(;;.+)$')
+
+# Genetic code of a contig, given as /trans=N in its header comments
+TRANS_CODE = re.compile(r'/trans\s*=\s*(\d+)', re.IGNORECASE)
 
+#####################################################################
+# Utility functions                                                 #
+#####################################################################
 
-# Print the sequence in fasta format X characters per line
-def fasta_block_to_fh(seq, pos, fh):
-    while seq:
-        if len(seq) > 60:
-            subseq = seq[:60]
-            fh.write(f"{pos:6d}  {subseq}\n")
-            pos += len(re.findall(r'[acgtACGTnN]', subseq))
-            seq = seq[60:]
-            continue
-        fh.write(f"{pos:6d}  {seq}\n")
-        break
+# Name, arrow and start/end of an annotation line, used to order the
+# annotations found at the same position
+ANNOT_LINE_PARTS = re.compile(r'([\w|\_\-\d\(\)\?]+)\s*(==>|<==)\s*(start|end|point)')
+
+# Wraps a value so that it sorts in reverse order inside a sort key
+class Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+# Sort key of a [position, line number, "S" or "E", annot] entry of
+# contig_to_fh, computed once per entry. This is the order of the former
+# sort_annots comparator: by position, then by line number for the
+# lines read from the masterfile. Lines without a line number (added
+# since the masterfile was read) come after those at the same position:
+#   ==> : ends before starts, starts by name, ends by reverse name
+#   <== : starts before ends, starts by reverse name, ends by name
+# and lines that can't be parsed after them, by their text.
+def annot_sort_key(entry):
+    pos, linenumber, se, annot = entry
+    if linenumber:
+        return (pos, 0, linenumber)
+
+    fullline = (annot.startline if se == "S" else annot.endline) or ""
+    match    = ANNOT_LINE_PARTS.search(fullline.split(";;")[0])
+    if not match:
+        return (pos, 1, 2, fullline)
+
+    name, arrow, startorend = match.groups()
+    if arrow == "==>":
+        if startorend == "end":
+            return (pos, 1, 0, 0, Descending(name))
+        return (pos, 1, 0, 1, name)
+    else:
+        if startorend == "end":
+            return (pos, 1, 1, 1, name)
+        return (pos, 1, 1, 0, Descending(name))
+
+
+# Gene name and annotation type of the name of a G- annotation: the
+# copy number (_X) is dropped, then the name is the one of a signal (S),
+# an exon (E), an intron (I) or else of a gene (G).
+def gene_name_and_type(name):
+    newgename = COPY_NUMBER.sub('', name)
+
+    match = INTRONIC_ORF.search(newgename)
+    if match:
+        # special case for G-cox1_2-I3-orf232
+        newgename = match.group(1)
+
+    # If it's a signal
+    match = SIGNAL_NAME.match(newgename)
+    if match:
+        return match.group(1), "S"
+    # If it's an exon
+    if EXON_NAME.search(newgename):
+        genenamecut = newgename.split("-")
+        return (genenamecut[0] if genenamecut[0] != "" else newgename), "E"
+    # If it's an intron
+    if INTRON_NAME.search(newgename):
+        genenamecut = newgename.split("-")
+        return (genenamecut[0] if genenamecut[0] != "" else newgename), "I"
+    # If it's a tRNA
+    match = TRNA_NAME.match(newgename)
+    if match:
+        return match.group(1), "G"
+    return newgename, "G"
+
+# Find the first sequence line of a contig holding a bad character,
+# only called once a contig is known to be invalid.
+def bad_sequence_line(lines, badchars):
+    for line in lines:
+        match = re.match(r'^\s*\d*\s*([^;].*)', line)
+        if match and badchars.search(match.group(1).replace(" ", "").replace("\t", "")):
+            return line
+    return None
+
+# Print the sequence in fasta format X characters per line, the
+# position of each line is the one of the previous line plus its
+# number of nucleotides (the '!' markers don't count). Given the
+# CoordinateIndex of the whole sequence (coords) and the offset of seq
+# in it, the positions are looked up in the index instead; without
+# markers in seq they're just pos plus the line offsets.
+def fasta_block_to_fh(seq, pos, fh, width=60, coords=None, offset=0):
+    lines = []
+    if '!' not in seq:
+        for start in range(0, len(seq), width):
+            lines.append(f"{pos + start:6d}  {seq[start:start+width]}\n")
+    elif coords is not None:
+        for start in range(0, len(seq), width):
+            lines.append(f"{coords.position(offset + start) + 1:6d}  {seq[start:start+width]}\n")
+    else:
+        for start in range(0, len(seq), width):
+            subseq = seq[start:start+width]
+            lines.append(f"{pos:6d}  {subseq}\n")
+            pos += len(subseq) - subseq.count('!')
+    fh.write("".join(lines))
+
+# Write size above which the text of a contig is handed to the file
+WRITE_BATCH_SIZE = 1 << 20
+
+# Open a masterfile for writing, gzip or xz compressed when asked to
+# or when the file name ends with .gz or .xz.
+def open_masterfile_output(filename, compression=None):
+    if compression is None:
+        if filename.endswith('.gz'):
+            compression = 'gzip'
+        elif filename.endswith('.xz'):
+            compression = 'xz'
+
+    if compression == 'gzip':
+        return gzip.open(filename, 'wt', compresslevel=6)
+    if compression == 'xz':
+        return lzma.open(filename, 'wt')
+    if compression:
+        raise ValueError(f"Unknown compression '{compression}', expected 'gzip' or 'xz'")
+    return open(filename, 'w', buffering=WRITE_BATCH_SIZE)
+
+# Collects the text written for a contig and passes it to the real file
+# handle in large batches instead of one write per line.
+# written counts the characters written so far.
+class BatchWriter:
+    def __init__(self, fh, batchsize=WRITE_BATCH_SIZE):
+        self.fh        = fh
+        self.batchsize = batchsize
+        self.pieces    = []
+        self.size      = 0
+        self.written   = 0
+
+    def write(self, text):
+        self.pieces.append(text)
+        self.size    += len(text)
+        self.written += len(text)
+        if self.size >= self.batchsize:
+            self.flush()
+
+    def flush(self):
+        if self.pieces:
+            self.fh.write("".join(self.pieces))
+            self.pieces = []
+            self.size   = 0
+
+# Remove AP (annot_pair) from masterfile annot_pair list. AP_to_rm is a
+# set of the id() of the annotations to remove, the list is rebuilt in a
+# single pass (in place, so other references to it see the change).
+def remove_AP(AP_to_rm, contig):
+    if not AP_to_rm:
+        return
+    contig.remove_annot_pairs(AP_to_rm)
 
-# Remove AP (annot_pair) from masterfile annot_pair list
-def remove_AP(AP_to_rm=[],contig=MasterfileContig()):
 
-    all_annots = contig.annotations
-    for i in range(len(all_annots) - 1, -1, -1):
-        contig_AP = all_annots[i]
-        id_contig_AP = id(contig_AP)
+#####################################################################
+# Compressed input                                                  #
+#####################################################################
 
-        # go over the table containing annotation
-        for id_rm_AP in AP_to_rm:
-            # It mean start is already defined
-            if id_rm_AP == id_contig_AP:
-                all_annots.remove(contig_AP)
+# Leading bytes of the compressed formats read, and the suffixes used
+# when a file can't be sniffed (e.g. a named pipe)
+COMPRESSION_MAGIC = {
+    'gzip': b'\x1f\x8b',
+    'xz':   b'\xfd7zXZ\x00',
+    'zstd': b'\x28\xb5\x2f\xfd',
+}
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.xz': 'xz', '.zst': 'zstd'}
+
+# Commands decompressing their standard input to their standard output,
+# tried in order: they run in a process of their own, alongside the
+# parser, and pigz and xz (5.4 and later) decompress with several
+# threads.
+DECOMPRESSION_COMMANDS = {
+    'gzip': [['pigz', '-dc'], ['gzip', '-dc']],
+    'xz':   [['xz', '-dc', '-T0']],
+    'zstd': [['zstd', '-dcq']],
+}
+
+# Read size of the decompressed streams
+READ_BUFFER_SIZE = 1 << 20
+
+# Compression of a masterfile ('gzip', 'xz' or 'zstd'), found from its
+# first bytes, or from its suffix when it isn't a regular file. None
+# for a plain text file.
+def input_compression(filename):
+    if not os.path.isfile(filename):
+        return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1])
+    with open(filename, 'rb') as fh:
+        head = fh.read(8)
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+# Open a masterfile for reading ('r' or 'rb'), decompressing it on the
+# fly when it's compressed. With external=True (the default) the data
+# is decompressed by one of the DECOMPRESSION_COMMANDS when one is
+# installed, else in this process. Either way a corrupt or truncated
+# file raises a ValueError when it's read.
+def open_masterfile_input(filename, mode='r', external=True):
+    compression = input_compression(filename)
+    if compression is None:
+        return open(filename, mode)
+
+    raw = None
+    if external:
+        for command in DECOMPRESSION_COMMANDS[compression]:
+            if shutil.which(command[0]):
+                raw = DecompressionProcess(command, filename)
+                break
+    if raw is None:
+        raw = DecompressionStream(filename, compression)
+    fh = io.BufferedReader(raw, READ_BUFFER_SIZE)
+    return fh if 'b' in mode else io.TextIOWrapper(fh)
+
+# Bytes [start, end) of a masterfile, of its decompressed text when it
+# is compressed: those are read through up to start, as a compressed
+# file can't be seeked into.
+def read_byte_range(filename, start, end):
+    with open_masterfile_input(filename, 'rb') as fh:
+        if fh.seekable():
+            fh.seek(start)
+        else:
+            skip = start
+            while skip > 0:
+                skipped = len(fh.read(min(skip, READ_BUFFER_SIZE)))
+                if not skipped:
+                    break
+                skip -= skipped
+        return fh.read(end - start)
+
+# Raw stream of a file decompressed in this process, by gzip, lzma or
+# (optional dependency, only needed without the zstd command)
+# zstandard. Decompression errors (e.g. on a truncated file) are raised
+# as a ValueError, as by DecompressionProcess.
+class DecompressionStream(io.RawIOBase):
+    def __init__(self, filename, compression):
+        self.filename = filename
+        self.errors   = (EOFError, gzip.BadGzipFile, zlib.error, lzma.LZMAError)
+        if compression == 'gzip':
+            self.fh = gzip.open(filename, 'rb')
+        elif compression == 'xz':
+            self.fh = lzma.open(filename, 'rb')
+        else:
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError(f"Masterfile '{filename}' is zstd compressed: the zstd command or the zstandard module is needed to read it")
+            self.fh      = zstandard.open(filename, 'rb')
+            self.errors += (zstandard.ZstdError,)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            return self.fh.readinto(buffer)
+        except self.errors as error:
+            raise ValueError(f"Can't decompress masterfile '{self.filename}': {error}") from error
+
+    def close(self):
+        if not self.closed:
+            self.fh.close()
+        super().close()
+
+# Raw stream of the standard output of a decompression command run on
+# a file. The command failing (e.g. on a truncated file) is raised as a
+# ValueError at the end of the stream; closing the stream before its
+# end kills the command.
+class DecompressionProcess(io.RawIOBase):
+    def __init__(self, command, filename):
+        self.command  = command
+        self.filename = filename
+        with open(filename, 'rb') as stdin:
+            self.process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.process.stdout.readinto(buffer)
+        if not count:
+            self.process.wait()
+            if self.process.returncode != 0:
+                error = self.process.stderr.read().decode(errors='replace').strip()
+                raise ValueError(f"Can't decompress masterfile '{self.filename}' ({' '.join(self.command)}): {error}")
+        return count
+
+    def close(self):
+        if not self.closed:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process.stderr.close()
+        super().close()
 
 
 #####################################################################
@@ -131,558 +392,1028 @@ class Masterfile:
         self.header     = []
         self.comment    = None
         self.contigs    = None
+        self.linecounts = Counter()  # lines parsed, by line type
+        self.cleanstats = []         # one entry per contig cleaned
+        self.stats      = Counter()  # contigs parsed and written, annotations paired, bytes written...
+        self.profiler   = NULL_PROFILER  # times the parse, clean and write stages (see profiler.py)
 
+        # Filled by index_masterfile and get_contig_by_name
+        self.contigindex  = None     # name -> (name, offset, length, sequence length)
+        self.indexoptions = (0, False)
+        self.contigbyname = None     # name -> contig already parsed
 
-    def clean_pirmaster(self, tmpdir=None):
-        AP_to_rm = []
+        # The masterfile as it was parsed, for object_to_masterfile(splice=True)
+        self.sourcestat   = None     # (size, mtime) of self.filename
+        self.sourceheader = None     # copy of self.header
 
+
+    def clean_pirmaster(self, tmpdir=None):
+        for contig in self.iter_clean_pirmaster(tmpdir):
+            pass
+
+    # Clean the contigs one at a time and write each of them to
+    # tmpdir/Masterfile_copy as soon as it is cleaned; the cleaned
+    # contigs are yielded so that a caller can stream them further
+    # (e.g. to contigs.fna) without holding the whole masterfile.
+    # When contigs is None, the contigs already loaded in self are used.
+    # When tmpdir is None, no copy is written: the cleaned contigs are
+    # only yielded.
+    def iter_clean_pirmaster(self, tmpdir=None, contigs=None):
+        if contigs is None:
+            contigs = self.contigs
+
+        if tmpdir is None:
+            yield from self._clean_contigs(contigs, None)
+            return
+
+        with open_masterfile_output(f"{tmpdir}/Masterfile_copy") as fh:
+            self.header_to_fh(fh)
+            yield from self._clean_contigs(contigs, fh)
+
+    def _clean_contigs(self, contigs, fh):
         # Check each annot push all annot to remove on $AP_to_rm, changed the other one
         isUnique = {}
         count    = 0
-        for contig in self.contigs:
-            annotations = contig.annotations
-            contigname  = contig.name
-            comments    = contig.namecomments or ""
-            header      = contigname + comments
-
-            if header in isUnique:
-                isUnique[header] += 1
-            else:
-                isUnique[header]  = 1
+        for contig in contigs:
+            count += 1
+            with self.profiler.stage('clean'):
+                self.clean_contig(contig, count, isUnique)
+            if fh is not None:
+                with self.profiler.stage('write'):
+                    self.contig_to_fh(contig, fh)
+            yield contig
+
+    # Clean a single contig in place: renamed to "contig<count>", sequence
+    # unmarked and upper-cased, annotations rewritten as mfannot comments.
+    # isUnique is shared between the calls to detect duplicated headers.
+    # The number of annotations dropped and rewritten is appended to
+    # self.cleanstats and returned.
+    def clean_contig(self, contig, count, isUnique):
+        AP_to_rm    = set()
+        skipped     = 0
+        annotations = contig.annotations
+        contigname  = contig.name
+        comments    = contig.namecomments or ""
+        header      = contigname + comments
+
+        if header in isUnique:
+            isUnique[header] += 1
+        else:
+            isUnique[header]  = 1
 
-            if isUnique[header] > 1:
-                raise ValueError(f"Two contigs have same header '{header}'\n")
+        if isUnique[header] > 1:
+            raise ValueError(f"Two contigs have same header '{header}'\n")
 
-            count += 1
+        # Clean name and comments
+        contig.name         = "contig" + str(count)
+        contig.namecomments = ""
 
-            # Clean name and comments
-            contig.name         = "contig" + str(count)
-            contig.namecomments = ""
-
-            seq                 = contig.sequence
-            seq                 = seq.replace("!", "")
-            seq                 = seq.upper()
-            contig.sequence     = seq
-            for annot_pair in annotations:
-                type          = annot_pair.type
-                startline     = annot_pair.startline or ""
-                endline       = annot_pair.endline   or ""
-
-                new_startline = None
-                new_endline   = None
-
-                id_AP = id(annot_pair)
-
-                if type == "C":
-                    if startline and not startline.startswith(";; mfannot:"):
-                        continue
-                    if endline and not endline.startswith(";; mfannot:"):
-                        continue
-
-                annot_pair.type = "C"
-
-                if endline != None and startline != None:
-                    if not startline.startswith(";; mfannot:"):
-                        startline_match = re.match(r'(.+)\s*(;;.+)$', startline)
-                        if startline_match:
-                            if not re.search(r'mfannot:', startline_match.group(2)):
-                                new_startline        = startline_match.group(2)
-                                annot_pair.startline = new_startline
-                                if new_startline == "":
-                                    annot_pair.startpos = None
-
-                    if not endline.startswith(";; mfannot:"):
-                        endline_match = re.match(r'(.+)\s*(;;.+)$', endline)
-                        if endline_match:
-                            if not re.search(r'mfannot:', endline_match.group(2)):
-                                new_endline        = endline_match.group(2)
-                                annot_pair.endline = new_endline
-                                if new_endline == "":
-                                    annot_pair.endpos = None
-
-                    if new_startline == None and new_endline == None:
-                        AP_to_rm.append(id_AP)
-                        continue
-
-                elif endline == None:
-                    if startline.startswith(";; mfannot:"):
-                        AP_to_rm.append(id_AP)
-                        continue
-                    else:
-                        new_startline = ";$startline ;; mfannot: no end found"
+        seq                 = contig.sequence
+        if isinstance(seq, ContigSequence):
+            seq             = seq.without_markers().upper()
+        else:
+            seq             = seq.replace("!", "")
+            seq             = seq.upper()
+        contig.sequence     = seq
+        rewritten = 0
+        for annot_pair in annotations:
+            type          = annot_pair.type
+            startline     = annot_pair.startline or ""
+            endline       = annot_pair.endline   or ""
+
+            new_startline = None
+            new_endline   = None
+
+            if type == "C":
+                if startline and not startline.startswith(";; mfannot:"):
+                    skipped += 1
+                    continue
+                if endline and not endline.startswith(";; mfannot:"):
+                    skipped += 1
+                    continue
 
+            annot_pair.type = "C"
+
+            # Only the trailing ';;' comment of each line is kept (an
+            # mfannot comment is left as is), an annotation without any
+            # is dropped
+            if not startline.startswith(";; mfannot:"):
+                startline_match = TRAILING_COMMENT.match(startline)
+                if startline_match and 'mfannot:' not in startline_match.group(2):
+                    new_startline        = startline_match.group(2)
                     annot_pair.startline = new_startline
-                    continue
-                else:
-                    if endline.startswith(";; mfannot:"):
-                        AP_to_rm.append(id_AP)
-                        continue
-                    else:
-                        new_endline = ";$endline ;; mfannot: no start found"
 
+            if not endline.startswith(";; mfannot:"):
+                endline_match = TRAILING_COMMENT.match(endline)
+                if endline_match and 'mfannot:' not in endline_match.group(2):
+                    new_endline        = endline_match.group(2)
                     annot_pair.endline = new_endline
-                    continue
+
+            if new_startline is None and new_endline is None:
+                AP_to_rm.add(id(annot_pair))
+                continue
+            rewritten += 1
 
         remove_AP(AP_to_rm, contig)
-        self.object_to_masterfile(f"{tmpdir}/Masterfile_copy")
 
+        dropped   = len(AP_to_rm)
+        self.cleanstats.append({
+            'contig'    : contig.name,
+            'header'    : header,
+            'dropped'   : dropped,
+            'rewritten' : rewritten,
+        })
+        return dropped, rewritten
+
+    # With compact=True the sequences are stored as ContigSequence
+    # (2-bit packed, '!' markers kept apart) instead of str. With
+    # workers > 1 the contigs are parsed by a pool of that many processes.
+    # With cache=True (or the path of a cache directory) the parsed object
+    # is loaded from/saved to a binary cache, see cached_object_from_masterfile.
+    # A gzip, xz or zstd compressed masterfile is decompressed on the fly
+    # (see open_masterfile_input), and always parsed serially: its byte
+    # ranges can't be handed to the workers.
+    def object_from_masterfile(self, filename, RemoveIupac=0, compact=False, workers=None, cache=None):
+        if cache:
+            cachedir = None if cache is True else cache
+            return self.cached_object_from_masterfile(filename, RemoveIupac, compact, workers, cachedir)
+        if workers and workers > 1 and input_compression(filename) is None:
+            with self.profiler.stage('parse'):
+                return self.parallel_object_from_masterfile(filename, RemoveIupac, compact, workers)
+        self.contigs      = list(self.iter_contigs(filename, RemoveIupac, compact))
+        self.contigbyname = None
+        return self
 
-    def object_from_masterfile(self, filename, RemoveIupac=0):
-        self.filename = filename
+    # Load the parsed masterfile from its binary cache, stored next to it
+    # or in cachedir. The cache is keyed by the path, size, mtime and
+    # content hash of the masterfile (and the parsing options): when any
+    # of them changed, the masterfile is parsed again and the cache saved.
+    def cached_object_from_masterfile(self, filename, RemoveIupac=0, compact=False, workers=None, cachedir=None):
+        cachefile = masterfile_cache_filename(filename, cachedir)
+        key       = masterfile_cache_key(filename, RemoveIupac, compact)
+
+        with self.profiler.stage('cache load'):
+            state = load_masterfile_cache(cachefile, key)
+        if state is not None:
+            self.header, self.comment, self.contigs, counts, stats = state
+            self.filename     = filename
+            self.contigbyname = None
+            self.sourcestat   = source_stat(filename)
+            self.sourceheader = list(self.header)
+            self.linecounts.update(counts)
+            self.stats.update(stats)
+            return self
+
+        self.object_from_masterfile(filename, RemoveIupac, compact, workers)
+        with self.profiler.stage('cache save'):
+            save_masterfile_cache(cachefile, key, (self.header, self.comment, self.contigs, self.linecounts, self.stats))
+        return self
 
+    # Parse the header here, then hand byte ranges holding whole contigs
+    # to a process pool. The contigs come back in the order of the file
+    # and are identical to the ones of a serial parse (line numbers are
+    # counted from each contig header).
+    def parallel_object_from_masterfile(self, filename, RemoveIupac=0, compact=False, workers=2):
+        self.filename   = filename
+        self.sourcestat = source_stat(filename)
         with open(filename, 'r') as fh:
-            lines = fh.readlines()
-        lines = [line.strip() for line in lines]
+            self.header_from_fh(fh)
+
+        ranges  = contig_ranges(filename, workers * PARALLEL_CHUNKS_PER_WORKER)
+        contigs = []
+        if ranges:
+            # Imported here, it's slow to import and a serial parse doesn't need it
+            from concurrent.futures import ProcessPoolExecutor
+
+            starts = [start for start, end in ranges]
+            ends   = [end   for start, end in ranges]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(
+                    parse_masterfile_range,
+                    repeat(filename), starts, ends, repeat(RemoveIupac), repeat(compact),
+                )
+                for range_contigs, linecounts, stats in results:
+                    contigs.extend(range_contigs)
+                    self.linecounts.update(linecounts)
+                    self.stats.update(stats)
+
+            # The ranks were counted from the start of each range
+            for rank, contig in enumerate(contigs):
+                contig.source = (filename, rank)
+
+        self.contigs      = contigs
+        self.contigbyname = None
+        return self
 
-        row            = 0
+    # Read the header block of the masterfile, then return a generator
+    # yielding the parsed contigs one by one. Only the lines of the
+    # contig being parsed are held in memory.
+    def iter_contigs(self, filename, RemoveIupac=0, compact=False):
+        self.filename   = filename
+        self.sourcestat = source_stat(filename)
+
+        fh = open_masterfile_input(filename)
+        try:
+            line = self.header_from_fh(fh)
+        except BaseException:
+            fh.close()
+            raise
+
+        return self._iter_contigs_from_fh(fh, line, RemoveIupac, compact)
+
+    # Read the header block (everything before the first '>' line),
+    # set self.header and self.comment and return the first contig
+    # header line, or None if the masterfile has no contig.
+    def header_from_fh(self, fh):
         header         = []
         comment_header = []
         after_header   = 0
 
-        while row < len(lines) and not lines[row].startswith('>'):
-            line = lines[row]
+        line = None
+        for line in fh:
+            line = line.strip()
+            if line.startswith('>'):
+                break
             if line.startswith(';; end mfannot'):
-                row         += 1
                 after_header = 1
                 continue
             if after_header == 0:
                 header.append(line)
-                row += 1
             else:
                 comment_header.append(line)
-                row += 1
+        else:
+            line = None
 
-        self.header   = header
-        MFheaderisDef = len(comment_header)
+        self.header       = header
+        self.sourceheader = list(header)
+        MFheaderisDef     = len(comment_header)
         if MFheaderisDef == 0:
             self.comment = header
         else:
             self.comment = comment_header
 
-        contigs = []
-        # Parse each contigs
-        while True:
-            if row >= len(lines):
-                break
-
-            contig = MasterfileContig()
-
-            line = lines[row]
-
-            row += 1
-            match = re.match(r'^>\s*(\S+)(.*)', line)
-            if not match:
-                raise ValueError(f"Can't parse header line of masterfile '{filename}'. Line is:\n{line}\n")
-            else:
-                faname       = match.group(1)
-                contig.name  = faname
-                namecomments = match.group(2)
-                if namecomments != "" and re.match(r'/trans\s*=\s*(\d+)/i', namecomments):
-                    contig.geneticcode = namecomments.group(1)
-                if namecomments != "":
-                    contig.namecomments = namecomments
-
-            seq        = ""
-            annotexp   = {}
-            allannots  = []
-            seqpos     = 0 # in computer coordinates, not biological coordinates!
-            linenumber = 0
-
-            while row < len(lines):
-                linenumber += 1
-                line        = lines[row]
-                row        += 1
-
-                if not line.strip():
-                    continue
-                if line.startswith('>'):
-                    row -= 1
+        return line
+
+    # Generator behind iter_contigs, closes fh once exhausted.
+    def _iter_contigs_from_fh(self, fh, line, RemoveIupac=0, compact=False):
+        with fh:
+            yield from self.profiler.timed('parse', self.contigs_from_lines(fh, line, RemoveIupac, compact))
+
+    # Parse the contigs from an iterable over the lines following the
+    # '>' header line of the first of them, one contig at a time. Their
+    # source is self.filename and their rank in it, counted from 0.
+    def contigs_from_lines(self, lines, line, RemoveIupac=0, compact=False):
+        lines = iter(lines)
+        rank  = 0
+        while line is not None:
+            # Collect the lines up to the next contig header
+            contiglines = []
+            nextline    = None
+            for nextline in lines:
+                nextline = nextline.strip()
+                if nextline.startswith('>'):
                     break
+                contiglines.append(nextline)
+            else:
+                nextline = None
+
+            contig        = self.contig_from_lines(line, contiglines, RemoveIupac, compact)
+            contig.source = (self.filename, rank)
+            rank         += 1
+            yield contig
+            line = nextline
+
+    # Parse the contigs held in the [start, end) byte range of a
+    # masterfile, start being the offset of a '>' header line (in the
+    # decompressed text of a compressed masterfile).
+    def contigs_from_range(self, filename, start, end, RemoveIupac=0, compact=False):
+        text = read_byte_range(filename, start, end).decode()
+
+        lines = io.StringIO(text, newline=None)
+        line  = next(lines).strip()
+        return list(self.contigs_from_lines(lines, line, RemoveIupac, compact))
+
+    # Parse one contig from its '>' header line and the (stripped)
+    # lines that follow it, up to the next header.
+    def contig_from_lines(self, line, lines, RemoveIupac=0, compact=False):
+        row    = 0
+        contig = MasterfileContig()
+
+        match = re.match(r'^>\s*(\S+)(.*)', line)
+        if not match:
+            raise ValueError(f"Can't parse header line of masterfile '{self.filename}'. Line is:\n{line}\n")
+        else:
+            faname       = match.group(1)
+            contig.name  = faname
+            namecomments = match.group(2)
+            transcode    = TRANS_CODE.search(namecomments)
+            if transcode:
+                contig.genetic_code = int(transcode.group(1))
+            if namecomments != "":
+                contig.namecomments = namecomments
+
+        seqchunks  = []
+        annotexp   = {}
+        allannots  = []
+        seqpos     = 0 # in computer coordinates, not biological coordinates!
+        linenumber = 0
+
+        linecounts = self.linecounts
+        linecounts[LINE_HEADER] += 1
+
+        while row < len(lines):
+            linenumber += 1
+            line        = lines[row]
+            row        += 1
+
+            linetype, match        = classify_line(line)
+            linecounts[linetype]  += 1
+
+            if linetype == LINE_BLANK:
+                continue
+            if linetype == LINE_SEQUENCE:
+                dna = match.group(1)
+                if not dna.strip():
+                    continue  # ignore blank lines
+                dna = dna.replace(" ", "").replace("\r", "").replace("\n", "").replace("\t", "")
+                # The characters are checked once for the whole contig below
+                seqchunks.append(dna)  # includes special characters such as '!'
+                seqpos += len(dna) - dna.count('!')  # count without the '!'s.
+                continue
 
-                match = re.match(r'^\s*\d*\s*([^;].*)', line)
-                if match:
-                    dna = match.group(1)
-                    if not dna.strip():
-                        continue  # ignore blank lines
-                    dna = dna.replace(" ", "").replace("\r", "").replace("\n", "").replace("\t", "")
-                    if RemoveIupac:
-                        if not re.match(r'^[acgtnN!]+$', dna):
-                            raise ValueError(f"Bad characters in sequence line?!??\nLine: {line}\n")
-                        seq    += dna  # includes special characters such as '!'
-                        seqpos += len(re.findall(r'[acgtACGTnN]', dna))  # count without the '!'s.
+            if linetype == LINE_ANNOTATION:
+                type, name, arrow, startend, comment = match.groups()
+                group       = INTRON_GROUP.search(line)
+                intron_type = sys.intern(group.group(1)) if group else ""
+                arrow       = sys.intern(arrow)
+
+                # The line is kept as the (shared) parts around the name
+                lineprefix  = line[:match.start(2)]
+                linesuffix  = line[match.end(2):]
+
+                multicomment = []
+                while row < len(lines):
+                    if not lines[row-1].endswith('\\'):
+                        break
+                    multicomment.append(lines[row])
+                    linecounts[LINE_CONTINUATION] += 1
+                    row += 1
+
+                pos = None
+                if arrow.endswith('>'):
+                    if startend == 'start' or startend == 'point':
+                        pos = seqpos + 1
                     else:
-                        if not re.match(r'^[uUyrwskmbdhvxUYRWSKMBDHVXACGTacgtnN!]+$', dna):
-                            raise ValueError(f"Bad characters in sequence line?!??\nLine: {line}\n")
-                        seq    += dna  # includes special characters such as '!'
-                        seqpos += len(re.findall(r'[uUyrwskmbdhvxUYRWSKMBDHVXacgtACGTnN]', dna))  # count without the '!'s.
-                        seq     = seq.translate(str.maketrans('uUyrwskmbdhvxUYRWSKMBDHVX', 'TTNNNNNNNNNNNNNNNNNNNNNNN'))
-                    continue
-
-                if re.match(r'^;\s*([G])-(\S+)\s+(<==\*?|\*?==>)\s+(start|end|point)(.*)', line):
-                    type, name, arrow, startend, comment = re.match(r'^;\s*([G])-(\S+)\s+(<==\*?|\*?==>)\s+(start|end|point)(.*)', line).groups()
-                    intron_type = re.search(r'/group=(\S+)', line).group(1) if re.search(r'/group=(\S+)', line) else ""
-
-                    multicomment = []
-                    while row < len(lines):
-                        if not line.startswith(';') or not lines[row-1].endswith('\\'):
-                            break
-                        multicomment.append(lines[row])
-                        row += 1
-
-                    pos = None
-                    if arrow == '>':
-                        if startend == 'start' or startend == 'point':
-                            pos = seqpos + 1
-                        else:
-                            pos = seqpos
+                        pos = seqpos
+                else:
+                    if startend == 'end':
+                        pos = seqpos + 1
                     else:
-                        if startend == 'end':
-                            pos = seqpos + 1
+                        pos = seqpos
+
+                annotkey = f"{type}-{name}".lower()
+
+                ### structure of data : a hash called annotexp, keyed by the
+                ### lower cased G-name, contains a deque of the annotations still
+                ### waiting for their other side, oldest first. They all wait for
+                ### the same side: a start arriving while ends are waiting is
+                ### paired with the oldest of them (and the other way around), in
+                ### O(1) whatever the number of copies.
+
+                if startend == "point":
+                    # Create a new AnnotPair
+                    annot = AnnotPair(
+                        type       = type,
+                        introntype = intron_type,
+                        genename   = name,
+                        direction  = arrow
+                    )
+                    annot.startpos          = pos
+                    annot.endpos            = pos
+                    annot.set_startline_parts(lineprefix, name, linesuffix)
+                    annot.startmulticomment = multicomment or None
+                    annot.startlinenumber   = linenumber
+                    allannots.append(annot)
+                else:
+                    waiting = annotexp.get(annotkey)
+                    if waiting is None:
+                        waiting = annotexp[annotkey] = deque()
+
+                    if startend == "start":
+                        # Waiting annotations either all lack their start or all lack their end
+                        if waiting and waiting[0].startline is None:
+                            # Pair with the oldest annotation waiting for its start
+                            annot = waiting.popleft()
+                            allannots.append(annot)
                         else:
-                            pos = seqpos
-
-                    annotkey = f"{type}-{name}".lower()
-
-                    ### structure of date : a hash called annotexp, contains a
-                    ### table. This one contains an other hash for storing annotation
-                    ### The last hash array has 3 keys :
-                    ### 1 -> start : if it's defined, start pos is defined in annotation
-                    ### 2 -> end : if it's defined, end pos is defined in annotation
-                    ### 3 -> annot : contains the annotation itself
-
-                    if startend == "point":
-                        # Create a new AnnotPair
-                        annot = AnnotPair(
-                            type       = type,
-                            introntype = intron_type,
-                            genename   = name,
-                            direction  = arrow
-                        )
+                            annot = AnnotPair(
+                                type       = type,
+                                introntype = intron_type,
+                                genename   = name,
+                                direction  = arrow
+                            )
+                            waiting.append(annot)
                         annot.startpos          = pos
-                        annot.endpos            = pos
-                        annot.startline         = line
-                        annot.startmulticomment = multicomment
+                        annot.set_startline_parts(lineprefix, name, linesuffix)
+                        annot.startmulticomment = multicomment or None
                         annot.startlinenumber   = linenumber
-                        allannots.append(annot)
                     else:
-                        if annotkey in annotexp:
-                            table = annotexp[annotkey]
-                            if startend == "start":
-                                count      = 0
-                                hasdefined = 0
-                                # go over the table containing annotation
-                                while count < len(table):
-                                    infos = table[count]
-                                    # here we get if it's start or stop
-                                    state = infos['startend']
-                                    # It mean start is already defined
-                                    if state == 'start' or state == 'finish':
-                                        count += 1
-                                        continue
-                                    # Means that end
-                                    else:
-                                        annot = infos['annotation']
-
-                                        annot.startpos          = pos
-                                        annot.startline         = line
-                                        annot.startmulticomment = multicomment
-                                        annot.startlinenumber   = linenumber
-
-                                        allannots.append(annot)
-                                        infos['startend'] = 'finish'
-                                        hasdefined = 1
-                                        break
-                                # It means that annotation array has been running without finding an empty
-                                # case, a corresponding annotation in existing annotation
-                                if hasdefined == 0:
-                                    newinfos = {}
-                                    # It's just to define the thing
-                                    newinfos['startend'] = 'start'
-                                    annot = AnnotPair(
-                                        type       = type,
-                                        introntype = intron_type,
-                                        genename   = name,
-                                        direction  = arrow
-                                    )
-                                    annot.startpos          = pos
-                                    annot.startline         = line
-                                    annot.startmulticomment = multicomment
-                                    annot.startlinenumber   = linenumber
-
-                                    newinfos['annotation'] = annot
-                                    table.append(newinfos)
-                            else:
-                                count      = 0
-                                 # a variable that allows to
-                                hasdefined = 0
-                                # go over the table containing annotation
-                                while count < len(table):
-                                    infos = table[count]
-                                    # here we get if it's start or stop
-                                    state = infos['startend']
-                                    # It mean start is already defined
-                                    if state == 'end' or state == 'finish':
-                                        count += 1
-                                        continue
-                                    # Means that end
-                                    else:
-                                        annot = infos['annotation']
-                                        annot.endpos          = pos
-                                        annot.endline         = line
-                                        annot.endmulticomment = multicomment
-                                        annot.endlinenumber   = linenumber
-
-                                        allannots.append(annot)
-                                        infos['startend'] = 'finish'
-                                        hasdefined = 1
-                                        break
-                                # It means that annotation array has been running without finding an empty
-                                # case, a corresponding annotation in existing annotation
-                                if hasdefined == 0:
-                                    newinfos = {}
-                                    # It's just to define the thing
-                                    newinfos['startend'] = 'end'
-                                    annot = AnnotPair(
-                                        type       = type,
-                                        introntype = intron_type,
-                                        genename   = name,
-                                        direction  = arrow
-                                    )
-                                    annot.endpos          = pos
-                                    annot.endline         = line
-                                    annot.endmulticomment = multicomment
-                                    annot.endlinenumber   = linenumber
-
-                                    newinfos['annotation'] = annot
-                                    table.append(newinfos)
+                        if waiting and waiting[0].endline is None:
+                            # Pair with the oldest annotation waiting for its end
+                            annot = waiting.popleft()
+                            allannots.append(annot)
                         else:
-                            annot =  AnnotPair(
+                            annot = AnnotPair(
                                 type       = type,
                                 introntype = intron_type,
                                 genename   = name,
-                                direction  = arrow,
+                                direction  = arrow
                             )
-                            if startend == "start":
-                                annot.startpos          = pos
-                                annot.startline         = line
-                                annot.startmulticomment = multicomment
-                                annot.startlinenumber   = linenumber
-                            if startend == "end":
-                                annot.endpos          = pos
-                                annot.endline         = line
-                                annot.endmulticomment = multicomment
-                                annot.endlinenumber   = linenumber
-                            # hash array containing, start stop, and the annot
-                            infos = {}
-                            # It's just to define the thing
-                            infos['startend']   = startend
-                            infos['annotation'] = annot
-                            table = []
-                            # we put the hashing table in the table
-                            table.append(infos)
-                            annotexp[annotkey] = table
-                    continue
-
-                if line.startswith(';'):
-                    multicomment = []
-                    while row < len(lines):
-                        if not lines[row].startswith(';') or not lines[row-1].endswith('\\'):
-                            row += 1
-                            break
-                        multicomment.append(lines[row])
+                            waiting.append(annot)
+                        annot.endpos          = pos
+                        annot.set_endline_parts(lineprefix, name, linesuffix)
+                        annot.endmulticomment = multicomment or None
+                        annot.endlinenumber   = linenumber
+                continue
 
-                    annot = AnnotPair(
-                        type              = "C",  # a comment
-                        startpos          = seqpos+1,
-                        startline         = line,
-                        startmulticomment = multicomment,
-                        startlinenumber   = linenumber,
-                    )
+            if linetype == LINE_COMMENT:
+                multicomment = []
+                while row < len(lines):
+                    if not lines[row-1].endswith('\\'):
+                        break
+                    multicomment.append(lines[row])
+                    linecounts[LINE_CONTINUATION] += 1
+                    row += 1
+
+                annot = AnnotPair(
+                    type              = "C",  # a comment
+                    startpos          = seqpos+1,
+                    startline         = line,
+                    startmulticomment = multicomment or None,
+                    startlinenumber   = linenumber,
+                )
+
+                allannots.append(annot)
+                continue
 
-                    allannots.append(annot)
-                    continue
+            raise ValueError(f"Unexpected line:\n{line}\n")
+
+        #  checking annotations
+        paired = 0
+        for annot in allannots:
+            if annot.type == 'G':
+                genename, annot.type = gene_name_and_type(annot.genename)
+
+                # Names repeat across copies, exons and introns: share them
+                annot.genename = sys.intern(genename)
+                if annot.endline is not None:
+                    paired += 1
+
+        # Annotations still waiting for their other side are dropped
+        stats = self.stats
+        stats['contigs parsed']       += 1
+        stats['annotations']          += len(allannots)
+        stats['annotations paired']   += paired
+        stats['annotations unpaired'] += sum(len(waiting) for waiting in annotexp.values())
+        annotexp = None
+
+        # Join, validate and translate the sequence once per contig
+        seq       = "".join(seqchunks)
+        seqchunks = None
+        badchars  = BAD_SEQCHARS_NOIUPAC if RemoveIupac else BAD_SEQCHARS
+        if badchars.search(seq):
+            line = bad_sequence_line(lines, badchars)
+            raise ValueError(f"Bad characters in sequence line?!??\nLine: {line}\n")
+        if not RemoveIupac:
+            seq = seq.translate(IUPAC_TO_TN)
+
+        contig.annotations    = allannots
+        seqlen                = len(seq) - seq.count('!')
+        contig.sequencelength = seqlen
+
+        if compact:
+            seq = ContigSequence.from_string(seq)
+        contig.sequence = seq
+        contig.mark_parsed()
+
+        return contig
+
+    # The output is gzip/xz compressed with compression='gzip' or 'xz',
+    # or when filename ends with .gz or .xz.
+    #
+    # With splice=True, the contigs not changed since they were parsed
+    # (see MasterfileContig.unchanged) and the header, when unchanged, are
+    # copied byte for byte from the masterfile they were parsed from and
+    # only the others are written again. The masterfile is written in
+    # full when it can't be spliced: compressed output, or the source
+    # file changed or gone since it was parsed.
+    def object_to_masterfile(self, filename, compression=None, splice=False):
+        with self.profiler.stage('write'):
+            if splice and compression is None and not filename.endswith(('.gz', '.xz')):
+                ranges = self.source_ranges()
+                if ranges is not None:
+                    self.splice_to_masterfile(filename, ranges)
+                    return
+            with open_masterfile_output(filename, compression) as fh:
+                self.header_to_fh(fh)
+                for contig in self.contigs:
+                    self.contig_to_fh(contig, fh)
+
+    # (offset, length) byte ranges of the header and of each contig in
+    # the masterfile parsed, from its sidecar index when up to date. None
+    # when the file changed since it was parsed, or is compressed.
+    def source_ranges(self):
+        if self.filename is None or self.sourcestat is None:
+            return None
+        try:
+            if source_stat(self.filename) != self.sourcestat or input_compression(self.filename):
+                return None
+        except OSError:
+            return None
+
+        entries = read_contig_index(self.filename)
+        if entries is not None:
+            ranges = [(offset, length) for name, offset, length, seqlen in entries]
+        else:
+            offsets = contig_offsets(self.filename)
+            ends    = offsets[1:] + [self.sourcestat[0]]
+            ranges  = [(start, end - start) for start, end in zip(offsets, ends)]
+        first = ranges[0][0] if ranges else self.sourcestat[0]
+        return [(0, first)] + ranges
+
+    def splice_to_masterfile(self, filename, ranges):
+        source = self.filename
+        header = ranges[0]
+        ranges = ranges[1:]
+
+        # Never write over the file being read
+        output = filename
+        if os.path.exists(filename) and os.path.samefile(filename, source):
+            output = f"{filename}.{os.getpid()}.tmp"
+
+        spliced = 0
+        with open(source, 'rb') as src, open(output, 'wb') as dst:
+            if self.header == self.sourceheader:
+                copy_byte_range(src, dst, *header)
+                self.stats['bytes copied'] += header[1]
+            else:
+                text = io.StringIO()
+                self.header_to_fh(text)
+                dst.write(text.getvalue().encode())
+
+            for contig in self.contigs:
+                contigsource = contig.source
+                if contigsource is not None and contigsource[0] == source and contigsource[1] < len(ranges) and contig.unchanged():
+                    offset, length = ranges[contigsource[1]]
+                    copy_byte_range(src, dst, offset, length)
+                    spliced                    += 1
+                    self.stats['bytes copied'] += length
+                else:
+                    text = io.StringIO()
+                    self.contig_to_fh(contig, text)
+                    dst.write(text.getvalue().encode())
+        self.stats['contigs spliced'] += spliced
 
-                raise ValueError(f"Unexpected line:\n{line}\n")
-
-            #  checking annotations
-            for annot in allannots:
-                if annot.type == 'G':
-                    # For the genename, deleting the _X : the number of each copy
-                    newgename = annot.genename
-                    newgename = re.sub(r'\_\d+', '', newgename)
-
-                    if re.match(r'-I\d+-(\S+)$', newgename):
-                        # special case for G-cox1_2-I3-orf232
-                        newgename = re.match(r'-I\d+-(\S+)$', newgename).group(1)
-
-                    annot.genename = newgename
-
-                    # If it's a gene
-                    if re.match(r'Sig-(.+)$', annot.genename):
-                        annot.genename = re.match(r'Sig-(.+)$', annot.genename).group(1)
-                        annot.type = "S"
-                    # If it's an exon
-                    elif re.match(r'-E\d+$', annot.genename) or re.match(r'-E\d+-\S+$', annot.genename):
-                        genenamecut = annot.genename.split("-")
-                        annot.genename = genenamecut[0] if genenamecut[0] != "" else annot.genename
-                        annot.type = "E"
-                    # If it's an intron
-                    elif re.match(r'-I\d+$', annot.genename) or re.match(r'-I\d+-\S+$', annot.genename):
-                        genenamecut = annot.genename.split("-")
-                        annot.genename = genenamecut[0] if genenamecut[0] != "" else annot.genename
-                        annot.type = "I"
-                    # If it's a tRNA
-                    elif re.match(r'trn[\w|?]*\([\w|?]*\)', annot.genename):
-                        annot.genename = re.match(r'trn([\w|?]*)\([\w|?]*\)', annot.genename).group(1)
-
-            annotexp = None
-            contig.sequence = seq
-
-            contig.annotations    = allannots
-            seqlen                = len(re.findall(r'[acgtACGTnN]', seq))
-            contig.sequencelength = seqlen
-
-            contigs.append(contig)
-
-        self.contigs = contigs
-        return self
+        if output != filename:
+            os.replace(output, filename)
 
-    def object_to_masterfile(self, filename):
-        # Print masterfile header
-        fh     = open(filename, 'w')
+    # Print masterfile header, without its trailing blank lines (left in
+    # self.header, compared with sourceheader when splicing)
+    def header_to_fh(self, fh):
         header = self.header or []
 
-        # Remove trailing blank lines
-        while len(header) and re.match(r'^\s*$', header[-1]):
-            header.pop()
-
-        if len(header):
-            fh.write("\n".join(header) + "\n")
-
-        contigs = self.contigs
-
-        for contig in contigs:
-            name         = contig.name
-            namecomments = contig.namecomments or ""
+        end = len(header)
+        while end and re.match(r'^\s*$', header[end - 1]):
+            end -= 1
+
+        if end:
+            text = "\n".join(header[:end]) + "\n"
+            fh.write(text)
+            self.stats['bytes written'] += len(text)
+
+    # Print one contig: its '>' line, then the sequence with the
+    # annotation lines interleaved at their positions.
+    def contig_to_fh(self, contig, fh):
+        name         = contig.name
+        namecomments = contig.namecomments or ""
+
+        fh = BatchWriter(fh)
+        fh.write("\n\n")
+        fh.write(f">{name}{namecomments}\n")
+
+        posannots = []
+        annots    = contig.annotations
+        coords    = contig.coordinate_index()
+        fullseq   = str(contig.sequence)  # also accepts a ContigSequence
+
+        # An AC annotation gets a '!' marker just before its first
+        # nucleotide and just after its last one, unless there's one
+        # already. They're merged in the index and the text is rebuilt
+        # once, in one pass.
+        acmarkers = set()
+        for annot in annots:
+            if annot.type != 'AC':
+                continue
+            if annot.startpos and not coords.has_marker(annot.startpos - 1):
+                acmarkers.add(annot.startpos - 1)
+            if annot.endpos and not coords.has_marker(annot.endpos):
+                acmarkers.add(annot.endpos)
+        if acmarkers:
+            nucleotides = contig.sequence.nucleotides() if hasattr(contig.sequence, 'nucleotides') else fullseq.replace('!', '')
+            coords      = coords.with_markers(acmarkers)
+            fullseq     = coords.apply(nucleotides)
+
+        for annot in annots:
+            type  = annot.type
+            start = annot.startpos
+            if type == 'AC':
+                continue
 
-            fh.write("\n\n")
-            fh.write(f">{name}{namecomments}\n")
+            end   = annot.endpos
+            # <== or ==> or <==* or *==> or undef
+            arrow = annot.direction or ">"
+
+            # A point (or an unpaired line) only has one side to print
+            if annot.startline is None:
+                start = None
+            if annot.endline is None:
+                end   = None
+
+            if arrow.endswith('>'):
+                if start:
+                    posannots.append([start-1, annot.startlinenumber or 0, "S", annot])
+                if end:
+                    posannots.append([end, annot.endlinenumber or 0, "E", annot])
+            else:
+                if start:
+                    posannots.append([start, annot.startlinenumber or 0, "S", annot])
+                if end:
+                    posannots.append([end-1, annot.endlinenumber or 0, "E", annot])
+
+        posannots.sort(key=annot_sort_key)
+
+        seqpos  = 0
+        charpos = 0
+        for annotinfo in posannots:
+            atpos, se, annot = annotinfo[0], annotinfo[2], annotinfo[3]
+
+            # Take the atpos - seqpos next nucleotides, plus the markers
+            # among them: the block ends just after the nucleotide at
+            # atpos - 1, whose offset is looked up in the index
+            blockpos   = seqpos
+            blockstart = charpos
+            blockend   = charpos
+            if atpos > seqpos:
+                blockend = min(coords.offset(atpos - 1) + 1, len(fullseq))
+            block    = fullseq[charpos:blockend]
+            charpos  = blockend
+            seqpos   = coords.position(charpos)
+
+            if charpos < len(fullseq) and fullseq[charpos] == "!" and len(block) >= 4 and "!" in block[-4:]:
+                block += "!"
+                charpos += 1
+            if block:
+                fasta_block_to_fh(block, blockpos+1, fh, coords=coords, offset=blockstart)
 
-            posannots = []
-            annots    = contig.annotations
-            fullseq   = contig.sequence
-            start_ac  = {}
-            stop_ac   = {}
+            multicomment = [];
+            if se == "S":
+                fh.write(f"{annot.startline}\n")
+                multicomment = annot.startmulticomment
+            else:
+                fh.write(f"{annot.endline}\n")
+                multicomment = annot.endmulticomment
+            if multicomment:
+                fh.write("\n".join(multicomment) + "\n")
+
+        block = ""
+        if charpos < len(fullseq):
+            block = fullseq[charpos:]
+        else:
+            block = ""
 
-            for annot in annots:
-                type  = annot.type
-                if type != 'AC':
-                    continue
+        if block:
+            fasta_block_to_fh(block, seqpos+1, fh, coords=coords, offset=charpos)
 
-                start = annot.startpos
-                start_ac[start] = 1
+        fh.flush()
+        self.stats['contigs written'] += 1
+        self.stats['bytes written']   += fh.written
 
-                stop = annot.endpos
-                stop_ac[stop] = 1
+    # Contig named contigname, None when there is none. It's looked up
+    # in the parsed contigs or, when the masterfile was loaded with
+    # index_masterfile, parsed alone from its byte range of the file.
+    # The contigs found are cached by name.
+    def get_contig_by_name(self, contigname):
+        if self.contigbyname is None:
+            self.contigbyname = {contig.name: contig for contig in self.contigs or [] if contig.name}
+
+        contig = self.contigbyname.get(contigname)
+        if contig is None and self.contigindex and contigname in self.contigindex:
+            name, offset, length, seqlength = self.contigindex[contigname]
+            RemoveIupac, compact = self.indexoptions
+            contig = self.contigs_from_range(self.filename, offset, offset + length, RemoveIupac, compact)[0]
+            contig.source = None  # its rank counts from the range
+            self.contigbyname[contigname] = contig
+        return contig
+
+    # Read the header of the masterfile and its sidecar index (built and
+    # written next to it when missing or out of date), without parsing
+    # any contig: get_contig_by_name then parses the contigs on demand.
+    def index_masterfile(self, filename, RemoveIupac=0, compact=False, rebuild=False):
+        self.filename = filename
+        with open_masterfile_input(filename) as fh:
+            self.header_from_fh(fh)
+
+        entries = None if rebuild else read_contig_index(filename)
+        if entries is None:
+            entries = build_contig_index(filename)
+            try:
+                write_contig_index(filename, entries)
+            except OSError:
+                pass  # read-only location, the index is only kept in memory
+
+        self.contigindex  = {entry[0]: entry for entry in entries}
+        self.indexoptions = (RemoveIupac, compact)
+        self.contigbyname = None
+        return self
 
-            # Num will be bio coords
-            num = 0
-            for i in range(len(fullseq)):
-                c = fullseq[i]
-                if c == '!':
-                    continue
+    # Sort the contigs in place by sequence length, the longest first
+    # when direction is 1
+    def sort_masterfile(self, direction):
+        self.contigs.sort(key=lambda x: len(x.sequence), reverse=(direction == 1))
+        return self
 
-                # Num is bio coords
-                num += 1
-                if start_ac.get(num) or stop_ac.get(num):
-                    if fullseq[i-1] != '!' and start_ac.get(num):
-                        fullseq = fullseq[:i] + '!' + fullseq[i:]
-                        i += 1
-                    if fullseq[i] != '!' and stop_ac.get(num):
-                        fullseq = fullseq[:i+1] + '!' + fullseq[i+1:]
-                        i += 1
-
-            for annot in annots:
-                type  = annot.type
-                start = annot.startpos
-                if type == 'AC':
-                    continue
 
-                end   = annot.endpos
-                # <== or ==> or <==* or *==> or undef
-                arrow = annot.direction or ">"
+#####################################################################
+# Parallel parsing                                                  #
+#####################################################################
 
-                if arrow.startswith('>'):
-                    if start:
-                        posannots.append([start-1, annot.startlinenumber or 0, "S", annot])
-                    if end:
-                        posannots.append([end, annot.endlinenumber or 0, "E", annot])
-                else:
-                    if start:
-                        posannots.append([start, annot.startlinenumber or 0, "S", annot])
-                    if end:
-                        posannots.append([end-1, annot.endlinenumber or 0, "E", annot])
-
-            key_sort_annots = functools.cmp_to_key(sort_annots)
-            posannots = sorted(posannots, key=key_sort_annots)
-
-            seqpos  = 0
-            charpos = 0
-            for annotinfo in posannots:
-                atpos, se, annot = annotinfo[0], annotinfo[2], annotinfo[3]
-                name = annot.genename
-
-                block    = ""
-                blockpos = seqpos
-                while seqpos < atpos:
-                    char     = fullseq[charpos]
-                    block   += char
-                    charpos += 1
-
-                    if char != '!':
-                        seqpos += 1
-
-                if fullseq[charpos] == "!" and len(block) >= 4 and "!" in block[-4:]:
-                    block += "!"
-                    charpos += 1
-                if block:
-                    fasta_block_to_fh(block, blockpos+1, fh)
-
-                multicomment = [];
-                if se == "S":
-                    fh.write(f"{annot.startline}\n")
-                    multicomment = annot.startmulticomment
-                else:
-                    fh.write(f"{annot.endline}\n")
-                    multicomment = annot.endmulticomment
-                if multicomment:
-                    fh.write("\n".join(multicomment) + "\n")
+# Number of byte ranges per worker, so that a few large contigs don't
+# leave the other workers idle
+PARALLEL_CHUNKS_PER_WORKER = 4
+
+# Contig header lines, as seen by the parser once the lines are stripped
+CONTIG_HEADER = re.compile(rb'^[ \t\f\v]*>', re.MULTILINE)
+
+# Byte offsets of the '>' lines of a masterfile, found in one mmap scan
+def contig_offsets(filename):
+    with open(filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [match.start() for match in CONTIG_HEADER.finditer(mm)]
+
+# Split the contigs of a masterfile in about nchunks (start, end) byte
+# ranges of similar size, each one holding whole contigs
+def contig_ranges(filename, nchunks):
+    offsets = contig_offsets(filename)
+    if not offsets:
+        return []
+    filesize = os.path.getsize(filename)
+    target   = max(1, (filesize - offsets[0]) // nchunks)
+
+    ranges = []
+    start  = offsets[0]
+    for offset in offsets[1:]:
+        if offset - start >= target:
+            ranges.append((start, offset))
+            start = offset
+    ranges.append((start, filesize))
+    return ranges
+
+# (size, mtime) of a file, to check that it didn't change
+def source_stat(filename):
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime_ns)
+
+# Copy length bytes at offset of the file src to the current position
+# of the file dst, in the kernel when possible, else through a buffer
+def copy_byte_range(src, dst, offset, length):
+    dst.flush()
+    copied = kernel_copy(src.fileno(), dst.fileno(), offset, length)
+    dst.seek(0, os.SEEK_END)  # back in sync with the file descriptor
+
+    src.seek(offset + copied)
+    remaining = length - copied
+    while remaining > 0:
+        chunk = src.read(min(remaining, WRITE_BATCH_SIZE))
+        if not chunk:
+            raise ValueError(f"Masterfile '{src.name}' is shorter than expected")
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+# Copy with copy_file_range, else sendfile, as far as they go (they
+# aren't available everywhere nor between all file systems). Returns
+# the number of bytes copied.
+def kernel_copy(srcfd, dstfd, offset, length):
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                count = os.copy_file_range(srcfd, dstfd, length - copied, offset + copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError:
+            pass
+    if copied < length and hasattr(os, 'sendfile'):
+        try:
+            while copied < length:
+                count = os.sendfile(dstfd, srcfd, offset + copied, length - copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError:
+            pass
+    return copied
 
-            block = ""
-            if charpos < len(fullseq):
-                block = fullseq[charpos:]
-            else:
-                block = ""
+# Worker of parallel_object_from_masterfile: parse the contigs held in
+# [start, end) of the file, returns them with the line counts and stats
+def parse_masterfile_range(filename, start, end, RemoveIupac=0, compact=False):
+    pirmaster          = Masterfile()
+    pirmaster.filename = filename
+    contigs            = pirmaster.contigs_from_range(filename, start, end, RemoveIupac, compact)
+    return contigs, pirmaster.linecounts, pirmaster.stats
 
-            if block:
-                fasta_block_to_fh(block, seqpos+1, fh)
 
-        fh.close()
+#####################################################################
+# Contig index                                                      #
+#####################################################################
 
-    # Utility routine that precomputes an internal hash the first
-    # time it's called.
-    def get_contig_by_name(self, contigname):
-        if not self['!contigbyname!']:
-            cache   = self['!contigbyname!'] = {}
-            contigs = self.contigs or []
-            for contig in contigs:
-                name = contig.name
-                if name:
-                    cache[name] = contig
+# The sidecar index of a masterfile is a tab separated text file named
+# after it. Its first line records the size and mtime of the masterfile
+# it was built from, then each contig has a line with its name, the
+# byte offset of its '>' line, its length in bytes and the number of
+# nucleotides of its sequence.
+CONTIG_INDEX_SUFFIX  = '.mfidx'
+CONTIG_INDEX_VERSION = '1'
+
+# Contig name of a '>' line, comment lines (with the lines continuing
+# them after a '\') and the bytes of a sequence line that aren't
+# nucleotides
+CONTIG_NAME     = re.compile(rb'[ \t\f\v]*>[ \t\f\v]*(\S+)')
+COMMENT_LINES   = re.compile(rb'^[ \t\f\v]*;(?:[^\n]*\\[ \t\f\v\r]*\n)*[^\n]*', re.MULTILINE)
+NOT_NUCLEOTIDES = b' \t\f\v\r\n!0123456789'
+
+def contig_index_filename(filename):
+    return filename + CONTIG_INDEX_SUFFIX
+
+# Index entry of the contig whose text (from its '>' line) is block,
+# found at offset
+def contig_index_entry(block, offset):
+    match  = CONTIG_NAME.match(block)
+    name   = match.group(1).decode() if match else ""
+    body   = block[block.find(b'\n') + 1:] if b'\n' in block else b''
+    seqlen = len(COMMENT_LINES.sub(b'', body).translate(None, NOT_NUCLEOTIDES))
+    return (name, offset, len(block), seqlen)
+
+# Index entries (name, offset, length, sequence length) of the contigs
+# of a masterfile, in one mmap scan of the file. The offsets of a
+# compressed masterfile are in its decompressed text.
+def build_contig_index(filename):
+    if input_compression(filename):
+        with open_masterfile_input(filename, 'rb') as fh:
+            return build_contig_index_from_fh(fh)
+
+    entries = []
+    with open(filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return entries
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = [match.start() for match in CONTIG_HEADER.finditer(mm)]
+            for start, end in zip(offsets, offsets[1:] + [len(mm)]):
+                entries.append(contig_index_entry(mm[start:end], start))
+    return entries
+
+# Same entries from a binary stream, read blocksize bytes at a time:
+# only the contig being read is held in memory. The '>' lines are only
+# looked for in whole lines, the end of the stream ending the last one.
+def build_contig_index_from_fh(fh, blocksize=READ_BUFFER_SIZE):
+    entries = []
+    buffer  = bytearray()
+    base    = 0     # offset of buffer[0] in the stream
+    start   = None  # offset in buffer of the '>' line of the current contig
+    scanned = 0     # offset in buffer up to which the lines were scanned
+    while True:
+        block   = fh.read(blocksize)
+        buffer += block
+        limit   = len(buffer) if not block else max(scanned, buffer.rfind(b'\n', scanned) + 1)
+        for match in CONTIG_HEADER.finditer(buffer, scanned, limit):
+            if start is not None:
+                entries.append(contig_index_entry(bytes(buffer[start:match.start()]), base + start))
+            start = match.start()
+        scanned = limit
+        if not block:
+            break
+
+        # Drop what's before the current contig
+        drop = scanned if start is None else start
+        if drop:
+            del buffer[:drop]
+            base    += drop
+            scanned -= drop
+            start    = None if start is None else 0
+
+    if start is not None:
+        entries.append(contig_index_entry(bytes(buffer[start:]), base + start))
+    return entries
+
+def write_contig_index(filename, entries):
+    stat = os.stat(filename)
+    with open(contig_index_filename(filename), 'w') as fh:
+        fh.write(f"#mfidx\t{CONTIG_INDEX_VERSION}\t{stat.st_size}\t{stat.st_mtime_ns}\n")
+        fh.writelines(f"{name}\t{offset}\t{length}\t{seqlen}\n" for name, offset, length, seqlen in entries)
+
+# Index entries read back from the sidecar index of a masterfile, None
+# when it's missing, unreadable or out of date
+def read_contig_index(filename):
+    try:
+        stat = os.stat(filename)
+        with open(contig_index_filename(filename), 'r') as fh:
+            expected = ['#mfidx', CONTIG_INDEX_VERSION, str(stat.st_size), str(stat.st_mtime_ns)]
+            if fh.readline().rstrip('\n').split('\t') != expected:
+                return None
+            entries = []
+            for line in fh:
+                name, offset, length, seqlen = line.rstrip('\n').split('\t')
+                entries.append((name, int(offset), int(length), int(seqlen)))
+            return entries
+    except (OSError, ValueError):
+        return None
 
-        self['!contigbyname!'][contigname]  # returns undef if not found.
 
+#####################################################################
+# Parsed masterfile cache                                           #
+#####################################################################
 
-    def sort_masterfile(self, direction):
-        contigs = self.contigs
-        contigs = sorted(contigs, key=lambda x: len(x.sequence), reverse=(direction == 1))
+# A cache file holds, after its magic, two signed pickles (see
+# signed_pickle): the key it was built for, checked before anything
+# else is loaded, then the (header, comment, contigs, linecounts, stats)
+# of the parsed masterfile. Nothing is unpickled from a file not written by
+# this user (wrong owner, writable by others or bad tag): it's parsed
+# again and the cache written anew.
+MASTERFILE_CACHE_SUFFIX  = '.mfcache'
+MASTERFILE_CACHE_MAGIC   = b'MFCACHE2'
+MASTERFILE_CACHE_VERSION = 6
+
+# Cache file of a masterfile, next to it or in cachedir (named after
+# a hash of its absolute path)
+def masterfile_cache_filename(filename, cachedir=None):
+    if cachedir is None:
+        return filename + MASTERFILE_CACHE_SUFFIX
+    path = os.path.abspath(filename)
+    name = hashlib.sha1(path.encode()).hexdigest()
+    return os.path.join(cachedir, f"{os.path.basename(path)}.{name[:16]}{MASTERFILE_CACHE_SUFFIX}")
+
+# blake2b of the content of a file, read 1 Mb at a time
+def file_digest(filename):
+    digest = hashlib.blake2b()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def masterfile_cache_key(filename, RemoveIupac=0, compact=False):
+    stat = os.stat(filename)
+    return {
+        'version': MASTERFILE_CACHE_VERSION,
+        'path':    os.path.abspath(filename),
+        'size':    stat.st_size,
+        'mtime':   stat.st_mtime_ns,
+        'digest':  file_digest(filename),
+        'options': (bool(RemoveIupac), bool(compact)),
+    }
+
+# Cached state of a masterfile, None when there is no cache file or
+# when it was built for another key (or can't be read)
+def load_masterfile_cache(cachefile, key):
+    try:
+        with open(cachefile, 'rb') as fh:
+            if fh.read(len(MASTERFILE_CACHE_MAGIC)) != MASTERFILE_CACHE_MAGIC:
+                return None
+            if not verify_signed(fh):
+                return None
+            if pickle.load(fh) != key:
+                return None
+            return pickle.load(fh)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+# Write the cache file through a temporary file, so that a reader never
+# sees it half written. A cache that can't be written (or signed) is
+# skipped.
+def save_masterfile_cache(cachefile, key, state):
+    tmpfile = f"{cachefile}.{os.getpid()}.tmp"
+    try:
+        directory = os.path.dirname(cachefile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open_private(tmpfile) as fh:
+            fh.write(MASTERFILE_CACHE_MAGIC)
+            signed = write_signed(fh, key, state)
+        if not signed:
+            os.remove(tmpfile)
+            return
+        os.replace(tmpfile, cachefile)
+    except OSError:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
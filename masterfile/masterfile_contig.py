@@ -1,15 +1,146 @@
 #!/usr/bin/env python3
 
-from annot_pair import AnnotPair
+from .annot_pair       import AnnotPair
+from .annotation_index import AnnotationIndex
+from .coordinate_index import CoordinateIndex
 
+# Slots of MasterfileContig left out of its pickled state
+UNPICKLED_SLOTS = frozenset(('intervals', 'coordinates', 'parsedhash'))
+
+# A contig parsed from a masterfile knows where it came from (source,
+# the file name and its rank among the contigs of that file) and whether
+# it was changed since (unchanged()), so that
+# Masterfile.object_to_masterfile can copy the unchanged contigs from
+# the file instead of writing them again. Assigning the name, comments,
+# sequence or annotations and add_annot_pair/remove_annot_pairs mark the
+# contig dirty. The changes made in place, to the annotations list
+# (append, del...) or to an AnnotPair, can't be seen that way: they're
+# found by comparing content_hash() with the one taken when the contig
+# was parsed (parsedhash).
 class MasterfileContig:
+    __slots__ = ('_name', 'uniq_name', 'genetic_code', '_namecomments', '_annotations', '_sequence', 'sequencelength', 'intervals', 'coordinates', 'source', 'dirty', 'parsedhash')
+
     def __init__(self):
-        self.name         = None
-        self.uniq_name    = None
-        self.genetic_code = None
-        self.namecomments = None
-        self.annotations  = []
+        self._name          = None
+        self.uniq_name      = None
+        self.genetic_code   = None
+        self._namecomments  = None
+        self._annotations   = []
+        self._sequence      = None
+        self.sequencelength = None
+        self.intervals      = None  # AnnotationIndex, built on first use
+        self.coordinates    = None  # CoordinateIndex of the sequence, built on first use
+        self.source         = None  # (filename, rank) of the contig in the masterfile it was parsed from
+        self.dirty          = True  # changed since it was parsed
+        self.parsedhash     = None  # content_hash() when it was parsed
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self.dirty = True
+
+    @property
+    def namecomments(self):
+        return self._namecomments
+
+    @namecomments.setter
+    def namecomments(self, namecomments):
+        self._namecomments = namecomments
+        self.dirty         = True
+
+    @property
+    def annotations(self):
+        return self._annotations
+
+    @annotations.setter
+    def annotations(self, annotations):
+        self._annotations = annotations
+        self.intervals    = None
+        self.dirty        = True
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @sequence.setter
+    def sequence(self, sequence):
+        self._sequence   = sequence
+        self.coordinates = None
+        self.dirty       = True
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    # Hash of the annotations, in order, with all their attributes. The
+    # name, comments and sequence are strings (or an immutable
+    # ContigSequence): they can only change through their setters.
+    def content_hash(self):
+        return hash(tuple([annot_pair.state() for annot_pair in self._annotations]))
+
+    # Record the contig as just parsed, unchanged from now on
+    def mark_parsed(self):
+        self.dirty      = False
+        self.parsedhash = self.content_hash()
+
+    # Whether the contig is the same as when it was parsed
+    def unchanged(self):
+        return not self.dirty and self.parsedhash is not None and self.content_hash() == self.parsedhash
+
+    # The str hashes are salted per process: parsedhash isn't pickled but
+    # taken again when a contig is unpickled (from the masterfile cache,
+    # or from a parsing worker). Neither are the indexes, built again on
+    # first use: the AnnotationIndex is keyed by the id() of the
+    # annotations, which don't survive the round trip.
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot not in UNPICKLED_SLOTS}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self.intervals   = None
+        self.coordinates = None
+        self.parsedhash  = None if self.dirty else self.content_hash()
 
     def add_annot_pair(self, annot_pair):
-        self.annot_pairs.append(annot_pair)
+        self._annotations.append(annot_pair)
+        self.dirty = True
+        if self.intervals is not None:
+            self.intervals.add(annot_pair)
+
+    # Remove the annotations whose id() is in ids, in one pass
+    def remove_annot_pairs(self, ids):
+        kept    = []
+        removed = []
+        for annot_pair in self._annotations:
+            (removed if id(annot_pair) in ids else kept).append(annot_pair)
+        if removed:
+            self.dirty = True
+        self._annotations[:] = kept
+        if self.intervals is not None:
+            for annot_pair in removed:
+                self.intervals.remove(annot_pair)
+
+    # Interval index of the annotations (overlap, containment and
+    # nearest queries), kept up to date by add_annot_pair and
+    # remove_annot_pairs once built, and built again after the
+    # annotations are assigned. A change made to the annotations list in
+    # place isn't seen by the index: use add_annot_pair/remove_annot_pairs,
+    # or reset intervals to None.
+    def interval_index(self):
+        if self.intervals is None:
+            self.intervals = AnnotationIndex(self._annotations)
+        return self.intervals
 
+    # Coordinate index of the sequence (biological position <-> offset
+    # in its text), rebuilt when the sequence is assigned
+    def coordinate_index(self):
+        if self.coordinates is None:
+            if hasattr(self._sequence, 'coordinates'):
+                self.coordinates = self._sequence.coordinates()
+            else:
+                self.coordinates = CoordinateIndex.from_string(self._sequence or "")
+        return self.coordinates
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from .contig_sequence import ContigSequence
+
+#####################################################################
+# Genetic codes                                                     #
+#####################################################################
+
+# NCBI translation tables, the amino acids of the 64 codons with the
+# bases in TCAG order (TTT, TTC, TTA, TTG, TCT, ...), for each code
+# accepted by HMMannot.py --genetic
+GENETIC_CODES = {
+    1:  "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    2:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG",
+    3:  "FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    4:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    5:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG",
+    6:  "FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    9:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+    10: "FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    11: "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    12: "FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    13: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG",
+    14: "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+    15: "FFLLSSSSYY*QCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    16: "FFLLSSSSYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    21: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+    22: "FFLLSS*SYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    23: "FF*LSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+    24: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG",
+    25: "FFLLSSSSYY**CCGWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+}
+
+STOP = ord('*')
+
+# Version of the ORFs found, part of the result cache keys: bumped when
+# they change for the same sequence and options
+ORF_FINDER_VERSION = 2
+
+# Nucleotides are indexed in ACGTN order, anything else counts as an N
+NUCLEOTIDE_INDEX = np.full(256, 4, dtype=np.uint8)
+for char, index in zip(b'ACGTacgt', [0, 1, 2, 3, 0, 1, 2, 3]):
+    NUCLEOTIDE_INDEX[char] = index
+
+# Index of the complement, in the same ACGTN order
+COMPLEMENT_INDEX = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+# Position of A/C/G/T in the TCAG order of the NCBI tables
+TCAG_RANK = [2, 1, 3, 0]
+
+# Amino acids of the codons a codon over ACGTN (index 25*b1 + 5*b2 + b3)
+# stands for, an N standing for any base
+def expanded_codon(aminoacids, index):
+    expanded = [[]]
+    for base in (index // 25, index // 5 % 5, index % 5):
+        choices  = range(4) if base == 4 else (base,)
+        expanded = [codon + [choice] for codon in expanded for choice in choices]
+    return {aminoacids[16 * TCAG_RANK[b1] + 4 * TCAG_RANK[b2] + TCAG_RANK[b3]] for b1, b2, b3 in expanded}
+
+# Translation of the 125 codons over ACGTN. A codon holding N gets the
+# amino acid all its expansions agree on (GCN is Ala), else X: it's
+# never a stop unless all expansions are.
+def codon_table(aminoacids):
+    table = np.empty(125, dtype=np.uint8)
+    for index in range(125):
+        translated   = expanded_codon(aminoacids, index)
+        table[index] = ord(translated.pop()) if len(translated) == 1 else ord('X')
+    return table
+
+# Whether each of the 125 codons can open an ORF: as in esl-translate,
+# only a codon none of whose expansions is a stop (an NNN following a
+# stop codon is skipped, but translated as X inside an ORF)
+def opening_table(aminoacids):
+    return np.array(['*' not in expanded_codon(aminoacids, index) for index in range(125)])
+
+CODON_TABLES   = {code: codon_table(aminoacids) for code, aminoacids in GENETIC_CODES.items()}
+OPENING_TABLES = {code: opening_table(aminoacids) for code, aminoacids in GENETIC_CODES.items()}
+
+
+#####################################################################
+# Orf class                                                         #
+#####################################################################
+
+# An ORF in the coordinates of its source sequence (1-based, both
+# included, start > end on the reverse strand). Frames 1-3 are on the
+# forward strand, 4-6 on the reverse one, as numbered by esl-translate.
+class Orf:
+    __slots__ = ('source', 'start', 'end', 'frame', 'protein')
+
+    def __init__(self, source=None, start=None, end=None, frame=None, protein=None):
+        self.source  = source
+        self.start   = start
+        self.end     = end
+        self.frame   = frame
+        self.protein = protein
+
+    def __len__(self):
+        return len(self.protein)
+
+    # FASTA header line of the ORF, the same as esl-translate
+    def header(self, number, desc=""):
+        return f">orf{number} source={self.source} coords={self.start}..{self.end} length={len(self.protein)} frame={self.frame} desc={desc}"
+
+    def __repr__(self):
+        return f"Orf({self.source} {self.start}..{self.end} frame={self.frame} length={len(self.protein)})"
+
+
+#####################################################################
+# ORF finding                                                       #
+#####################################################################
+
+# Translate the three frames of a strand (an array of ACGTN indices)
+# at once and cut them at the stop codons. ORFs of at least minlen
+# amino acids are returned in the order esl-translate reports them:
+# the ones closed by a stop codon by position of the stop, then the
+# ones running to the end of the sequence, by position of their last
+# codon too (esl-translate closes them in turn from the frame where its
+# codon scan stops, not by frame).
+def strand_orfs(indexes, table, opening, minlen, source, reverse=False):
+    length = len(indexes)
+    if length < 3:
+        return []
+
+    codons     = indexes[:-2] * 25 + indexes[1:-1] * 5 + indexes[2:]
+    translated = table[codons]
+    opens      = opening[codons] if (indexes == 4).any() else None
+
+    closed  = []
+    running = []
+    for frame in range(3):
+        aminoacids = translated[frame::3]
+        ncodons    = len(aminoacids)
+        stops      = np.flatnonzero(aminoacids == STOP)
+        ends       = np.concatenate((stops, [ncodons]))
+
+        # Each ORF starts at the first codon able to open one after the
+        # previous stop (nextopen[i]: first one at or after i), the codon
+        # just after it when there's no N
+        starts = np.concatenate(([0], stops + 1))
+        if opens is not None:
+            candidates = np.where(opens[frame::3], np.arange(ncodons), ncodons)
+            nextopen   = np.append(np.minimum.accumulate(candidates[::-1])[::-1], ncodons)
+            starts     = nextopen[starts]
+        lengths = ends - starts
+        for orfindex in np.flatnonzero((lengths >= minlen) & (lengths > 0)):
+            start, end = int(starts[orfindex]), int(ends[orfindex])
+            ntstart    = frame + 3 * start + 1
+            ntend      = frame + 3 * end
+            if reverse:
+                ntstart, ntend = length - ntstart + 1, length - ntend + 1
+            orf = Orf(
+                source  = source,
+                start   = ntstart,
+                end     = ntend,
+                frame   = frame + 1 + (3 if reverse else 0),
+                protein = aminoacids[start:end].tobytes().decode('ascii'),
+            )
+            (closed if orfindex < len(stops) else running).append((frame + 3 * end, orf))
+
+    closed.sort(key=lambda entry: entry[0])
+    running.sort(key=lambda entry: entry[0])
+    return [orf for pos, orf in closed] + [orf for pos, orf in running]
+
+# ORFs of at least minlen amino acids in the six frames of seq (a str
+# of nucleotides, or bytes), or only the forward (strand='watson') or
+# reverse (strand='crick') ones. As with esl-translate's defaults, an
+# ORF runs from a stop codon (or the start of the sequence) to the next
+# stop codon (or the end of the sequence), the stop codon excluded.
+def find_orfs(seq, genetic_code=1, minlen=20, strand=None, source=None):
+    if genetic_code not in CODON_TABLES:
+        raise ValueError(f"Unknown genetic code: {genetic_code}")
+    table   = CODON_TABLES[genetic_code]
+    opening = OPENING_TABLES[genetic_code]
+
+    if isinstance(seq, str):
+        seq = seq.encode('ascii', 'replace')
+    indexes = NUCLEOTIDE_INDEX[np.frombuffer(seq, dtype=np.uint8)]
+
+    orfs = []
+    if strand != 'crick':
+        orfs.extend(strand_orfs(indexes, table, opening, minlen, source))
+    if strand != 'watson':
+        orfs.extend(strand_orfs(COMPLEMENT_INDEX[indexes[::-1]], table, opening, minlen, source, reverse=True))
+    return orfs
+
+# ORFs of a MasterfileContig, translated with the code given by its
+# /trans= comment if any, else with genetic_code
+def contig_orfs(contig, genetic_code=1, minlen=20, strand=None):
+    seq = contig.sequence
+    if isinstance(seq, ContigSequence):
+        seq = seq.nucleotides()
+    else:
+        seq = seq.replace('!', '')
+    return find_orfs(seq, contig.genetic_code or genetic_code, minlen, strand, contig.name)
+
+# (name, protein) records of ORFs numbered from first, the name being
+# the FASTA header line without its '>'
+def orf_records(orfs, first=1):
+    for number, orf in enumerate(orfs, first):
+        yield orf.header(number)[1:], orf.protein
+
+# Write ORFs as FASTA, 60 amino acids per line, numbered from first.
+# Returns the number of the next ORF.
+def orfs_to_fh(orfs, fh, first=1, width=60):
+    number = first
+    for orf in orfs:
+        lines = [orf.header(number)]
+        for start in range(0, len(orf.protein), width):
+            lines.append(orf.protein[start:start+width])
+        fh.write("\n".join(lines) + "\n")
+        number += 1
+    return number
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not on Unix
+    resource = None
+
+#####################################################################
+# Utility functions                                                 #
+#####################################################################
+
+# Peak resident set size of the process (or of its children, e.g. the
+# hmmsearch runs) in bytes, None when it can't be read
+def peak_rss(children=False):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+#####################################################################
+# Profiler class                                                    #
+#####################################################################
+
+# Timers and counters of the stages of a run. A stage is timed with
+#   with profiler.stage('parse'):
+#       ...
+# or, for the items of a generator, with profiler.timed('parse', items).
+# Stages nest: the time spent in an inner stage is not counted in the
+# outer one, so that the times of a pipeline of generators add up to
+# the time of the run. Each stage records its wall clock and CPU time,
+# the number of times it was entered and the peak RSS of the process
+# when it was last left.
+#
+# With cprofiledir, each stage is also run under cProfile and its
+# statistics dumped to cprofiledir/<stage>.prof (pstats format).
+#
+# Each thread has its own stack of stages (e.g. the producer thread of
+# an AsyncSearchPipeline), the times of the stages of different threads
+# overlapping. cProfile only runs in the thread that created the
+# profiler.
+#
+# A disabled profiler (the default one of Masterfile) does nothing and
+# costs one call per stage.
+class Profiler:
+    def __init__(self, enabled=True, cprofiledir=None):
+        self.enabled     = enabled
+        self.cprofiledir = cprofiledir
+        self.stages      = {}         # name -> timings of the stage
+        self.counters    = Counter()
+        self.local       = threading.local()  # .stack: [name, wall start, cpu start] of the stages entered
+        self.lock        = threading.Lock()   # held to update stages and counters
+        self.thread      = threading.current_thread()
+        self.cprofiles   = {}         # name -> cProfile.Profile
+        self.started     = time.perf_counter()
+        self.cpustarted  = time.process_time()
+
+    # Stages entered by the current thread
+    @property
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _timings(self, name):
+        timings = self.stages.get(name)
+        if timings is None:
+            timings = self.stages[name] = {'seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0, 'peak_rss_bytes': None}
+        return timings
+
+    # Charge the time since the last start of the innermost stage to it
+    # (the CPU time being the one of the process)
+    def _charge(self, stack, now, cpunow):
+        name, start, cpustart = stack[-1]
+        with self.lock:
+            timings                 = self._timings(name)
+            timings['seconds']     += now - start
+            timings['cpu_seconds'] += cpunow - cpustart
+
+    def _cprofile(self, name):
+        profile = self.cprofiles.get(name)
+        if profile is None:
+            profile = self.cprofiles[name] = cProfile.Profile()
+        return profile
+
+    def stage(self, name):
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name):
+        stack       = self.stack
+        cprofile    = self.cprofiledir and threading.current_thread() is self.thread
+        now, cpunow = time.perf_counter(), time.process_time()
+        if stack:
+            self._charge(stack, now, cpunow)
+            if cprofile:
+                self._cprofile(stack[-1][0]).disable()
+        stack.append([name, now, cpunow])
+        with self.lock:
+            self._timings(name)['calls'] += 1
+        if cprofile:
+            self._cprofile(name).enable()
+        try:
+            yield
+        finally:
+            if cprofile:
+                self._cprofile(name).disable()
+            now, cpunow = time.perf_counter(), time.process_time()
+            self._charge(stack, now, cpunow)
+            stack.pop()
+            rss = peak_rss()
+            with self.lock:
+                self._timings(name)['peak_rss_bytes'] = rss
+            if stack:
+                stack[-1][1:] = [now, cpunow]
+                if cprofile:
+                    self._cprofile(stack[-1][0]).enable()
+
+    # Pass the items of iterable through, the time spent producing each
+    # of them counted in the stage name
+    def timed(self, name, iterable):
+        if not self.enabled:
+            return iterable
+        return self._timed(name, iterable)
+
+    def _timed(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self._stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    # Add a mapping of counts, their names prefixed with prefix
+    def add_counts(self, counts, prefix=""):
+        if self.enabled:
+            with self.lock:
+                for name, value in counts.items():
+                    self.counters[prefix + name] += value
+
+    def report(self):
+        return {
+            'wall_seconds':            time.perf_counter() - self.started,
+            'cpu_seconds':             time.process_time() - self.cpustarted,
+            'peak_rss_bytes':          peak_rss(),
+            'children_peak_rss_bytes': peak_rss(children=True),
+            'stages':                  self.stages,
+            'counters':                dict(self.counters),
+        }
+
+    # Write the report as JSON to filename ('-' for the standard output)
+    # and the cProfile statistics of each stage to cprofiledir
+    def write(self, filename, **extra):
+        report = dict(extra, **self.report())
+        if filename == '-':
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+        else:
+            with open(filename, 'w') as fh:
+                json.dump(report, fh, indent=2)
+                fh.write("\n")
+
+        if self.cprofiledir:
+            os.makedirs(self.cprofiledir, exist_ok=True)
+            for name, profile in self.cprofiles.items():
+                profile.dump_stats(os.path.join(self.cprofiledir, name.replace(' ', '_') + '.prof'))
+
+# The profiler of the objects not given one
+NULL_PROFILER = Profiler(enabled=False)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+
+from .contig_sequence import ContigSequence
+from .signed_pickle   import open_private, verify_signed, write_signed
+
+#####################################################################
+# Utility functions                                                 #
+#####################################################################
+
+# Hash of the nucleotides of a contig sequence (str or ContigSequence),
+# without the '!' markers and whatever the case, so that the same
+# contig gets the same hash from one masterfile to the next
+def sequence_digest(sequence):
+    if isinstance(sequence, ContigSequence):
+        seq = sequence.nucleotides()
+    else:
+        seq = sequence.replace('!', '')
+    return hashlib.blake2b(seq.upper().encode('ascii', 'replace')).hexdigest()
+
+
+#####################################################################
+# ResultCache class                                                 #
+#####################################################################
+
+# Persistent content-addressed cache of per contig results (ORFs, HMM
+# hits), one signed pickle file per entry under directory, named after
+# the key. The cache is bounded to max_bytes: the least recently used
+# entries (by file mtime, refreshed on each hit) are evicted first.
+# An entry failing verify_signed (e.g. dropped in a shared directory by
+# somebody else) is a miss and is removed, never unpickled. Without a
+# secret key nothing is stored.
+class ResultCache:
+    SUFFIX = '.result'
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries   = OrderedDict()  # key -> size, least recently used first
+        self.size      = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+        self.evict()
+
+    # Key of a result: a hash of all the parts it depends on
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def entry_filename(self, key):
+        return os.path.join(self.directory, key[:2], key + self.SUFFIX)
+
+    # Entries already in the directory, oldest first
+    def _scan(self):
+        found = []
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(self.SUFFIX):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime_ns, entry.name[:-len(self.SUFFIX)], stat.st_size))
+        for mtime, key, size in sorted(found):
+            self.entries[key]  = size
+            self.size         += size
+
+    # Cached result of key, None on a miss
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        filename = self.entry_filename(key)
+        try:
+            with open(filename, 'rb') as fh:
+                if not verify_signed(fh):
+                    raise pickle.UnpicklingError(f"Unsigned result cache entry '{filename}'")
+                value = pickle.load(fh)
+            os.utime(filename)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # Store the result of key, through a temporary file so that a reader
+    # never sees it half written, then evict what goes over max_bytes
+    def put(self, key, value):
+        filename = self.entry_filename(key)
+        tmpfile  = f"{filename}.{os.getpid()}.tmp"
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open_private(tmpfile) as fh:
+            signed = write_signed(fh, value)
+            size   = fh.tell()
+        if not signed:
+            os.remove(tmpfile)
+            return
+        os.replace(tmpfile, filename)
+
+        self.size         -= self.entries.pop(key, 0)
+        self.entries[key]  = size
+        self.size         += size
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key, 0)
+        try:
+            os.remove(self.entry_filename(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {
+            'hits':      self.hits,
+            'misses':    self.misses,
+            'evictions': self.evictions,
+            'entries':   len(self.entries),
+            'bytes':     self.size,
+        }
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import os
+import subprocess
+import threading
+
+#####################################################################
+# Utility functions                                                 #
+#####################################################################
+
+# (name, sequence) records of a FASTA file, read one at a time. The
+# name is the header line without its '>'.
+def fasta_records(filename):
+    with open(filename, 'r') as fh:
+        name   = None
+        chunks = []
+        for line in fh:
+            line = line.rstrip('\n')
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, "".join(chunks)
+                name   = line[1:]
+                chunks = []
+            elif line:
+                chunks.append(line)
+        if name is not None:
+            yield name, "".join(chunks)
+
+# (name, sequence) records of the contigs of a Masterfile, without the
+# '!' markers, longest first (Masterfile.sort_masterfile)
+def contig_records(pirmaster):
+    pirmaster.sort_masterfile(1)
+    for contig in pirmaster.contigs:
+        yield contig.name, str(contig.sequence).replace('!', '')
+
+# Split records in nshards lists of about the same total sequence
+# length: each record, longest first, goes to the lightest shard so far
+# (the longest processing time first heuristic). Set presorted when the
+# records already come longest first.
+def balance_shards(records, nshards, presorted=False):
+    if not presorted:
+        records = sorted(records, key=lambda record: len(record[1]), reverse=True)
+
+    shards = [[] for _ in range(nshards)]
+    loads  = [(0, index) for index in range(nshards)]
+    for record in records:
+        load, index = heapq.heappop(loads)
+        shards[index].append(record)
+        heapq.heappush(loads, (load + len(record[1]), index))
+    return [shard for shard in shards if shard]
+
+# Default runner of the scheduler: run a command, raising
+# subprocess.CalledProcessError with its standard error on failure.
+# When input is given the command is only started, input piped to its
+# standard input, and its standard output returned as a CommandOutput
+# read line by line from the pipe: a table of millions of hits is
+# neither held in memory nor written to disk. Else the standard output
+# is discarded (HMMER writes its tables to files).
+def run_command(command, input=None):
+    if input is None:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        return None
+    return CommandOutput(command, input)
+
+
+#####################################################################
+# CommandOutput class                                               #
+#####################################################################
+
+# Standard output of a command being run, read line by line from its
+# pipe while two threads write input to its standard input and collect
+# its standard error. The command waits when its output isn't read
+# (backpressure). Closing it reads what's left, waits for the command
+# and raises subprocess.CalledProcessError when it failed; leaving its
+# `with` block on an exception kills the command instead.
+class CommandOutput:
+    def __init__(self, command, input):
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        self.stderr  = []
+        self.closed  = False
+        self.threads = [
+            threading.Thread(target=self._feed, args=(input,), daemon=True),
+            threading.Thread(target=self._collect, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _feed(self, input):
+        try:
+            self.process.stdin.write(input)
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):  # the command ended without reading it all
+            pass
+
+    def _collect(self):
+        self.stderr.append(self.process.stderr.read())
+
+    def __iter__(self):
+        return iter(self.process.stdout)
+
+    def read(self):
+        return self.process.stdout.read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, exc, traceback):
+        if exctype is None:
+            self.close()
+        else:
+            self.kill()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for block in iter(lambda: self.process.stdout.read(1 << 16), ''):
+            pass
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        for thread in self.threads:
+            thread.join()
+        self.process.stderr.close()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command, None, "".join(self.stderr))
+
+    # Stop the command, without error
+    def kill(self):
+        if self.closed:
+            return
+        self.process.kill()
+        try:
+            self.close()
+        except subprocess.CalledProcessError:
+            pass
+
+
+#####################################################################
+# SearchResult class                                                #
+#####################################################################
+
+# One shard searched: its index, the FASTA file given to the search
+# command and the file it wrote, or when piped the FASTA text written
+# to its standard input (until searched) and its standard output (the
+# CommandOutput returned by the runner, a file object or its text), and
+# the number of sequences and residues
+class SearchResult:
+    __slots__ = ('index', 'input', 'output', 'sequences', 'table', 'nsequences', 'length')
+
+    def __init__(self, index=None, input=None, output=None, sequences=None, table=None, nsequences=None, length=None):
+        self.index      = index
+        self.input      = input
+        self.output     = output
+        self.sequences  = sequences
+        self.table      = table
+        self.nsequences = nsequences
+        self.length     = length
+
+
+#####################################################################
+# SearchScheduler class                                             #
+#####################################################################
+
+# Runs a search command (hmmsearch, nhmmer, ...) over shards of the
+# sequences, at most `workers` at a time.
+#
+# command is a list of arguments where '{input}' and '{output}' are
+# replaced by the FASTA file of a shard and the file the results of
+# that shard go to, e.g.
+#   ['hmmsearch', '--cpu', '1', '-o', '/dev/null', '--tblout', '{output}', 'profiles.hmm', '{input}']
+#
+# Without a tmpdir no file is written: '{input}' becomes '-' and the
+# shard is piped to the standard input of the command, '{output}'
+# becomes '/dev/stdout' and the table is read back from its standard
+# output (so the rest of the output must go elsewhere, as above). The
+# piped shards are started in order, at most `workers` ahead of the one
+# being read: a search whose output isn't read yet waits for it.
+#
+# The executor (a concurrent.futures.Executor, a thread pool by
+# default: the work happens in the subprocesses) and the runner (the
+# function running one command) can be replaced, e.g. by a fake search
+# binary or an in-process search in tests.
+class SearchScheduler:
+    def __init__(self, command, workers=1, tmpdir=None, executor=None, runner=None, prefix="shard"):
+        self.command  = list(command)
+        self.workers  = max(1, workers)
+        self.tmpdir   = tmpdir
+        self.executor = executor
+        self.runner   = runner or run_command
+        self.prefix   = prefix
+
+    # Command line of one shard
+    def shard_command(self, inputfile, outputfile):
+        return [arg.replace('{input}', inputfile).replace('{output}', outputfile) for arg in self.command]
+
+    # Split the records in about `workers` shards of the same total
+    # length, written as FASTA files in tmpdir (or kept as FASTA text to
+    # be piped). Returns the SearchResult of each shard, not yet searched.
+    def write_shards(self, records, nshards=None, presorted=False):
+        shards  = balance_shards(records, nshards or self.workers, presorted)
+        results = []
+        for index, shard in enumerate(shards):
+            result = SearchResult(
+                index      = index,
+                nsequences = len(shard),
+                length     = sum(len(seq) for name, seq in shard),
+            )
+            fasta = "".join(f">{name}\n{seq}\n" for name, seq in shard)
+            if self.tmpdir is None:
+                result.sequences = fasta
+            else:
+                result.input  = os.path.join(self.tmpdir, f"{self.prefix}_{index}.fa")
+                result.output = os.path.join(self.tmpdir, f"{self.prefix}_{index}.out")
+                with open(result.input, 'w') as fh:
+                    fh.write(fasta)
+            results.append(result)
+        return results
+
+    def _search(self, result):
+        if result.sequences is None:
+            self.runner(self.shard_command(result.input, result.output))
+        else:
+            result.table     = self.runner(self.shard_command('-', '/dev/stdout'), result.sequences)
+            result.sequences = None
+        return result
+
+    # Shard the records and search the shards concurrently. The results
+    # are yielded in shard order, each one as soon as it and the ones
+    # before it are done (or, piped, started), so that they can be read
+    # while the next shards are still searched. A piped table not closed
+    # by the reader is closed when the next result is asked for, raising
+    # the error of its search.
+    def run(self, records, nshards=None, presorted=False):
+        shards = self.write_shards(records, nshards, presorted)
+        if self.executor is not None:
+            yield from self._run_on(self.executor, shards)
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            yield from self._run_on(executor, shards)
+
+    def _run_on(self, executor, shards):
+        window  = self.workers if self.tmpdir is None else len(shards)
+        pending = iter(shards)
+        futures = deque(executor.submit(self._search, shard) for _, shard in zip(range(window), pending))
+        try:
+            while futures:
+                result = futures.popleft().result()
+                yield result
+                if hasattr(result.table, 'close'):
+                    result.table.close()
+                for shard in pending:
+                    futures.append(executor.submit(self._search, shard))
+                    break
+        finally:
+            for future in futures:
+                if not future.cancel() and future.exception() is None:
+                    table = future.result().table
+                    if hasattr(table, 'kill'):
+                        table.kill()
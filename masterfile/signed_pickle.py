@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import hashlib
+import hmac
+import os
+import pickle
+
+#####################################################################
+# Secret key                                                        #
+#####################################################################
+
+# Unpickling runs arbitrary code, so the binary caches are only
+# unpickled once they're known to have been written by this user: each
+# file carries an HMAC-SHA256 tag of its pickles, made with a secret key
+# readable only by the user. A file planted in a shared directory can't
+# carry a valid tag and is never unpickled.
+#
+# The key is MASTERFILE_CACHE_KEY if set (a relative path, or a bare
+# file name, being taken from the current directory), else cache.key
+# under $XDG_CACHE_HOME/masterfile (~/.cache/masterfile), created on
+# first use.
+KEY_ENVIRONMENT = 'MASTERFILE_CACHE_KEY'
+KEY_SIZE        = 32
+TAG_SIZE        = hashlib.sha256().digest_size
+
+def key_filename():
+    if os.environ.get(KEY_ENVIRONMENT):
+        return os.path.expanduser(os.environ[KEY_ENVIRONMENT])
+    cachehome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cachehome, 'masterfile', 'cache.key')
+
+# Whether an open file belongs to this user and can't be written (or
+# for the key, read) by anybody else
+def owned_by_user(fh, private=False):
+    stat = os.fstat(fh.fileno())
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        return False
+    return not stat.st_mode & (0o077 if private else 0o022)
+
+# The secret key of the user, created when missing. None when it can't
+# be read or created, or is readable by others: nothing is then cached.
+def secret_key(filename=None):
+    filename = os.path.abspath(filename or key_filename())
+    try:
+        os.makedirs(os.path.dirname(filename), mode=0o700, exist_ok=True)
+        try:
+            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(os.urandom(KEY_SIZE))
+        with open(filename, 'rb') as fh:
+            if not owned_by_user(fh, private=True):
+                return None
+            key = fh.read()
+    except OSError:
+        return None
+    return key if len(key) == KEY_SIZE else None
+
+
+#####################################################################
+# Signed pickle files                                               #
+#####################################################################
+
+# Open a new binary file for writing, readable and writable by the user
+# only whatever the umask (verify_signed refuses files others can write)
+def open_private(filename):
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    return os.fdopen(fd, 'wb')
+
+# Passes what's written to fh through, updating an HMAC with it
+class SigningWriter:
+    def __init__(self, fh, mac):
+        self.fh  = fh
+        self.mac = mac
+
+    def write(self, data):
+        self.mac.update(data)
+        return self.fh.write(data)
+
+# Write objects as pickles to fh (a seekable binary file), preceded by
+# their tag. Returns False, writing nothing, without a secret key.
+def write_signed(fh, *objects, key=None):
+    key = key or secret_key()
+    if key is None:
+        return False
+    mac    = hmac.new(key, digestmod=hashlib.sha256)
+    tagpos = fh.tell()
+    fh.write(b'\0' * TAG_SIZE)
+    writer = SigningWriter(fh, mac)
+    for obj in objects:
+        pickle.dump(obj, writer, protocol=pickle.HIGHEST_PROTOCOL)
+    end = fh.tell()
+    fh.seek(tagpos)
+    fh.write(mac.digest())
+    fh.seek(end)
+    return True
+
+# Check the file written by write_signed that fh is at: it must belong
+# to this user, not be writable by others, and its tag must match the
+# rest of the file. On success fh is left at the first pickle, to be
+# read with pickle.load; the file is read in blocks, not held in memory.
+def verify_signed(fh, key=None):
+    key = key or secret_key()
+    if key is None or not owned_by_user(fh):
+        return False
+    tag = fh.read(TAG_SIZE)
+    if len(tag) != TAG_SIZE:
+        return False
+    start = fh.tell()
+    mac   = hmac.new(key, digestmod=hashlib.sha256)
+    for block in iter(lambda: fh.read(1 << 20), b''):
+        mac.update(block)
+    if not hmac.compare_digest(mac.digest(), tag):
+        return False
+    fh.seek(start)
+    return True
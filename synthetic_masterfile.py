@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+
+##############################################################################################
+# Utilities Methods                                                                          #
+##############################################################################################
+
+GENE_NAMES   = ["cox1", "cox2", "cox3", "cob", "atp6", "atp9", "nad1", "nad2", "nad4", "nad5", "rnl", "rns", "rps3", "trnA(ugc)", "trnM(cau)"]
+IUPAC_CODES  = "uyrwskmbdhvn"
+INTRON_TYPES = ["IA", "IB", "IIA", "IIB"]
+
+# Annotation lines of one gene as (position, line) events: the line is
+# written just before the nucleotide at position (0-based). A gene on
+# the reverse strand has its end line first, as in mfannot output.
+# With nexons > 1 the gene is split in exons and introns (G-name-E1,
+# G-name-I1, ...) and the gene lines enclose them.
+def gene_events(rand, name, start, end, reverse, nexons, comments):
+    arrow  = "<==" if reverse else "==>"
+    events = []
+
+    def pair(label, low, high, suffix=""):
+        startline = f"; G-{label} {arrow} start{suffix}"
+        endline   = f"; G-{label} {arrow} end"
+        if comments and rand.random() < 0.3:
+            endline += " ;; mfannot: synthetic"
+        events.append((low,  endline if reverse else startline))
+        events.append((high, startline if reverse else endline))
+
+    pair(name, start, end)
+    if nexons > 1:
+        bounds = sorted(rand.sample(range(start + 1, end), 2 * nexons - 2))
+        edges  = [start] + bounds + [end]
+        for index in range(2 * nexons - 1):
+            low, high = edges[index], edges[index + 1]
+            if index % 2 == 0:
+                pair(f"{name}-E{index // 2 + 1}", low, high)
+            else:
+                group = rand.choice(INTRON_TYPES)
+                pair(f"{name}-I{index // 2 + 1}", low, high, f" /group={group}")
+    return events
+
+# Write a synthetic masterfile, deterministic for a given seed.
+#   contigs      number of contigs
+#   length       length of each contig (nt)
+#   iupac        fraction of IUPAC ambiguity codes in the sequences
+#   markers      probability of a '!' marker in each sequence line
+#   density      genes per kb
+#   copies       fraction of the genes having a second copy (name_2)
+#   introns      fraction of the genes split in exons and introns
+#   comments     ';; mfannot:' comment lines per kb (and comments
+#                after some annotation lines)
+#   width        nucleotides per sequence line
+def write_synthetic_masterfile(filename, contigs=10, length=100000, iupac=0.001, markers=0.05, density=1.0,
+                               copies=0.1, introns=0.2, comments=0.5, width=60, seed=1):
+    rand = random.Random(seed)
+    with open(filename, "w") as fh:
+        fh.write(";; mfannot v1.0 (synthetic)\n;; end mfannot\n\n")
+        for number in range(contigs):
+            trans = f" /trans={rand.choice([1, 4, 11])}" if number % 3 == 0 else ""
+            fh.write(f">synthetic_{number + 1}{trans}\n")
+            write_synthetic_contig(fh, rand, length, iupac, markers, density, copies, introns, comments, width)
+            fh.write("\n")
+
+def write_synthetic_contig(fh, rand, length, iupac, markers, density, copies, introns, comments, width):
+    weights = [(1 - iupac) / 4] * 4 + [iupac / len(IUPAC_CODES)] * len(IUPAC_CODES)
+    seq     = "".join(rand.choices("acgt" + IUPAC_CODES, weights, k=length))
+
+    events = []
+    ngenes = int(length * density / 1000)
+    for gene in range(ngenes):
+        name   = rand.choice(GENE_NAMES)
+        size   = rand.randint(90, 2000)
+        start  = rand.randrange(0, max(1, length - size))
+        end    = min(length, start + size)
+        nexons = rand.randint(2, 3) if rand.random() < introns else 1
+        events.extend(gene_events(rand, name, start, end, rand.random() < 0.3, nexons, comments > 0))
+        if rand.random() < copies:
+            start = rand.randrange(0, max(1, length - size))
+            events.extend(gene_events(rand, f"{name}_2", start, min(length, start + size), rand.random() < 0.3, 1, comments > 0))
+    for comment in range(int(length * comments / 1000)):
+        events.append((rand.randrange(0, length), f";; mfannot: synthetic comment {comment + 1}"))
+    events.sort(key=lambda event: event[0])
+
+    lines = []
+    pos   = 0
+    index = 0
+    while pos < length:
+        while index < len(events) and events[index][0] <= pos:
+            lines.append(events[index][1])
+            index += 1
+        end = min(pos + width, length)
+        if index < len(events) and events[index][0] < end:
+            end = events[index][0]
+        chunk = seq[pos:end]
+        if rand.random() < markers:
+            cut   = rand.randrange(0, len(chunk) + 1)
+            chunk = chunk[:cut] + "!" + chunk[cut:]
+        lines.append(f"{pos + 1:6d}  {chunk}")
+        pos = end
+    lines.extend(line for position, line in events[index:])
+    fh.write("\n".join(lines) + "\n")
+
+##############################################################################################
+# Main                                                                                       #
+##############################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='synthetic_masterfile',
+        description='Write a reproducible synthetic masterfile.',
+    )
+    parser.add_argument('masterfile', help='The masterfile to write.')
+    parser.add_argument('--contigs', type=int, default=10, help='Number of contigs.')
+    parser.add_argument('--length', type=int, default=100000, help='Length of each contig (nt).')
+    parser.add_argument('--iupac', type=float, default=0.001, help='Fraction of IUPAC ambiguity codes.')
+    parser.add_argument('--markers', type=float, default=0.05, help="Probability of a '!' marker per sequence line.")
+    parser.add_argument('--density', type=float, default=1.0, help='Genes per kb.')
+    parser.add_argument('--copies', type=float, default=0.1, help='Fraction of the genes with a second copy.')
+    parser.add_argument('--introns', type=float, default=0.2, help='Fraction of the genes with exons and introns.')
+    parser.add_argument('--comments', type=float, default=0.5, help='mfannot comment lines per kb.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed.')
+
+    args = parser.parse_args()
+    write_synthetic_masterfile(args.masterfile, args.contigs, args.length, args.iupac, args.markers, args.density,
+                               args.copies, args.introns, args.comments, seed=args.seed)
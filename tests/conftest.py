@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# The tests import masterfile, HMMannot... from the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from masterfile.signed_pickle import KEY_ENVIRONMENT
+
+# Payload marking that it was unpickled, planted in a cache file to check
+# that nothing unsigned is ever loaded
+class Planted:
+    unpickled = False
+
+    def __reduce__(self):
+        return (setattr, (Planted, 'unpickled', True))
+
+@pytest.fixture
+def planted():
+    Planted.unpickled = False
+    return Planted
+
+# Key of the signed pickles (caches) in the test directory, never the
+# one of the user running the tests. Returns its file name.
+@pytest.fixture
+def cache_key(tmp_path, monkeypatch):
+    filename = tmp_path / 'key' / 'cache.key'
+    monkeypatch.setenv(KEY_ENVIRONMENT, str(filename))
+    return filename
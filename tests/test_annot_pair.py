@@ -0,0 +1,97 @@
+import io
+import tracemalloc
+
+from masterfile import Masterfile
+from masterfile.annot_pair import AnnotPair
+
+MASTERFILE = """;; test
+;; end mfannot
+
+>contig1
+; G-cox1 ==> start
+     1  atgaaacccgggtttaaacccgggtttaaacccgggtttaaacccgggtttaaaccctaa
+; G-cox1 ==> end ;; a comment
+"""
+
+def parsed_pair(tmp_path):
+    filename = tmp_path / "test.mf"
+    filename.write_text(MASTERFILE)
+    contig = Masterfile().object_from_masterfile(str(filename)).contigs[0]
+    return contig.annotations[0]
+
+def test_verbatim_line_with_leading_blanks():
+    pair = AnnotPair(startline="  ; G-x ==> start", endline=" ; G-x ==> end")
+    assert pair.startline == "  ; G-x ==> start"
+    assert pair.endline   == " ; G-x ==> end"
+
+def test_parsed_lines_rebuilt(tmp_path):
+    pair = parsed_pair(tmp_path)
+    assert pair.startline == "; G-cox1 ==> start"
+    assert pair.endline   == "; G-cox1 ==> end ;; a comment"
+
+def test_assigned_line_with_leading_blank_kept_verbatim(tmp_path):
+    pair = parsed_pair(tmp_path)
+    pair.startline = " tail"
+    pair.endline   = "\tother"
+    assert pair.startline == " tail"
+    assert pair.endline   == "\tother"
+
+def test_parts_with_another_name_kept_verbatim():
+    pair = AnnotPair()
+    pair.set_startline_parts("; G-", "cox1", " ==> start")
+    pair.set_endline_parts("; G-", "cox2", " ==> end")
+    assert pair.startline == "; G-cox1 ==> start"
+    assert pair.endline   == "; G-cox2 ==> end"
+    pair.startline = None
+    assert pair.startline is None
+
+def test_parsed_pair_written_back(tmp_path):
+    parsed_pair(tmp_path)
+    pirmaster = Masterfile().object_from_masterfile(str(tmp_path / "test.mf"))
+    out       = io.StringIO()
+    pirmaster.contig_to_fh(pirmaster.contigs[0], out)
+    assert "; G-cox1 ==> start\n" in out.getvalue()
+    assert "; G-cox1 ==> end ;; a comment\n" in out.getvalue()
+
+# Memory held by each parsed annotation (the AnnotPair and its lines,
+# rebuilt from its fields rather than stored): the traced size of a
+# parsed contig with an annotation every 120 nt minus the one of the
+# same contig without any, divided by the number of annotations. A
+# first parse of the annotated contig is kept meanwhile: the gene names
+# are already interned (as in a batch, where they repeat), and the
+# interned strings table doesn't grow during the measure.
+BYTES_PER_ANNOTATION = 340
+
+def write_contig(filename, count, annotated):
+    with open(filename, 'w') as fh:
+        fh.write(";; test\n;; end mfannot\n\n>contig1\n")
+        for number in range(count):
+            if annotated:
+                fh.write(f"; G-orf{number} ==> start\n")
+            fh.write(f"{number * 120 + 1:6d}  {'acgt' * 15}\n")
+            if annotated:
+                fh.write(f"; G-orf{number} ==> end\n")
+            fh.write(f"{number * 120 + 61:6d}  {'acgt' * 15}\n")
+
+def parsed_size(filename):
+    tracemalloc.start()
+    try:
+        masterfile = Masterfile().object_from_masterfile(str(filename))
+        size       = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size, masterfile
+
+def test_memory_per_annotation(tmp_path):
+    count = 2000
+    write_contig(tmp_path / "annotated.mf", count, True)
+    write_contig(tmp_path / "bare.mf", count, False)
+    interned = Masterfile().object_from_masterfile(str(tmp_path / "annotated.mf"))
+    annotated, masterfile = parsed_size(tmp_path / "annotated.mf")
+    assert len(masterfile.contigs[0].annotations) == count
+    assert not hasattr(masterfile.contigs[0], '__dict__')
+    assert not hasattr(masterfile.contigs[0].annotations[0], '__dict__')
+    del masterfile
+    bare, masterfile = parsed_size(tmp_path / "bare.mf")
+    assert len(interned.contigs[0].annotations) == count
+    assert (annotated - bare) / count < BYTES_PER_ANNOTATION
@@ -0,0 +1,111 @@
+import functools
+import random
+import re
+
+from masterfile.annot_pair import AnnotPair
+from masterfile.masterfile import annot_sort_key
+
+#####################################################################
+# Oracle: the former sort_annots comparator                         #
+#####################################################################
+
+def cmp(a, b):
+    return (a > b) - (a < b)
+
+# sort_annots as it was before annot_sort_key, with its start/end
+# extraction repaired (it applied re.match to lines starting with ';',
+# and never set startorend): lines that don't parse fall through to the
+# comparison of the full lines, as it intended.
+def sort_annots(a, b):
+    if a[0] != b[0]:
+        return cmp(a[0], b[0])
+    if a[1] and b[1]:
+        return cmp(a[1], b[1])
+
+    fulllinea = (a[3].startline if a[2] == "S" else a[3].endline) or ""
+    fulllineb = (b[3].startline if b[2] == "S" else b[3].endline) or ""
+    matcha    = re.search(r'([\w|\_\-\d\(\)\?]+)\s*(==>|<==)\s*(start|end)', fulllinea.split(";;")[0].strip())
+    matchb    = re.search(r'([\w|\_\-\d\(\)\?]+)\s*(==>|<==)\s*(start|end)', fulllineb.split(";;")[0].strip())
+    if not matcha or not matchb:
+        return cmp(fulllinea, fulllineb)
+    namea, arrowa, startorenda = matcha.groups()
+    nameb, arrowb, startorendb = matchb.groups()
+
+    if arrowa == "==>" and arrowb == "==>":
+        if startorenda == startorendb == "start":
+            return cmp(namea, nameb)
+        if startorenda == startorendb == "end":
+            return cmp(nameb, namea)
+        return cmp(a[2], b[2])  # end before the start
+    if arrowa == "<==" and arrowb == "<==":
+        if startorenda == startorendb == "start":
+            return cmp(nameb, namea)
+        if startorenda == startorendb == "end":
+            return cmp(namea, nameb)
+        return cmp(b[2], a[2])  # start before the end
+    return cmp(fulllinea, fulllineb)
+
+
+#####################################################################
+# Random entries                                                    #
+#####################################################################
+
+NAMES = ["cox1", "cox1-E1", "cox2", "nad5", "rnl", "trnA(ugc)"]
+
+def entry(rand, pos, arrow, linenumber=0, unparsable=False):
+    se   = rand.choice("SE")
+    name = rand.choice(NAMES)
+    if unparsable:
+        line = rand.choice([None, "", f"; {name} something", f";; mfannot: note {rand.randint(0, 9)}"])
+    else:
+        side = "start" if se == "S" else "end"
+        line = f"; G-{name} {arrow} {side}"
+        if rand.random() < 0.3:
+            line += " ;; comment"
+    annot = AnnotPair(startline=line) if se == "S" else AnnotPair(endline=line)
+    return [pos, linenumber, se, annot]
+
+# Entries over a few positions (many ties). At each position they're
+# all numbered (distinct line numbers), or all unnumbered with the same
+# arrow, or all unparsable: the cases the comparator orders consistently.
+def consistent_entries(rand):
+    entries = []
+    for pos in range(rand.randint(1, 4)):
+        kind  = rand.choice(["numbered", "==>", "<==", "unparsable"])
+        count = rand.randint(1, 8)
+        if kind == "numbered":
+            for linenumber in rand.sample(range(1, 100), count):
+                entries.append(entry(rand, pos, rand.choice(["==>", "<=="]), linenumber))
+        elif kind == "unparsable":
+            entries.extend(entry(rand, pos, "==>", unparsable=True) for _ in range(count))
+        else:
+            entries.extend(entry(rand, pos, kind) for _ in range(count))
+    rand.shuffle(entries)
+    return entries
+
+
+#####################################################################
+# Tests                                                             #
+#####################################################################
+
+def test_key_sort_matches_comparator():
+    rand = random.Random(7)
+    for _ in range(3000):
+        entries = consistent_entries(rand)
+        assert sorted(entries, key=annot_sort_key) == sorted(entries, key=functools.cmp_to_key(sort_annots))
+
+def test_mixed_entries_total_order():
+    rand = random.Random(8)
+    for _ in range(500):
+        entries = [entry(rand, 0, "==>", rand.randint(1, 50)) for _ in range(3)]
+        entries += [entry(rand, 0, "==>") for _ in range(3)]
+        entries += [entry(rand, 0, "<==") for _ in range(3)]
+        entries += [entry(rand, 0, "==>", unparsable=True) for _ in range(3)]
+        rand.shuffle(entries)
+        ordered = sorted(entries, key=annot_sort_key)
+        groups  = [annot_sort_key(e)[1:3] if not e[1] else (0,) for e in ordered]
+        assert groups == sorted(groups)
+
+def test_forward_ends_by_reverse_name():
+    ends = [[5, 0, "E", AnnotPair(endline=f"; G-{name} ==> end")] for name in ["a", "c", "b"]]
+    assert [e[3].endline[4] for e in sorted(ends, key=annot_sort_key)] == ["c", "b", "a"]
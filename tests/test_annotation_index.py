@@ -0,0 +1,92 @@
+import random
+
+from masterfile.annot_pair import AnnotPair
+from masterfile.annotation_index import AnnotationIndex, annot_interval
+from masterfile.masterfile_contig import MasterfileContig
+
+def random_annotations(rand, count, length=5000):
+    annotations = []
+    for _ in range(count):
+        start = rand.randint(1, length)
+        end   = min(length, start + rand.randint(0, 400))
+        if rand.random() < 0.3:
+            annotations.append(AnnotPair(type='G', genename='g', startpos=end, endpos=start, direction='<=='))
+        else:
+            annotations.append(AnnotPair(type='G', genename='g', startpos=start, endpos=end, direction='==>'))
+    return annotations
+
+# Linear scan oracles
+def overlapping(annotations, start, end):
+    return {id(a) for a in annotations if annot_interval(a)[0] <= end and annot_interval(a)[1] >= start}
+
+def contained_in(annotations, start, end):
+    return {id(a) for a in annotations if annot_interval(a)[0] >= start and annot_interval(a)[1] <= end}
+
+def containing(annotations, start, end):
+    return {id(a) for a in annotations if annot_interval(a)[0] <= start and annot_interval(a)[1] >= end}
+
+def gap(annot, start, end):
+    low, high = annot_interval(annot)
+    return max(0, low - end, start - high)
+
+def check_index(index, annotations, rand, queries=200):
+    assert len(index) == len(annotations)
+    for _ in range(queries):
+        start = rand.randint(0, 5200)
+        end   = start + rand.randint(0, 300)
+        assert {id(a) for a in index.overlapping(start, end)} == overlapping(annotations, start, end)
+        assert {id(a) for a in index.contained_in(start, end)} == contained_in(annotations, start, end)
+        assert {id(a) for a in index.containing(start, end)} == containing(annotations, start, end)
+        nearest = index.nearest(start, end)
+        if annotations:
+            assert gap(nearest, start, end) == min(gap(a, start, end) for a in annotations)
+        else:
+            assert nearest is None
+
+def test_index_against_linear_scan():
+    rand        = random.Random(1)
+    annotations = random_annotations(rand, 800)
+    check_index(AnnotationIndex(annotations), annotations, rand)
+
+def test_index_follows_add_and_remove():
+    rand   = random.Random(2)
+    contig = MasterfileContig()
+    contig.annotations = random_annotations(rand, 300)
+    index  = contig.interval_index()
+    for annot in random_annotations(rand, 100):
+        contig.add_annot_pair(annot)
+    removed = {id(a) for a in rand.sample(contig.annotations, 150)}
+    contig.remove_annot_pairs(removed)
+    assert contig.interval_index() is index
+    check_index(index, contig.annotations, rand)
+
+def test_index_rebuilt_after_assignment():
+    rand   = random.Random(3)
+    contig = MasterfileContig()
+    contig.annotations = random_annotations(rand, 801)
+    contig.interval_index()
+    one = random_annotations(rand, 1)
+    contig.annotations = one
+    index = contig.interval_index()
+    assert len(index) == 1
+    check_index(index, one, rand)
+
+# The index isn't pickled (it's keyed by the id() of the annotations),
+# an unpickled contig builds it again
+def test_index_after_pickle_round_trip():
+    import pickle
+
+    rand   = random.Random(4)
+    contig = MasterfileContig()
+    contig.sequence    = "acgt" * 1300
+    contig.annotations = random_annotations(rand, 300)
+    contig.interval_index()
+    contig.coordinate_index()
+    contig = pickle.loads(pickle.dumps(contig))
+    assert contig.intervals is None and contig.coordinates is None
+
+    index   = contig.interval_index()
+    removed = {id(a) for a in rand.sample(contig.annotations, 150)}
+    contig.remove_annot_pairs(removed)
+    assert len(contig.annotations) == 150
+    check_index(index, contig.annotations, rand)
@@ -0,0 +1,32 @@
+import gzip
+import json
+import os
+
+from masterfile import Masterfile
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+FIELDS = ["type", "genename", "startpos", "endpos", "direction", "startline", "endline",
+          "startmulticomment", "endmulticomment", "startlinenumber", "endlinenumber", "introntype", "globaltype"]
+
+# pairing_corpus.mf.gz: three contigs of about 2300 annotation lines on
+# six multi-copy keys (cox1, Cox1, cox1-E1, cox1-I2, nad5, rnl), starts,
+# ends and points mixed in both directions. The expected AnnotPairs were
+# dumped by the parser as it was before the per-key deque pairing, which
+# scanned the list of the annotations started so far.
+def test_pairing_matches_list_scan_parser(tmp_path):
+    filename = tmp_path / "pairing_corpus.mf"
+    with gzip.open(os.path.join(DATA, "pairing_corpus.mf.gz"), "rb") as fh:
+        filename.write_bytes(fh.read())
+    with gzip.open(os.path.join(DATA, "pairing_corpus.expected.json.gz"), "rt") as fh:
+        expected = json.load(fh)
+
+    pirmaster = Masterfile().object_from_masterfile(str(filename))
+    parsed    = {
+        contig.name: [[getattr(annot, field) or None for field in FIELDS] for annot in contig.annotations]
+        for contig in pirmaster.contigs
+    }
+    assert sum(len(annotations) for annotations in expected.values()) > 3000
+    assert parsed.keys() == expected.keys()
+    for name in expected:
+        assert parsed[name] == expected[name], name
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+import subprocess
+import threading
+import time
+
+import pytest
+
+from masterfile.async_pipeline import AsyncSearchPipeline, run_command_async
+
+# Fails on the shard holding the record named FAIL, the other searches
+# take a while, so that they're still running when it fails
+FAILING_SEARCH = ['sh', '-c', 'if grep -q "^>FAIL"; then exit 3; fi; exec sleep 10']
+
+def records(count, fail_at=None):
+    for number in range(count):
+        name = "FAIL" if number == fail_at else f"orf{number}"
+        yield name, "ACDEFGHIKL" * 100
+
+# (index, table) of each shard, its table read while it's searched
+async def collect(pipeline, items):
+    return [(result.index, "".join([line async for line in result.table])) async for result in pipeline.run(items)]
+
+def run_with_handler(coroutine, timeout=30):
+    errors = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        return await asyncio.wait_for(coroutine, timeout)
+
+    return asyncio.run(main()), errors
+
+def test_results_in_order():
+    pipeline = AsyncSearchPipeline(['cat'], workers=3, shard_length=2500)
+    results, errors = run_with_handler(collect(pipeline, records(20)))
+    assert [index for index, table in results] == list(range(len(results)))
+    assert "".join(table for index, table in results).count(">") == 20
+    assert not errors
+
+def test_tables_are_read_in_batches_of_whole_lines():
+    pipeline = AsyncSearchPipeline(['cat'], workers=2, shard_length=2500)
+
+    async def main():
+        lines = []
+        async for result in pipeline.run(records(20)):
+            async for batch in result.table.batches(size=100):
+                lines.extend(batch)
+        return lines
+
+    lines, errors = run_with_handler(main())
+    assert all(line.endswith("\n") for line in lines)
+    assert sum(line.startswith(">") for line in lines) == 20
+
+def test_tables_are_not_spooled_to_disk(monkeypatch):
+    def spool(*args, **kwargs):
+        raise AssertionError("temporary file created")
+    monkeypatch.setattr('tempfile.TemporaryFile', spool)
+    monkeypatch.setattr('tempfile.NamedTemporaryFile', spool)
+    pipeline = AsyncSearchPipeline(['cat'], workers=2, shard_length=2500)
+    results, errors = run_with_handler(collect(pipeline, records(20)))
+    assert len(results) == 7
+
+# A search whose table isn't read yet waits for it: at most `workers`
+# searches are started ahead of the table being read (each one writing
+# more than the pipe and its reader buffer)
+def test_searches_wait_for_the_reader():
+    started = []
+
+    async def runner(command, input):
+        started.append(input)
+        return await run_command_async(command, input)
+
+    async def main():
+        command  = ['sh', '-c', 'cat >/dev/null; yes ACDEFGHIKL | head -c 1000000']
+        pipeline = AsyncSearchPipeline(command, workers=2, shard_length=1000, runner=runner)
+        async for result in pipeline.run(records(12)):
+            await asyncio.sleep(0.05)
+            assert len(started) <= result.index + 2
+            async for batch in result.table.batches():
+                pass
+        return len(started)
+
+    nstarted, errors = run_with_handler(main())
+    assert nstarted == 12
+    assert not errors
+
+def test_failing_shard_stops_the_run():
+    pipeline = AsyncSearchPipeline(FAILING_SEARCH, workers=2, shard_length=3000)
+    start    = time.monotonic()
+    with pytest.raises(subprocess.CalledProcessError):
+        run_with_handler(collect(pipeline, records(60, fail_at=4)))
+    assert time.monotonic() - start < 10
+
+def test_failing_shard_leaves_no_unretrieved_error():
+    pipeline = AsyncSearchPipeline(['sh', '-c', 'cat >/dev/null; exit 3'], workers=2, shard_length=3000)
+    errors   = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        with pytest.raises(subprocess.CalledProcessError):
+            await asyncio.wait_for(collect(pipeline, records(200)), 30)
+
+    asyncio.run(main())
+    assert not errors
+
+# The records are produced in a thread: a production blocking until the
+# first table is read doesn't block the searches
+def test_records_are_produced_in_a_thread():
+    first = threading.Event()
+
+    def items():
+        yield "orf0", "ACDEFGHIKL" * 100
+        if not first.wait(10):
+            raise TimeoutError("first table never read")
+        yield "orf1", "ACDEFGHIKL" * 100
+
+    async def main():
+        pipeline = AsyncSearchPipeline(['cat'], workers=1, shard_length=1000)
+        indexes  = []
+        async for result in pipeline.run(items()):
+            async for line in result.table:
+                pass
+            first.set()
+            indexes.append(result.index)
+        return indexes
+
+    start = time.monotonic()
+    indexes, errors = run_with_handler(main())
+    assert indexes == [0, 1]
+    assert time.monotonic() - start < 5
+    assert not errors
+
+def test_records_are_closed_when_a_search_fails():
+    closed = threading.Event()
+
+    def items():
+        try:
+            for number in itertools.count():
+                yield f"orf{number}", "ACDEFGHIKL" * 100
+        finally:
+            closed.set()
+
+    pipeline = AsyncSearchPipeline(['sh', '-c', 'cat >/dev/null; exit 3'], workers=2, shard_length=3000)
+    with pytest.raises(subprocess.CalledProcessError):
+        run_with_handler(collect(pipeline, items()))
+    assert closed.is_set()
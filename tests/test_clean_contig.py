@@ -0,0 +1,44 @@
+from masterfile.masterfile import Masterfile
+
+# cox1 keeps the comment of its start line, nad1 has none (dropped), the
+# note is a comment annotation left as is (not rewritten), rns keeps its
+# mfannot start line and the comment of its end line
+MASTERFILE = """;; header
+
+>c1 /trans=4
+; G-cox1 ==> start ;; kept comment
+     1  acgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgt
+; G-cox1 ==> end
+; G-nad1 ==> start
+    61  acgtacgtac
+; G-nad1 ==> end
+; C-note ==> start
+    71  acgtac
+; C-note ==> end ;; other comment
+; G-rns ==> start ;; mfannot: already cleaned
+    77  acgt
+; G-rns ==> end ;; last
+>c2
+; G-atp6 ==> start
+     1  acgtacgtac
+; G-atp6 ==> end
+"""
+
+def test_dropped_and_rewritten_annotations_are_counted(tmp_path):
+    filename = tmp_path / 'test.mf'
+    filename.write_text(MASTERFILE)
+    mf = Masterfile()
+    mf.object_from_masterfile(str(filename))
+    contigs = list(mf.iter_clean_pirmaster(None, mf.contigs))
+
+    assert [(stats['contig'], stats['header'], stats['dropped'], stats['rewritten']) for stats in mf.cleanstats] == [
+        ("contig1", "c1 /trans=4", 1, 2),
+        ("contig2", "c2",          1, 0),
+    ]
+    assert [(annot.type, annot.genename, annot.startline, annot.endline) for annot in contigs[0].annotations] == [
+        ("C", "cox1", ";; kept comment",                              "; G-cox1 ==> end"),
+        ("C", None,   "; C-note ==> start",                           None),
+        ("C", None,   "; C-note ==> end ;; other comment",            None),
+        ("C", "rns",  "; G-rns ==> start ;; mfannot: already cleaned", ";; last"),
+    ]
+    assert contigs[1].annotations == []
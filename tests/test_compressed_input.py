@@ -0,0 +1,78 @@
+import gzip
+import lzma
+import shutil
+
+import pytest
+
+from masterfile import masterfile
+from masterfile.masterfile import DecompressionProcess, DecompressionStream, Masterfile, open_masterfile_input
+
+TEXT = ";; header\n;; end mfannot\n\n" + "".join(
+    f">c{number}\n; G-gene{number} ==> start\n     1  {'acgt' * 100}\n; G-gene{number} ==> end\n   401  {'ttga' * 50}\n"
+    for number in range(300)
+)
+
+COMPRESS = {'gz': gzip.compress, 'xz': lzma.compress}
+
+def contig_states(filename):
+    return [
+        (contig.name, str(contig.sequence), [annot.state() for annot in contig.annotations])
+        for contig in Masterfile().object_from_masterfile(filename).contigs
+    ]
+
+@pytest.fixture
+def plain(tmp_path):
+    filename = tmp_path / 'test.mf'
+    filename.write_text(TEXT)
+    return str(filename)
+
+def compressed(tmp_path, suffix, truncated=False):
+    data     = COMPRESS[suffix](TEXT.encode())
+    filename = tmp_path / f'test.mf.{suffix}'
+    filename.write_bytes(data[:len(data) // 2] if truncated else data)
+    return str(filename)
+
+# No decompression command found
+@pytest.fixture
+def no_command(monkeypatch):
+    monkeypatch.setattr(masterfile.shutil, 'which', lambda command: None)
+
+@pytest.mark.parametrize("suffix, command", [('gz', 'gzip'), ('xz', 'xz')])
+def test_decompressed_by_a_command(tmp_path, plain, suffix, command):
+    if not shutil.which(command):
+        pytest.skip(f"no {command} command")
+    filename = compressed(tmp_path, suffix)
+    with open_masterfile_input(filename) as fh:
+        assert isinstance(fh.buffer.raw, DecompressionProcess)
+        assert fh.read() == TEXT
+    assert contig_states(filename) == contig_states(plain)
+
+@pytest.mark.parametrize("suffix", ['gz', 'xz'])
+def test_decompressed_in_process_without_a_command(tmp_path, plain, no_command, suffix):
+    filename = compressed(tmp_path, suffix)
+    with open_masterfile_input(filename) as fh:
+        assert isinstance(fh.buffer.raw, DecompressionStream)
+        assert fh.read() == TEXT
+    with open_masterfile_input(filename, 'rb') as fh:
+        assert fh.read() == TEXT.encode()
+    assert contig_states(filename) == contig_states(plain)
+
+def test_closing_early_stops_the_command(tmp_path):
+    if not shutil.which('gzip'):
+        pytest.skip("no gzip command")
+    fh = open_masterfile_input(compressed(tmp_path, 'gz'), 'rb')
+    assert fh.read(10) == TEXT[:10].encode()
+    process = fh.raw.process
+    fh.close()
+    assert process.returncode is not None
+
+@pytest.mark.parametrize("suffix", ['gz', 'xz'])
+@pytest.mark.parametrize("external", [True, False])
+def test_truncated_input_is_a_value_error(tmp_path, monkeypatch, suffix, external):
+    if not external:
+        monkeypatch.setattr(masterfile.shutil, 'which', lambda command: None)
+    elif not shutil.which({'gz': 'gzip', 'xz': 'xz'}[suffix]):
+        pytest.skip("no decompression command")
+    filename = compressed(tmp_path, suffix, truncated=True)
+    with pytest.raises(ValueError, match="Can't decompress masterfile"):
+        Masterfile().object_from_masterfile(filename)
@@ -0,0 +1,103 @@
+import gzip
+import os
+
+import pytest
+
+from masterfile.masterfile import Masterfile, contig_index_filename, read_contig_index
+
+MASTERFILE = """;; header
+
+>c1 /trans=4
+     1  acgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgt
+; G-cox1 ==> start
+    61  acgtacgtac
+; G-cox1 ==> end
+>c2
+     1  ttttggggcc
+>c3 a comment
+; G-nad1 ==> start
+     1  aaaacccc!gg
+; G-nad1 ==> end
+"""
+
+def parsed(filename):
+    return {contig.name: contig for contig in Masterfile().object_from_masterfile(filename).contigs}
+
+def contig_state(contig):
+    return (contig.name, contig.namecomments, contig.genetic_code, str(contig.sequence), [annot.state() for annot in contig.annotations])
+
+@pytest.fixture(params=['plain', 'gz'])
+def filename(request, tmp_path):
+    if request.param == 'gz':
+        filename = tmp_path / 'test.mf.gz'
+        with gzip.open(filename, 'wt') as fh:
+            fh.write(MASTERFILE)
+    else:
+        filename = tmp_path / 'test.mf'
+        filename.write_text(MASTERFILE)
+    return str(filename)
+
+def test_contigs_parsed_on_demand(filename):
+    expected = parsed(filename)
+    mf       = Masterfile()
+    mf.index_masterfile(filename)
+    assert mf.header == Masterfile().object_from_masterfile(filename).header
+    assert [entry[0] for entry in read_contig_index(filename)] == ["c1", "c2", "c3"]
+    for name in ("c3", "c1", "c2"):
+        assert contig_state(mf.get_contig_by_name(name)) == contig_state(expected[name])
+    assert mf.get_contig_by_name("c1") is mf.get_contig_by_name("c1")
+
+def test_unknown_contig(filename):
+    from masterfile.hmmer_hits import HmmerHit, attach_hits
+
+    mf = Masterfile()
+    mf.index_masterfile(filename)
+    assert mf.get_contig_by_name("c4") is None
+    assert "c4" not in mf.contigbyname
+
+    hit = HmmerHit(
+        target="orf1", query="cox1", queryaccession="-", evalue=1e-10, score=50.0, bias=0.0,
+        hmmfrom=1, hmmto=10, alifrom=1, alito=10, envfrom=1, envto=10,
+        description="source=c4 coords=1..30 length=10 frame=1",
+    )
+    with pytest.raises(ValueError, match="unknown contig 'c4'"):
+        list(attach_hits([hit], mf))
+
+def test_index_is_reused(filename):
+    Masterfile().index_masterfile(filename)
+    with open(contig_index_filename(filename)) as fh:
+        header = fh.readline()
+    os.utime(contig_index_filename(filename), ns=(1, 1))
+    Masterfile().index_masterfile(filename)
+    assert os.stat(contig_index_filename(filename)).st_mtime_ns == 1
+    with open(contig_index_filename(filename)) as fh:
+        assert fh.readline() == header
+
+# An index built for another version of the masterfile (other size, or
+# same size and other mtime) is built again
+@pytest.mark.parametrize("change", ['size', 'mtime'])
+def test_stale_index_is_rebuilt(tmp_path, change):
+    filename = str(tmp_path / 'test.mf')
+    with open(filename, 'w') as fh:
+        fh.write(MASTERFILE)
+    stat = os.stat(filename)
+    mf   = Masterfile()
+    mf.index_masterfile(filename)
+    assert str(mf.get_contig_by_name("c2").sequence) == "ttttggggcc"
+
+    # Same size: only the name of c2 changes, found by a new index only
+    if change == 'size':
+        text, name = MASTERFILE.replace("ttttggggcc", "ttttggggccaa"), "c2"
+    else:
+        text, name = MASTERFILE.replace(">c2", ">c9"), "c9"
+    with open(filename, 'w') as fh:
+        fh.write(text)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert (os.path.getsize(filename) != stat.st_size) == (change == 'size')
+
+    mf = Masterfile()
+    mf.index_masterfile(filename)
+    assert str(mf.get_contig_by_name(name).sequence) == str(parsed(filename)[name].sequence)
+    assert contig_state(mf.get_contig_by_name("c3")) == contig_state(parsed(filename)["c3"])
+    with open(contig_index_filename(filename)) as fh:
+        assert fh.readline().split('\t')[2:] == [str(os.path.getsize(filename)), f"{stat.st_mtime_ns + 10**9}\n"]
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from masterfile.contig_sequence import ContigSequence
+from masterfile.masterfile import IUPAC_TO_TN, Masterfile
+from masterfile.orf_finder import contig_orfs, find_orfs
+
+IUPAC = "uUyrwskmbdhvxYRWSKMBDHVX"
+
+def random_text(rand, length):
+    chars = [rand.choice("acgtnACGTN") for _ in range(length)]
+    for _ in range(rand.randint(0, length // 10 + 1)):
+        chars.insert(rand.randint(0, len(chars)), "!")
+    return "".join(chars)
+
+def check_sequence(seq, text):
+    bases = text.replace("!", "")
+    assert str(seq) == text
+    assert seq == text
+    assert len(seq) == len(bases)
+    assert seq.nucleotides() == bases
+    assert str(seq.upper()) == text.upper()
+    assert str(seq.without_markers()) == bases
+    assert list(seq.coordinates().markers) == list(ContigSequence.from_string(text).markers)
+
+    rand = random.Random(len(text))
+    for _ in range(50):
+        start, end = rand.randint(-5, len(bases) + 5), rand.randint(-5, len(bases) + 5)
+        assert seq[start:end] == bases[start:end]
+        assert seq.nucleotides(max(start, 0), end) == bases[max(start, 0):max(end, 0)]
+    assert seq[::3] == bases[::3]
+    for index in range(-len(bases), len(bases)):
+        assert seq[index] == bases[index]
+    with pytest.raises(IndexError):
+        seq[len(bases)]
+
+@pytest.mark.parametrize("seed", range(10))
+def test_round_trip(seed):
+    rand = random.Random(seed)
+    text = random_text(rand, rand.choice([0, 1, 3, 4, 5, 61, 500]))
+    check_sequence(ContigSequence.from_string(text), text)
+
+def test_unpacked_characters_are_rejected():
+    for char in IUPAC:
+        with pytest.raises(ValueError):
+            ContigSequence.from_string("acgt" + char)
+
+# The U and IUPAC ambiguity codes, in both cases, become T and N when
+# parsed: the same sequence whether it's kept as a str or packed
+def test_iupac_codes_parsed_alike(tmp_path):
+    text     = "acgt" + IUPAC + "!nNACGT" + IUPAC.lower() + "!!" + IUPAC.upper()
+    filename = tmp_path / 'test.mf'
+    filename.write_text(f";; header\n\n>c1\n     1  {text}\n")
+    sequences = []
+    for compact in (False, True):
+        mf = Masterfile()
+        mf.object_from_masterfile(str(filename), compact=compact)
+        sequences.append(mf.contigs[0].sequence)
+    assert isinstance(sequences[1], ContigSequence)
+    expected = text.translate(IUPAC_TO_TN)
+    assert str(sequences[0]) == expected
+    check_sequence(sequences[1], expected)
+
+# The '!' markers take no part in the translation: the ORFs of a marked
+# contig are the ones of its nucleotides, also across a marker
+def test_orfs_of_a_contig_with_markers(tmp_path):
+    rand     = random.Random(1)
+    bases    = "".join(rand.choice("acgt") for _ in range(600))
+    bases    = bases[:100] + "atg" + "gcc" * 40 + "taa" + bases[226:]
+    text     = "".join(base + ("!" if index in (0, 50, 150, 151, 300, 599) else "") for index, base in enumerate(bases))
+    filename = tmp_path / 'test.mf'
+    filename.write_text(";; header\n\n>c1\n" + "".join(
+        f"{len(text[:offset].replace('!', '')) + 1:6d}  {text[offset:offset + 60]}\n" for offset in range(0, len(text), 60)
+    ))
+
+    expected = [(orf.start, orf.end, orf.frame, orf.protein) for orf in find_orfs(bases, 1, 20, None, "c1")]
+    assert any("MAAAA" in protein and start <= 151 and end >= 152 for start, end, frame, protein in expected)
+    for compact in (False, True):
+        mf = Masterfile()
+        mf.object_from_masterfile(str(filename), compact=compact)
+        contig = mf.contigs[0]
+        assert str(contig.sequence) == text
+        assert [(orf.start, orf.end, orf.frame, orf.protein) for orf in contig_orfs(contig, 1, 20)] == expected
@@ -0,0 +1,104 @@
+import io
+import random
+import re
+
+import pytest
+
+from masterfile.annot_pair import AnnotPair
+from masterfile.contig_sequence import ContigSequence
+from masterfile.coordinate_index import CoordinateIndex
+from masterfile.masterfile import Masterfile
+
+# Random text of length nucleotides with '!' markers, some of them
+# consecutive, at the start or at the end
+def marked_text(rand, length):
+    chars = [rand.choice("acgtn") for _ in range(length)]
+    for _ in range(rand.randint(0, length // 5 + 2)):
+        chars.insert(rand.randint(0, len(chars)), "!")
+    return "".join(chars)
+
+# Linear scan oracles: offset of each nucleotide (and past the last
+# one), position of each offset
+def nucleotide_offsets(text):
+    return [index for index, char in enumerate(text) if char != "!"] + [len(text)]
+
+def offset_positions(text):
+    return [len(text[:offset].replace("!", "")) for offset in range(len(text) + 1)]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_position_offset_round_trips(seed):
+    rand  = random.Random(seed)
+    text  = marked_text(rand, rand.choice([0, 1, 5, 60, 300]))
+    index = CoordinateIndex.from_string(text)
+    assert len(index) == len(text)
+    assert index.length == len(text) - text.count("!")
+
+    offsets = nucleotide_offsets(text)
+    for pos, offset in enumerate(offsets):
+        assert index.offset(pos) == offset
+        assert index.position(offset) == pos
+        assert index.has_marker(pos) == (offset > 0 and text[offset - 1] == "!")
+    assert [index.position(offset) for offset in range(len(text) + 1)] == offset_positions(text)
+
+    nucleotides = text.replace("!", "")
+    assert index.apply(nucleotides) == text
+    assert ContigSequence.from_string(text).coordinates().markers == index.markers
+
+def test_with_markers_merges_in_order():
+    rand = random.Random(1)
+    for _ in range(20):
+        text      = marked_text(rand, 100)
+        index     = CoordinateIndex.from_string(text)
+        positions = [rand.randint(0, 100) for _ in range(5)]
+        merged    = index.with_markers(positions)
+        assert list(merged.markers) == sorted(list(index.markers) + positions)
+        expected  = text
+        for pos in sorted(positions, reverse=True):
+            offset   = nucleotide_offsets(expected)[pos]
+            expected = expected[:offset] + "!" + expected[offset:]
+        assert merged.apply(text.replace("!", "")) == expected
+
+MASTERFILE = """;; header
+
+>c1
+     1  acgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgt
+; G-cox1 ==> start
+    61  acgtacgt!acgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgt
+; G-cox1 ==> end
+   120  acgtacgtacgtacgtac
+"""
+
+# Sequence text written by contig_to_fh, checking that each line is
+# numbered with the position of its first nucleotide
+def written_sequence(text):
+    sequence = ""
+    for line in text.splitlines():
+        match = re.match(r'\s*(\d+)\s+(\S+)$', line)
+        if match:
+            assert int(match.group(1)) == len(sequence.replace("!", "")) + 1
+            sequence += match.group(2)
+    return sequence
+
+# Each AC annotation gets a start marker before its first nucleotide and
+# a stop marker after its last one, unless there's one already (the one
+# after nucleotide 68)
+@pytest.mark.parametrize("compact", [False, True])
+def test_ac_markers_are_inserted(tmp_path, compact):
+    filename = tmp_path / 'test.mf'
+    filename.write_text(MASTERFILE)
+    mf = Masterfile()
+    mf.object_from_masterfile(str(filename), compact=compact)
+    contig = mf.contigs[0]
+    for start, end in ((10, 20), (68, 100), (69, 137)):
+        contig.add_annot_pair(AnnotPair(type='AC', startpos=start, endpos=end))
+    before = str(contig.sequence)
+
+    fh = io.StringIO()
+    mf.contig_to_fh(contig, fh)
+    sequence = written_sequence(fh.getvalue())
+    index    = CoordinateIndex.from_string(sequence)
+    assert sequence.replace("!", "") == before.replace("!", "")
+    assert list(index.markers) == [9, 20, 67, 68, 100, 137]
+    for start, end in ((10, 20), (68, 100), (69, 137)):
+        assert index.has_marker(start - 1) and index.has_marker(end)
+    assert str(contig.sequence) == before
@@ -0,0 +1,90 @@
+import os
+import pickle
+
+import pytest
+
+from masterfile.masterfile import (
+    MASTERFILE_CACHE_MAGIC, Masterfile, load_masterfile_cache, masterfile_cache_filename,
+    masterfile_cache_key,
+)
+from masterfile.signed_pickle import KEY_ENVIRONMENT, secret_key
+
+MASTERFILE = """;; header
+>c1
+     1  acgtacgtac
+; G-cox1-E1 ==> start
+    11  acgtacgtac
+; G-cox1-E1 ==> end
+    21  acgtac
+>c2
+     1  ttttgggg
+"""
+
+@pytest.fixture
+def masterfile(tmp_path, cache_key):
+    filename = tmp_path / 'test.mf'
+    filename.write_text(MASTERFILE)
+    return str(filename)
+
+def parse(filename):
+    mf = Masterfile()
+    mf.object_from_masterfile(filename, cache=True)
+    return [(contig.name, contig.sequence) for contig in mf.contigs]
+
+def test_cache_round_trip(masterfile):
+    expected  = parse(masterfile)
+    cachefile = masterfile_cache_filename(masterfile)
+    assert os.stat(cachefile).st_mode & 0o077 == 0
+    assert load_masterfile_cache(cachefile, masterfile_cache_key(masterfile)) is not None
+    assert parse(masterfile) == expected
+
+def test_key_is_private(masterfile, cache_key):
+    key = secret_key()
+    assert key is not None
+    assert os.stat(cache_key).st_mode & 0o077 == 0
+    os.chmod(cache_key, 0o644)
+    assert secret_key() is None
+
+def test_unsigned_cache_is_not_unpickled(masterfile, planted):
+    expected  = parse(masterfile)
+    cachefile = masterfile_cache_filename(masterfile)
+    with open(cachefile, 'wb') as fh:
+        fh.write(MASTERFILE_CACHE_MAGIC)
+        fh.write(b'\0' * 32)
+        pickle.dump(planted(), fh)
+    assert load_masterfile_cache(cachefile, masterfile_cache_key(masterfile)) is None
+    assert parse(masterfile) == expected
+    assert not planted.unpickled
+
+def test_tampered_cache_is_not_unpickled(masterfile):
+    parse(masterfile)
+    cachefile = masterfile_cache_filename(masterfile)
+    with open(cachefile, 'r+b') as fh:
+        fh.seek(-1, os.SEEK_END)
+        last = fh.read(1)
+        fh.seek(-1, os.SEEK_END)
+        fh.write(bytes([last[0] ^ 1]))
+    assert load_masterfile_cache(cachefile, masterfile_cache_key(masterfile)) is None
+
+def test_cache_writable_by_others_is_refused(masterfile):
+    parse(masterfile)
+    cachefile = masterfile_cache_filename(masterfile)
+    os.chmod(cachefile, 0o664)
+    assert load_masterfile_cache(cachefile, masterfile_cache_key(masterfile)) is None
+
+def test_cache_hit_restores_the_statistics(masterfile):
+    parsed = Masterfile().object_from_masterfile(masterfile, cache=True)
+    cached = Masterfile().object_from_masterfile(masterfile, cache=True)
+    plain  = Masterfile().object_from_masterfile(masterfile)
+    assert parsed.stats['annotations paired'] == 1
+    assert cached.stats == parsed.stats == plain.stats
+    assert cached.linecounts == parsed.linecounts == plain.linecounts
+
+# A bare file name is taken from the current directory
+def test_relative_key_filename(masterfile, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv(KEY_ENVIRONMENT, 'relative.key')
+    assert secret_key() is not None
+    assert os.stat(tmp_path / 'relative.key').st_mode & 0o077 == 0
+    parse(masterfile)
+    assert load_masterfile_cache(masterfile_cache_filename(masterfile), masterfile_cache_key(masterfile)) is not None
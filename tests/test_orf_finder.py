@@ -0,0 +1,49 @@
+import io
+import os
+
+import pytest
+
+from masterfile.orf_finder import find_orfs, orfs_to_fh
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+def read_fasta(filename):
+    records = []
+    with open(filename) as fh:
+        for line in fh:
+            if line.startswith('>'):
+                records.append([line[1:].split()[0], ""])
+            else:
+                records[-1][1] += line.strip()
+    return records
+
+# esl_translate.fna: random contigs of 3 to 2000 nt, a few with runs of
+# N. The expected ORFs were written by Easel 0.49's esl_gencode, the
+# translation code of esl-translate, with the options in the file name
+# (code, -l minimum length, --watson/--crick), the others at their
+# defaults.
+@pytest.mark.parametrize("expected, genetic_code, minlen, strand", [
+    ("esl_translate.c1.faa",              1,  20, None),
+    ("esl_translate.c2.l5.faa",           2,  5,  None),
+    ("esl_translate.c11.l5.watson.faa",   11, 5,  'watson'),
+    ("esl_translate.c24.l5.crick.faa",    24, 5,  'crick'),
+])
+def test_orfs_match_esl_translate(expected, genetic_code, minlen, strand):
+    fh     = io.StringIO()
+    number = 1
+    for name, seq in read_fasta(os.path.join(DATA, "esl_translate.fna")):
+        number = orfs_to_fh(find_orfs(seq, genetic_code, minlen, strand, name), fh, number)
+    with open(os.path.join(DATA, expected)) as expectedfh:
+        assert fh.getvalue() == expectedfh.read()
+
+def test_contig_with_unknown_code_is_not_translated(tmp_path, capsys):
+    import HMMannot
+
+    filename = tmp_path / "test.mf"
+    filename.write_text(
+        ">c1 /trans=27\n     1  " + "atgaaacccggg" * 20 + "\n"
+        ">c2\n     1  " + "atgaaacccggg" * 20 + "\n"
+    )
+    annotated = HMMannot.annotate(str(filename), {'minorflen': 5})
+    assert [contig.name for contig in annotated.contigs] == ["contig1", "contig2"]
+    assert capsys.readouterr().err.count("no translation table for genetic code 27") == 1
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from masterfile.masterfile import PARALLEL_CHUNKS_PER_WORKER, Masterfile, contig_offsets, contig_ranges
+
+HEADER = ";; header\n;; end mfannot\n\n"
+
+def contig_text(number, length, rand):
+    lines = [f">c{number} /trans=4 ; a comment\n"]
+    for pos in range(0, length, 60):
+        if pos == 60:
+            lines.append(f"; G-gene{number} ==> start ;; note\n")
+        seq = "".join(rand.choice("acgtnry") for _ in range(min(60, length - pos)))
+        lines.append(f"{pos + 1:6d}  {'!' if pos == 120 else ''}{seq}\n")
+        if pos == 180:
+            lines.append(f"; G-gene{number} ==> end\n")
+    return "".join(lines) + "\n"
+
+def contig_state(contig):
+    return (contig.name, contig.namecomments, contig.genetic_code, str(contig.sequence), contig.source, contig.unchanged(), [annot.state() for annot in contig.annotations])
+
+def parse(filename, workers, compact):
+    mf = Masterfile()
+    mf.object_from_masterfile(filename, compact=compact, workers=workers)
+    return mf
+
+def check_parallel_parse(filename, workers=2):
+    for compact in (False, True):
+        serial   = parse(filename, None, compact)
+        parallel = parse(filename, workers, compact)
+        assert [contig_state(contig) for contig in parallel.contigs] == [contig_state(contig) for contig in serial.contigs]
+        assert parallel.header == serial.header
+        assert parallel.linecounts == serial.linecounts
+
+def test_parallel_parse_matches_serial(tmp_path):
+    rand     = random.Random(1)
+    filename = str(tmp_path / 'random.mf')
+    with open(filename, 'w') as fh:
+        fh.write(HEADER)
+        for number in range(40):
+            fh.write(contig_text(number, rand.randint(1, 600), rand))
+    assert len(contig_ranges(filename, 2 * PARALLEL_CHUNKS_PER_WORKER)) > 1
+    check_parallel_parse(filename)
+
+# Contigs of the same size in bytes: the '>' of each one falls exactly
+# on the boundary of a chunk
+def test_header_on_a_chunk_boundary(tmp_path):
+    nchunks  = 2 * PARALLEL_CHUNKS_PER_WORKER
+    contigs  = [contig_text(number, 300, random.Random(number)) for number in range(nchunks)]
+    filename = str(tmp_path / 'boundary.mf')
+    with open(filename, 'w') as fh:
+        fh.write(HEADER + "".join(contigs))
+    assert len({len(text) for text in contigs}) == 1
+
+    offsets = contig_offsets(filename)
+    assert [start for start, end in contig_ranges(filename, nchunks)] == offsets
+    check_parallel_parse(filename)
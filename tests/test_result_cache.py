@@ -0,0 +1,44 @@
+import os
+import pickle
+
+import pytest
+
+from masterfile.result_cache import ResultCache
+
+@pytest.fixture
+def cache(tmp_path, cache_key):
+    return ResultCache(str(tmp_path / 'results'))
+
+def test_round_trip(cache):
+    key = ResultCache.key('acgt', 11)
+    cache.put(key, [('orf1', 'MKV')])
+    assert os.stat(cache.entry_filename(key)).st_mode & 0o077 == 0
+    assert cache.size == os.path.getsize(cache.entry_filename(key))
+    assert ResultCache(cache.directory).get(key) == [('orf1', 'MKV')]
+
+def test_planted_entry_is_not_unpickled(cache, planted):
+    key      = ResultCache.key('acgt', 11)
+    filename = cache.entry_filename(key)
+    os.makedirs(os.path.dirname(filename))
+    with open(filename, 'wb') as fh:
+        fh.write(b'\0' * 32)
+        pickle.dump(planted(), fh)
+    cache = ResultCache(cache.directory)
+    assert cache.get(key) is None
+    assert not planted.unpickled
+    assert not os.path.exists(filename)
+
+def test_tampered_entry_is_a_miss(cache):
+    key = ResultCache.key('acgt', 11)
+    cache.put(key, 'x' * 100)
+    with open(cache.entry_filename(key), 'r+b') as fh:
+        fh.seek(-10, os.SEEK_END)
+        fh.write(b'y')
+    assert cache.get(key) is None
+    assert cache.stats()['misses'] == 1
+
+def test_entry_writable_by_others_is_a_miss(cache):
+    key = ResultCache.key('acgt', 11)
+    cache.put(key, 'value')
+    os.chmod(cache.entry_filename(key), 0o666)
+    assert cache.get(key) is None
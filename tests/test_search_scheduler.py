@@ -0,0 +1,52 @@
+import io
+import subprocess
+
+import pytest
+
+from masterfile.search_scheduler import SearchScheduler, run_command
+
+RECORDS = [(f"orf{number}", "ACDEFGHIKL" * (number + 1)) for number in range(12)]
+
+def test_piped_tables_are_read_line_by_line():
+    scheduler = SearchScheduler(['cat'], workers=3)
+    lines     = []
+    for result in scheduler.run(RECORDS):
+        assert not isinstance(result.table, str)
+        with result.table as fh:
+            lines.extend(line for line in fh if line.startswith('>'))
+    assert sorted(lines) == sorted(f">{name}\n" for name, seq in RECORDS)
+
+def test_piped_tables_are_not_spooled_to_disk(monkeypatch):
+    def spool(*args, **kwargs):
+        raise AssertionError("temporary file created")
+    monkeypatch.setattr('tempfile.TemporaryFile', spool)
+    monkeypatch.setattr('tempfile.NamedTemporaryFile', spool)
+    scheduler = SearchScheduler(['cat'], workers=2)
+    assert sum(len(result.table.read()) for result in scheduler.run(RECORDS, nshards=4)) > 0
+
+# At most `workers` searches are started ahead of the table being read
+def test_piped_searches_wait_for_the_reader():
+    started = []
+    def runner(command, input):
+        started.append(input)
+        return run_command(command, input)
+    scheduler = SearchScheduler(['cat'], workers=2, runner=runner)
+    for index, result in enumerate(scheduler.run(RECORDS, nshards=6)):
+        assert len(started) <= index + 2
+        result.table.read()
+    assert len(started) == 6
+
+def test_failing_search_raises():
+    scheduler = SearchScheduler(['sh', '-c', 'cat >/dev/null; exit 2'], workers=2)
+    with pytest.raises(subprocess.CalledProcessError):
+        list(scheduler.run(RECORDS))
+
+def test_shard_hits_streams_the_table():
+    import HMMannot
+
+    row = "orf1 - 100 cox1 - 300 1e-10 50 0 1 1 1e-12 1e-10 50 0 1 100 2 20 2 20 0.9 source=c1 coords=1..300 length=100 frame=1\n"
+    scheduler = SearchScheduler(['sh', '-c', f'cat >/dev/null; echo "# table"; printf "{row}"'], workers=1)
+    copy      = io.StringIO()
+    hits      = list(HMMannot.shard_hits(scheduler.run(RECORDS), copy))
+    assert [(hit.target, hit.query) for hit in hits] == [("orf1", "cox1")]
+    assert copy.getvalue() == "# table\n" + row
@@ -0,0 +1,92 @@
+import io
+
+import pytest
+
+from masterfile.annot_pair import AnnotPair
+from masterfile.masterfile import Masterfile
+
+MASTERFILE = """;; header
+
+
+>c1
+     1  acgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgtacgt
+; G-cox1-E1 ==> start
+    61  acgtacgtac
+; G-cox1-E1 ==> end
+    71  acgtac
+
+
+>c2
+     1  ttttggggcc
+; G-nad1 ==> start
+    11  ttttggggcc
+; G-nad1 ==> end
+    21  ttttgg
+"""
+
+@pytest.fixture
+def filename(tmp_path, cache_key):
+    filename = tmp_path / 'test.mf'
+    filename.write_text(MASTERFILE)
+    return str(filename)
+
+def parse(filename, **options):
+    mf = Masterfile()
+    mf.object_from_masterfile(filename, **options)
+    return mf
+
+def annotations(filename):
+    return {contig.name: [(a.genename, a.startpos, a.endpos) for a in contig.annotations] for contig in parse(filename).contigs}
+
+def test_unchanged_contigs_are_spliced(filename, tmp_path):
+    mf     = parse(filename)
+    output = str(tmp_path / 'out.mf')
+    mf.object_to_masterfile(output, splice=True)
+    assert mf.stats['contigs spliced'] == 2
+    assert open(output).read() == MASTERFILE
+
+def test_appended_annotation_is_written(filename, tmp_path):
+    mf     = parse(filename)
+    output = str(tmp_path / 'out.mf')
+    mf.contigs[0].annotations.append(AnnotPair(
+        type='G', genename='y', startpos=21, endpos=40, direction='==>',
+        startline='; G-y ==> start', endline='; G-y ==> end',
+    ))
+    mf.object_to_masterfile(output, splice=True)
+    assert mf.stats['contigs spliced'] == 1
+    assert ('y', 21, 40) in annotations(output)['c1']
+    assert annotations(output)['c2'] == annotations(filename)['c2']
+
+def test_edited_annotation_is_written(filename, tmp_path):
+    mf     = parse(filename)
+    output = str(tmp_path / 'out.mf')
+    mf.contigs[1].annotations[0].startpos = 5
+    mf.object_to_masterfile(output, splice=True)
+    assert mf.stats['contigs spliced'] == 1
+    assert annotations(output)['c2'] == [('nad1', 5, 20)]
+
+def test_removed_annotation_is_not_written(filename, tmp_path):
+    mf     = parse(filename)
+    output = str(tmp_path / 'out.mf')
+    del mf.contigs[1].annotations[0]
+    mf.object_to_masterfile(output, splice=True)
+    assert annotations(output)['c2'] == []
+
+def test_header_is_not_changed_by_writing(filename, tmp_path):
+    mf     = parse(filename)
+    header = list(mf.header)
+    mf.header_to_fh(io.StringIO())
+    assert mf.header == header
+    mf.object_to_masterfile(str(tmp_path / 'full.mf'))
+    mf.object_to_masterfile(str(tmp_path / 'out.mf'), splice=True)
+    assert mf.header == header
+    assert open(tmp_path / 'out.mf').read() == MASTERFILE
+
+def test_contigs_loaded_from_the_cache_are_spliced(filename, tmp_path):
+    parse(filename, cache=True)
+    mf     = parse(filename, cache=True)
+    output = str(tmp_path / 'out.mf')
+    mf.contigs[0].annotations[0].endpos = 65
+    mf.object_to_masterfile(output, splice=True)
+    assert mf.stats['contigs spliced'] == 1
+    assert annotations(output)['c1'] == [('cox1', 61, 65)]